@@ -0,0 +1,250 @@
+"""
+AsyncScheduler
+
+A Scheduler (see scheduler.py) which runs on an
+existing asyncio event loop (trollius on Python 2):
+
+ [1] the timing loop runs in a thread of its own, as
+     with Scheduler, so that the job store reads and
+     writes (loading the jobs, the next run times,
+     the claims of the clustered mode) and the waits
+     for _jobstores_lock never block the event loop
+ [2] coroutine functions are run as tasks on the
+     event loop and awaited there, without a thread;
+     the timing loop only hands their runs over to
+     the event loop
+ [3] other callables run in the thread pool or the
+     process pool, as with Scheduler
+
+at(), every(), after(), cron(), unschedule() and the
+listing of the jobs still read or write the job store
+in the thread which calls them: called from a
+coroutine, they block the event loop meanwhile (as
+does stop(), until the current pass of the timing
+loop is over).
+
+It provides the same at(), every(), after(), cron()
+and decorators as Scheduler. Unlike Scheduler, each
+AsyncScheduler has a backend of its own, bound to
+the event loop it is started on.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from apscheduler.scheduler import SchedulerAlreadyRunningError
+from scheduler import Scheduler, SchedulerNotRunningError
+from scheduler import BackendAlreadyCreatedError, _Backend
+from scheduler import _g_aps_default_sql_config
+from logutil import log_event
+from functools import partial
+import traceback
+import threading
+import time
+import logging
+
+__all__ = ('AsyncScheduler',)
+
+logger = logging.getLogger(__name__)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Event Loop Backend
+#
+# _loop : the event loop the backend is started on
+#
+# the timing loop is APScheduler's main loop (see 
+# _Backend._main_loop()), in the 'SchedulerLoop' thread,
+# which also gets the job stores ready (see 
+# _Backend._prepare_start()) before it starts; the runs
+# of the coroutine jobs are handed to the event loop with
+# call_soon_threadsafe().
+#
+def _task_result(task):
+    """
+    Returns the result of a finished job task
+    in the form expected by _Backend._job_done().
+    """
+    if task.cancelled():
+        return ('error', asyncio.CancelledError(),
+                'CancelledError: the job was cancelled\n')
+    exc = task.exception()
+    if exc is None:
+        return ('executed', task.result())
+    return ('error', exc,
+            ''.join(traceback.format_exception(
+                type(exc), exc, getattr(exc, '__traceback__', None))))
+
+
+class _AsyncBackend(_Backend):
+    """
+    _Backend which runs the coroutine jobs as 
+    tasks of an event loop.
+    """
+
+    def __init__(self, gconfig={}, **options):
+        self._loop = None
+        _Backend.__init__(self, gconfig, **options)
+
+    @property
+    def running(self):
+        return not self._stopped and self._loop is not None
+
+    def start(self, loop):
+        thread = self._thread
+        if self.running or (thread is not None and thread.is_alive()):
+            raise SchedulerAlreadyRunningError
+        self._thread = threading.Thread(target=self.__run, args=(loop,),
+                                        name='SchedulerLoop')
+        self._thread.setDaemon(self.daemonic)
+        self._thread.start()
+
+    def __run(self, loop):
+        try:
+            self._prepare_start()
+        except Exception:
+            logger.exception('The scheduler could not start on event '
+                             'loop %r', loop)
+            return
+        self._loop = loop
+        self._stopped = False
+        logger.info('Scheduler starting on event loop %r', loop)
+        self._main_loop()
+
+    def _dispatch(self, job, run_times, since=None):
+        if job.executor == 'thread' and \
+           asyncio.iscoroutinefunction(job.func):
+            loop = self._loop
+            if loop is None:
+                return
+            try:
+                loop.call_soon_threadsafe(self._launch_runs, job, run_times,
+                                          partial(self.__run_on_loop, loop))
+            except RuntimeError:
+                # the event loop is closed
+                logger.error('Runs of job "%s" missed: event loop %r is '
+                             'closed', job, loop)
+        else:
+            _Backend._dispatch(self, job, run_times, since)
+
+    def __run_on_loop(self, loop, job, run_time):
+        log_event(logger, 'run', logging.INFO, 
+                  'Running job "%s" on the event loop (scheduled at %s)',
+                  job, run_time)
+        started = time.time()
+        task = asyncio.ensure_future(job.func(*job.args, **job.kwargs),
+                                     loop=loop)
+        def done(task):
+            self._job_done(job, run_time, _task_result(task), started)
+        task.add_done_callback(done)
+
+    def shutdown(self, wait=True, shutdown_threadpool=True,
+                 close_jobstores=True):
+        running = self.running
+        _Backend.shutdown(self, wait, shutdown_threadpool, close_jobstores)
+        if running:
+            # the running coroutine jobs are not cancelled
+            self._loop = None
+#
+# End of Event Loop Backend
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# AsyncScheduler Class
+#
+class AsyncScheduler(Scheduler):
+    """
+    A Scheduler which runs on an asyncio event loop.
+
+    Coroutine functions given to at(), every(),
+    after() and cron() (or their decorators) run
+    on the event loop; other callables run as they
+    do with Scheduler.
+    """
+
+    def __init__(self, aps_config={}, backend_factory=None, loop=None):
+        """
+        loop : event loop to run on, unless another
+               one is given to start() [default:
+               asyncio.get_event_loop() on start()]
+        """
+        self.__loop = loop
+        self.__aps = None
+        self.__aps_factory = _AsyncBackend
+        self.__aps_config = dict(_g_aps_default_sql_config)
+        self.__aps_lock = threading.Lock()
+        Scheduler.__init__(self, aps_config, backend_factory)
+
+    def _backend(self):
+        """
+        Returns the backend of this AsyncScheduler,
+        creating it if this is the first use.
+        """
+        if self.__aps is None:
+            self.__aps_lock.acquire()
+            try:
+                if self.__aps is None:
+                    self.__aps = self.__aps_factory(self.__aps_config)
+            finally:
+                self.__aps_lock.release()
+        return self.__aps
+
+    def configure(self, aps_config={}, backend_factory=None):
+        """
+        Same as Scheduler.configure(), for the
+        backend of this AsyncScheduler.
+        """
+        self.__aps_lock.acquire()
+        try:
+            if self.__aps is None:
+                if backend_factory:
+                    self.__aps_factory = backend_factory
+                self.__aps_config.update(aps_config)
+                return
+        finally:
+            self.__aps_lock.release()
+
+        if self.__aps.running:
+            raise SchedulerAlreadyRunningError
+        if backend_factory:
+            raise BackendAlreadyCreatedError
+        if aps_config:
+            self.__aps.configure(aps_config)
+
+    def start(self, loop=None):
+        """
+        Start the Scheduler on the given event loop;
+        its coroutine jobs run once the event loop 
+        runs. Does not block, whatever 
+        apscheduler.standalone is: the job stores are
+        loaded by the thread of the timing loop.
+        """
+        if self._backend().running:
+            raise SchedulerAlreadyRunningError
+        self._backend().start(loop or self.__loop or
+                              asyncio.get_event_loop())
+
+    def stop(self):
+        """
+        Stop the Scheduler. Does not wait for the
+        running jobs, so that it does not block
+        the event loop but for the end of the 
+        current pass of the timing loop.
+        """
+        if not self.is_running():
+            raise SchedulerNotRunningError
+        self.__aps.shutdown(wait=False)
+
+    def is_running(self):
+        """
+        Scheduler is running or not.
+        """
+        return self.__aps is not None and self.__aps.running
+#
+# End of AsyncScheduler Class
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
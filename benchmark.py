@@ -0,0 +1,465 @@
+"""
+Benchmark
+
+Benchmarks for the Scheduler (see scheduler.py).
+Each benchmark prints its results as one JSON
+object per line, so that they can be collected
+and compared between runs.
+
+ [1] startup : cost of importing scheduler.py and
+               creating a Scheduler, which must not
+               depend on the job store; and the cost
+               of the first use, which creates it.
+ [2] wakeup  : cost of one wakeup of the main loop
+               with 1k, 100k and 1M scheduled jobs.
+ [3] api     : rates of adding and unscheduling jobs,
+               firing throughput, fire time lag and
+               memory per job, through the Scheduler
+               API, with 1k, 100k and 1M scheduled
+               jobs in the memory job store and in a
+               SQLite stand-in for Framework_Jobs.
+ [4] cadence : distribution of the fire time lag of
+               jobs running every 100 and 250 ms, with
+               the precise wakeup of the main loop (see
+               clock.py) and with threading.Event.
+
+usage: python benchmark.py [benchmark[:size,size...] ...]
+"""
+
+from datetime import datetime, timedelta
+import subprocess
+import threading
+import tempfile
+import shutil
+import time
+import json
+import sys
+import os
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Startup
+#
+# __startup_repeat : number of fresh interpreters
+#                    to measure [default: 5]
+#
+# the import is measured in a fresh interpreter each
+# time; the first use points the default job store at
+# an in-memory SQLite database, so the numbers do not
+# depend on a running MySQL server.
+#
+__startup_repeat = 5
+
+_g_startup_script = '''
+import json, sys, time
+from datetime import datetime, timedelta
+t0 = time.time()
+import scheduler
+t1 = time.time()
+sched = scheduler.Scheduler()
+t2 = time.time()
+created = scheduler.Scheduler._Scheduler__aps is not None
+sqlalchemy = 'sqlalchemy' in sys.modules
+sched.configure({'apscheduler.jobstore.default.url': 'sqlite://'})
+sched.at(lambda: None, datetime.now() + timedelta(days=1))
+t3 = time.time()
+print(json.dumps({'import': t1 - t0, 'construct': t2 - t1,
+                  'first_use': t3 - t2,
+                  'backend_created_on_import': created,
+                  'sqlalchemy_imported_on_import': sqlalchemy}))
+'''
+
+
+def bench_startup(repeat=__startup_repeat):
+    """
+    Measures the startup cost of the scheduler,
+    each run in a fresh interpreter.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       _g_startup_script], cwd=here)
+        runs.append(json.loads(out.decode('utf-8').strip().splitlines()[-1]))
+
+    result = {'benchmark': 'startup', 'runs': len(runs)}
+    for key in ('import', 'construct', 'first_use'):
+        values = sorted(run[key] for run in runs)
+        result[key + '_min'] = values[0]
+        result[key + '_median'] = values[len(values) // 2]
+    for key in ('backend_created_on_import',
+                'sqlalchemy_imported_on_import'):
+        result[key] = any(run[key] for run in runs)
+    return result
+#
+# End of Startup
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Wakeup
+#
+# __wakeup_sizes : numbers of scheduled jobs
+#                  [default: 1k, 100k and 1M]
+# __wakeup_ticks : number of wakeups measured
+#                  per size [default: 100]
+# __wakeup_scan_budget : seconds to spend measuring 
+#                  APScheduler's own (scanning) 
+#                  main loop [default: 10]
+#
+# all the jobs are an hour away except one job which 
+# runs every second; every wakeup moves the clock one 
+# second forward, so exactly one job is due. The jobs 
+# are submitted to a thread pool which drops them.
+#
+__wakeup_sizes = (1000, 100000, 1000000)
+__wakeup_ticks = 100
+__wakeup_scan_budget = 10
+
+
+class _NullThreadPool(object):
+    """
+    Thread pool which does not run anything.
+    """
+    def submit(self, func, *args, **kwargs):
+        pass
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def _noop():
+    pass
+
+
+def _memory_backend(size, now):
+    """
+    Returns a backend (not started) with 'size' jobs 
+    in a memory job store, one of them due every second.
+    """
+    from apscheduler.triggers import IntervalTrigger
+    from scheduler import _Backend
+    from jobstore import MemoryJobStore
+
+    backend = _Backend()
+    backend.add_jobstore(MemoryJobStore(), 'default', True)
+    backend._threadpool = _NullThreadPool()
+
+    later = IntervalTrigger(timedelta(days=1), now + timedelta(hours=1))
+    jobs = [backend.make_job(later, _noop, name='later')
+            for _ in range(size - 1)]
+    every = IntervalTrigger(timedelta(seconds=1), now)
+    jobs.append(backend.make_job(every, _noop, name='every'))
+    backend._real_add_jobs(jobs, False)
+    return backend
+
+
+def bench_wakeup(sizes=__wakeup_sizes, ticks=__wakeup_ticks):
+    """
+    Measures the cost of one wakeup (finding and 
+    starting the due jobs) using the due-job heap, 
+    and using APScheduler's scan of all the jobs.
+    """
+    from apscheduler.scheduler import Scheduler as APScheduler
+
+    results = []
+    for size in sizes:
+        now = datetime.now()
+        backend = _memory_backend(size, now)
+
+        start = time.time()
+        for tick in range(ticks):
+            backend._process_jobs(now + timedelta(seconds=tick))
+        heap = (time.time() - start) / ticks
+
+        scans = 0
+        start = time.time()
+        while scans < ticks and \
+              time.time() - start < __wakeup_scan_budget:
+            tick = ticks + scans
+            APScheduler._process_jobs(backend, now + timedelta(seconds=tick))
+            scans += 1
+        scan = (time.time() - start) / scans
+
+        results.append({'benchmark': 'wakeup', 'jobs': size, 
+                        'heap_wakeup_us': heap * 1e6, 
+                        'scan_wakeup_us': scan * 1e6,
+                        'scan_wakeups': scans})
+        del backend
+    return results
+#
+# End of Wakeup
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Scheduler API
+#
+# __api_sizes  : numbers of scheduled jobs
+#                [default: 1k, 100k and 1M]
+# __api_stores : job stores [default: memory, sqlite]
+# __api_fires  : number of jobs fired together, on top
+#                of the scheduled jobs [default: 10k]
+# __api_unschedule : max number of jobs unscheduled
+#                one by one, at most a tenth of 
+#                them [default: 1k]
+#
+# each run is done in a fresh interpreter, as the
+# Scheduler backend is shared by the whole process.
+# The scheduled jobs are due in 1 to 2 days; the
+# fired jobs are all due at the same time, and
+# record how late they start (the lag).
+#
+__api_sizes = (1000, 100000, 1000000)
+__api_stores = ('memory', 'sqlite')
+__api_fires = 10000
+__api_unschedule = 1000
+
+_g_api_script = '''
+import benchmark, sys
+benchmark._api_run(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]),
+                   int(sys.argv[4]))
+'''
+
+# start times of the fired jobs, minus their run times
+_g_lags = []
+_g_fired = threading.Event()
+_g_fire_count = [0]
+
+
+def _record(run_time):
+    _g_lags.append(time.time() - run_time)
+    if len(_g_lags) == _g_fire_count[0]:
+        _g_fired.set()
+
+
+def _rss():
+    """
+    Resident set size of this process, in bytes.
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def _api_run(store, size, fires, unschedule):
+    """
+    Runs the Scheduler API benchmark with the given
+    job store and sizes; prints the results.
+    """
+    from scheduler import Scheduler, _Backend
+    from apscheduler.events import EVENT_JOB_MISSED
+
+    config = {'apscheduler.standalone': False}
+    factory = None
+    tmpdir = tempfile.mkdtemp()
+    if store == 'sqlite':
+        config['apscheduler.jobstore.default.url'] = \
+            'sqlite:///%s' % os.path.join(tmpdir, 'jobs.db')
+    else:
+        # no persistent job store, start() adds a memory one
+        def factory(config):
+            return _Backend(dict((key, value) for key, value
+                                 in config.items() if not
+                                 key.startswith('apscheduler.jobstore.')))
+
+    result = {'benchmark': 'api', 'store': store, 'jobs': size}
+    try:
+        sched = Scheduler(config, factory)
+        sched.start()
+        missed = []
+        sched._backend().add_listener(missed.append, EVENT_JOB_MISSED)
+
+        # add
+        later = datetime.now() + timedelta(days=1)
+        rss = _rss()
+        start = time.time()
+        with sched.batch():
+            for i in range(size):
+                sched.at(_noop, later + timedelta(seconds=i % 86400),
+                         name='bulk')
+        elapsed = time.time() - start
+        result['add_per_s'] = size / elapsed
+        result['bytes_per_job'] = (_rss() - rss) / float(size)
+
+        # fire, all at once, once they are all added
+        _g_fire_count[0] = fires
+        run_time = time.time() + 1 + 2 * fires * elapsed / size
+        with sched.batch():
+            for i in range(fires):
+                sched.at(_record, datetime.fromtimestamp(run_time),
+                         args=[run_time], name='fire',
+                         misfire_grace_time=3600)
+        _g_fired.wait(max(run_time - time.time(), 0) + 60 + fires / 100.0)
+        lags = sorted(_g_lags)
+        result['fires'] = len(lags)
+        result['fires_missed'] = len(missed)
+        if lags:
+            result['fire_per_s'] = len(lags) / max(lags[-1], 1e-6)
+            for percent in (50, 90, 99):
+                result['lag_ms_p%d' % percent] = \
+                    _percentile(lags, percent) * 1e3
+            result['lag_ms_max'] = lags[-1] * 1e3
+
+        # unschedule, one by one and then all the rest together
+        jobs = sched.get_scheduled_jobs()[:min(unschedule, size // 10)]
+        start = time.time()
+        for job in jobs:
+            sched.unschedule(job=job)
+        result['unschedule_per_s'] = len(jobs) / (time.time() - start)
+        start = time.time()
+        count = sched.unschedule_where(name_prefix='bulk')
+        result['unschedule_where_per_s'] = count / (time.time() - start)
+        sched.stop()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    print(json.dumps(result))
+
+
+def bench_api(sizes=__api_sizes, stores=__api_stores, fires=__api_fires,
+              unschedule=__api_unschedule):
+    """
+    Measures the Scheduler API with each of the
+    job stores and sizes, each in a fresh interpreter.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for store in stores:
+        for size in sizes:
+            out = subprocess.check_output([sys.executable, '-c',
+                                           _g_api_script, store, str(size),
+                                           str(fires), str(unschedule)],
+                                          cwd=here)
+            results.append(json.loads(out.decode('utf-8').strip().
+                                      splitlines()[-1]))
+    return results
+#
+# End of Scheduler API
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Cadence
+#
+# __cadence_sizes    : intervals of the jobs, in ms
+#                      [default: 100 and 250]
+# __cadence_jobs     : number of jobs with that
+#                      interval [default: 4]
+# __cadence_duration : seconds the jobs run
+#                      [default: 10]
+#
+# each run is done in a fresh interpreter, in the
+# memory job store, once with apscheduler.wakeup.precise
+# and once without. The jobs start on the same fire 
+# times; the lag of a fire is how late it starts after
+# the last of them, and the missed fires are counted.
+# The thread pool keeps one core thread per job.
+#
+__cadence_sizes = (100, 250)
+__cadence_jobs = 4
+__cadence_duration = 10
+
+_g_cadence_script = '''
+import benchmark, sys
+benchmark._cadence_run(int(sys.argv[1]), int(sys.argv[2]), 
+                       float(sys.argv[3]), sys.argv[4] == 'True')
+'''
+
+
+def _fire(starts):
+    starts.append(time.time())
+
+
+def _cadence_run(interval, jobs, duration, precise):
+    """
+    Runs the cadence benchmark with the given interval
+    (in ms) and wakeup; prints the results.
+    """
+    from scheduler import Scheduler, _Backend
+
+    def factory(config):
+        return _Backend(dict((key, value) for key, value
+                             in config.items() if not
+                             key.startswith('apscheduler.jobstore.')))
+
+    config = {'apscheduler.standalone': False,
+              'apscheduler.wakeup.precise': precise,
+              'apscheduler.threadpool.core_threads': jobs}
+    sched = Scheduler(config, factory)
+    sched.start()
+    first = int(time.time()) + 2
+    starts = []
+    for i in range(jobs):
+        sched.every(_fire, milliseconds=interval, args=[starts],
+                    start_date=datetime.fromtimestamp(first),
+                    misfire_grace_time=3600)
+    time.sleep(first + duration - time.time())
+    sched.stop()
+
+    step = interval / 1e3
+    lags = sorted((start - first) % step for start in starts
+                  if start < first + duration)
+    expected = jobs * int(duration / step)
+    result = {'benchmark': 'cadence', 'interval_ms': interval,
+              'jobs': jobs, 'precise': precise, 'fires': len(lags),
+              'fires_missed': max(expected - len(lags), 0)}
+    if lags:
+        for percent in (50, 90, 99):
+            result['lag_ms_p%d' % percent] = \
+                _percentile(lags, percent) * 1e3
+        result['lag_ms_max'] = lags[-1] * 1e3
+    print(json.dumps(result))
+
+
+def bench_cadence(sizes=__cadence_sizes, jobs=__cadence_jobs,
+                  duration=__cadence_duration):
+    """
+    Measures the fire time lag of sub-second jobs, 
+    with and without the precise wakeup, each in a 
+    fresh interpreter.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for interval in sizes:
+        for precise in (True, False):
+            out = subprocess.check_output([sys.executable, '-c',
+                                           _g_cadence_script, str(interval),
+                                           str(jobs), str(duration),
+                                           str(precise)], cwd=here)
+            results.append(json.loads(out.decode('utf-8').strip().
+                                      splitlines()[-1]))
+    return results
+#
+# End of Cadence
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+_g_benchmarks = {
+    'api': bench_api,
+    'cadence': bench_cadence,
+    'startup': bench_startup,
+    'wakeup': bench_wakeup,
+}
+
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:] or sorted(_g_benchmarks):
+        name, _, sizes = arg.partition(':')
+        if name not in _g_benchmarks:
+            sys.exit('unknown benchmark "%s", choose from: %s' %
+                     (name, ', '.join(sorted(_g_benchmarks))))
+        if sizes:
+            sizes = [int(size) for size in sizes.split(',')]
+            results = _g_benchmarks[name](sizes)
+        else:
+            results = _g_benchmarks[name]()
+        if isinstance(results, dict):
+            results = [results]
+        for result in results:
+            print(json.dumps(result, sort_keys=True))
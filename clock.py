@@ -0,0 +1,173 @@
+"""
+Clock
+
+The clock and the wakeup of the Scheduler's main loop
+(see scheduler.py):
+
+ [1] monotonic()  : seconds of a clock which never goes
+                    back, for timeouts; time.monotonic()
+                    where there is one, else the POSIX
+                    CLOCK_MONOTONIC (through ctypes), else
+                    time.time()
+ [2] PreciseEvent : stands in for the threading.Event
+                    which wakes up the main loop; its
+                    wait() returns at its timeout within a
+                    fraction of a millisecond, and as soon
+                    as it is set
+
+threading.Event.wait() of Python 2 times out on the
+wall clock, and sees set() with sleeps of up to 50 ms
+(the wakeup for a job added, or a retry, comes that
+late); PreciseEvent waits in select() on a pipe
+instead, written to by set().
+"""
+
+import threading
+import select
+import errno
+import time
+import os
+
+__all__ = ('monotonic', 'PreciseEvent')
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Monotonic Clock
+#
+# _g_clock_monotonic : CLOCK_MONOTONIC of clock_gettime(),
+#                      same value on Linux and the BSDs
+#
+_g_clock_monotonic = 1
+
+
+def _posix_monotonic():
+    """
+    Returns monotonic() from clock_gettime(), or
+    None where it cannot be loaded.
+    """
+    try:
+        import ctypes
+        import ctypes.util
+    except ImportError:
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    for name in ('rt', 'c'):
+        path = ctypes.util.find_library(name)
+        if path is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        break
+    else:
+        return None
+
+    def monotonic():
+        spec = timespec()
+        if clock_gettime(_g_clock_monotonic, ctypes.byref(spec)) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+    try:
+        monotonic()
+    except OSError:
+        return None
+    return monotonic
+
+try:
+    from time import monotonic
+except ImportError:
+    monotonic = _posix_monotonic() or time.time
+#
+# End of Monotonic Clock
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Precise Event
+#
+# spin : seconds; the last part of a timeout is spent
+#        polling monotonic() instead of in select(),
+#        for fire times within a few microseconds, at
+#        the cost of a busy thread [default: 0]
+#
+# the pipe holds one byte while the event is set.
+#
+class PreciseEvent(object):
+    """
+    threading.Event whose wait() sleeps in select(),
+    to the timeout on a monotonic clock.
+    """
+
+    def __init__(self, spin=0):
+        self.spin = float(spin)
+        self.__lock = threading.Lock()
+        self.__flag = False
+        self.__read, self.__write = os.pipe()
+
+    def is_set(self):
+        return self.__flag
+
+    isSet = is_set
+
+    def set(self):
+        self.__lock.acquire()
+        try:
+            if not self.__flag:
+                self.__flag = True
+                os.write(self.__write, b'x')
+        finally:
+            self.__lock.release()
+
+    def clear(self):
+        self.__lock.acquire()
+        try:
+            if self.__flag:
+                self.__flag = False
+                os.read(self.__read, 1)
+        finally:
+            self.__lock.release()
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            while not self.__flag:
+                self.__select(None)
+            return True
+
+        deadline = monotonic() + timeout
+        while not self.__flag:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            if remaining > self.spin:
+                self.__select(remaining - self.spin)
+            else:
+                # let the other threads run meanwhile
+                time.sleep(0)
+        return self.__flag
+
+    def __select(self, timeout):
+        try:
+            select.select([self.__read], [], [], timeout)
+        except (select.error, OSError, IOError) as e:
+            # interrupted by a signal: wait again
+            if e.args[0] != errno.EINTR:
+                raise
+
+    def close(self):
+        """
+        Closes the pipe; the event cannot be used
+        afterwards.
+        """
+        os.close(self.__read)
+        os.close(self.__write)
+#
+# End of Precise Event
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,106 @@
+"""
+Cluster
+
+Clustered mode of the Scheduler (see scheduler.py):
+several processes (nodes) share the jobs of one
+FrameworkJobStore table (see jobstore.py), and each
+fire time of a job is run by one node only.
+
+ [1] claims : a node starts a due job only once it has
+     claimed the job row, with a single UPDATE which
+     sets a lease (lease_owner, lease_expires) and
+     succeeds only if the row still has the runs count
+     the node knows of and no other node holds a live
+     lease on it. runs is increased on every fire, so
+     it is the version of the row. Once the runs are
+     started, the node stores the next run time and
+     releases the lease in one UPDATE. The job of a
+     node which dies holding a lease is claimed by
+     another node when the lease expires.
+ [2] spread : each fire time belongs to one of the live
+     nodes, by rendezvous hashing of (job id, runs);
+     the other nodes claim it only after the handoff
+     delay, in case that node is gone or late.
+ [3] sync   : every node records a heartbeat in the
+     <tablename>_nodes table, and loads the jobs added,
+     removed or fired by the other nodes, every
+     sync_interval: the rows written since its previous
+     sync (by their indexed updated_at) and the ids in
+     the <tablename>_removed table, not the whole table.
+
+The clocks of the nodes must be in sync. A run is not
+started again if its node dies while running it; runs
+taken over after a lease expired are subject to the
+misfire_grace_time of their job.
+"""
+
+from datetime import timedelta
+import hashlib
+import socket
+import os
+
+__all__ = ('Cluster',)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Cluster
+#
+# node          : name of this node, unique in the
+#                 cluster [default: hostname:pid]
+# lease_time    : seconds a claim holds a job [default: 30]
+# handoff       : seconds the other nodes wait before
+#                 claiming a fire time [default: 1]
+# sync_interval : seconds between two heartbeats (and
+#                 loads of the jobs of the other nodes)
+#                 [default: 5]; a node without a heartbeat
+#                 for 3 sync_intervals is not live
+# sync_overlap  : seconds; a sync reads the rows written
+#                 since that long before the previous 
+#                 one, for the writes committed meanwhile
+#                 and the clock skew of the nodes
+#                 [default: 2]
+#
+class Cluster(object):
+    """
+    The node of this process and the live nodes of
+    the cluster, as last seen in the job store.
+    """
+
+    def __init__(self, node=None, lease_time=30, handoff=1,
+                 sync_interval=5, sync_overlap=2):
+        self.node = node or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.lease_time = timedelta(seconds=float(lease_time))
+        self.handoff = timedelta(seconds=float(handoff))
+        self.sync_interval = float(sync_interval)
+        self.sync_overlap = timedelta(seconds=float(sync_overlap))
+        self.nodes = (self.node,)
+
+    def set_nodes(self, nodes):
+        """
+        Sets the live nodes, this one included.
+        """
+        nodes = set(nodes)
+        nodes.add(self.node)
+        self.nodes = tuple(sorted(nodes))
+
+    def heartbeat_expiry(self, now):
+        return now + timedelta(seconds=3 * self.sync_interval)
+
+    def owner(self, jobid, runs):
+        """
+        Returns the node which claims the next fire time
+        of the given job first; the same on all the nodes
+        which see the same live nodes.
+        """
+        def weight(node):
+            key = '%s|%s|%s' % (node, jobid, runs)
+            return hashlib.md5(key.encode('utf-8')).digest()
+        return max(self.nodes, key=weight)
+
+    def __repr__(self):
+        return '<%s (node=%s, %d live nodes)>' % \
+               (self.__class__.__name__, self.node, len(self.nodes))
+#
+# End of Cluster
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
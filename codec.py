@@ -0,0 +1,186 @@
+"""
+Codec
+
+Compact encoding of the jobs of FrameworkJobStore
+(see jobstore.py), instead of pickling the whole
+trigger, args, kwargs and options of every job:
+
+ [1] values   : args, kwargs and options are stored as
+                a format byte and the encoded value;
+                values of the built-in types (str, int,
+                list, dict, ...) are marshalled, which
+                is smaller and quicker to load than a
+                pickle; other values are pickled
+ [2] triggers : date, interval and cron triggers are
+                stored in the trigger_kind, trigger_date
+                and trigger_spec columns; other triggers
+                are pickled in the trigger column
+ [3] lazy     : the args and kwargs of a loaded job are
+                decoded when the job first needs them,
+                that is when it runs
+
+Rows written before this encoding (plain pickles, no
+format byte, no trigger_kind) are loaded as they are.
+"""
+
+from apscheduler.triggers.simple import SimpleTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.cron import CronTrigger
+from cronexpr import CompiledCronTrigger, make_cron_trigger
+from datetime import timedelta
+import marshal
+import pickle
+
+__all__ = ('Encoded', 'encode_value', 'decode_value',
+           'encode_trigger', 'decode_trigger')
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Values
+#
+# format bytes; a pickle starts with another byte
+# (0x80 for the protocol 2 pickles of older rows)
+#
+_g_marshal = b'\x01'
+_g_pickle = b'\x02'
+_g_marshal_version = 2
+
+_g_plain_types = frozenset((str, unicode, int, long, float, bool,
+                            type(None)))
+
+
+def _is_plain(value):
+    # marshal keeps the built-in types only: a subclass
+    # (of str, for instance) would come back as its base
+    kind = type(value)
+    if kind in _g_plain_types:
+        return True
+    if kind is list or kind is tuple:
+        return all(_is_plain(item) for item in value)
+    if kind is dict:
+        return all(_is_plain(key) and _is_plain(item)
+                   for key, item in value.items())
+    return False
+
+
+def encode_value(value):
+    """
+    Returns the given value as a format byte
+    followed by its encoding.
+    """
+    if _is_plain(value):
+        return _g_marshal + marshal.dumps(value, _g_marshal_version)
+    return _g_pickle + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode_value(data):
+    """
+    Returns the value encoded by encode_value(),
+    or by pickle for the rows of older versions.
+    """
+    data = bytes(data)
+    tag = data[:1]
+    if tag == _g_marshal:
+        return marshal.loads(data[1:])
+    if tag == _g_pickle:
+        return pickle.loads(data[1:])
+    return pickle.loads(data)
+
+
+class Encoded(object):
+    """
+    A value stored by encode_value(), decoded
+    on the first call to decode().
+    """
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def decode(self):
+        return decode_value(self.data)
+
+    def __repr__(self):
+        return '<%s (%d bytes)>' % (self.__class__.__name__, len(self.data))
+#
+# End of Values
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Triggers
+#
+# trigger_kind : 'date', 'interval' or 'cron', None
+#                for a pickled trigger
+# trigger_date : run date of a date trigger, start
+#                date of the others
+# trigger_spec : interval in seconds (interval) or the
+#                given fields (cron), as in
+#                'minute=*/5;second=0'
+#
+_g_cron_fields = CronTrigger.FIELD_NAMES
+
+
+def _interval_spec(interval):
+    seconds = interval.days * 86400 + interval.seconds
+    if interval.microseconds:
+        return '%d.%06d' % (seconds, interval.microseconds)
+    return '%d' % seconds
+
+
+def _parse_interval(spec):
+    seconds, _, microseconds = spec.partition('.')
+    return timedelta(seconds=int(seconds),
+                     microseconds=int(microseconds or 0))
+
+
+def _cron_fields(trigger):
+    # the given (not defaulted) fields, by name
+    if isinstance(trigger, CompiledCronTrigger):
+        return [(name, expr) for name, expr, default in
+                zip(_g_cron_fields, trigger.spec.exprs, trigger.defaults)
+                if not default]
+    return [(field.name, str(field)) for field in trigger.fields
+            if not field.is_default]
+
+
+def encode_trigger(trigger):
+    """
+    Returns the (trigger, trigger_kind, trigger_date,
+    trigger_spec) columns of the given trigger.
+    """
+    kind = type(trigger)
+    if kind is SimpleTrigger:
+        return b'', 'date', trigger.run_date, None
+    if kind is IntervalTrigger:
+        return (b'', 'interval', trigger.start_date,
+                _interval_spec(trigger.interval))
+    if kind is CompiledCronTrigger or kind is CronTrigger:
+        spec = ';'.join('%s=%s' % field for field in _cron_fields(trigger))
+        if len(spec) <= 1024:
+            return b'', 'cron', trigger.start_date, spec
+    return (pickle.dumps(trigger, pickle.HIGHEST_PROTOCOL),
+            None, None, None)
+
+
+def decode_trigger(data, kind, date, spec):
+    """
+    Returns the trigger stored by encode_trigger().
+    """
+    if kind is None:
+        return pickle.loads(bytes(data))
+    if kind == 'date':
+        return SimpleTrigger(date)
+    if kind == 'interval':
+        return IntervalTrigger(_parse_interval(spec), date)
+    if kind == 'cron':
+        fields = dict(field.split('=', 1) for field in spec.split(';')
+                      if field)
+        return make_cron_trigger(start_date=date, **fields)
+    raise ValueError('Unknown trigger kind: %s' % kind)
+#
+# End of Triggers
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
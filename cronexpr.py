@@ -0,0 +1,500 @@
+"""
+CronExpr
+
+Compiled cron expressions for Scheduler.cron() (see scheduler.py).
+
+Each field of an expression is parsed once into a bitmask of the
+values it matches; identical expressions are interned, so all the
+jobs using them share one compiled expression. The fire times are
+found by jumping from one set bit to the next in each field, instead
+of walking the fields forward one value at a time.
+
+The expressions follow APScheduler's CronTrigger, except for the
+'last' and '<nth> <weekday>' day expressions; make_cron_trigger()
+falls back to CronTrigger (PlainCronTrigger) for those. The second field may also be
+fractional ('30.5', '*/0.25', '10-20/1.5'), which CronTrigger is not.
+"""
+
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import convert_to_datetime, datetime_ceil
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from itertools import islice
+import threading
+import weakref
+import re
+
+__all__ = ('CompiledCronTrigger', 'PlainCronTrigger',
+           'UnsupportedExpression', 'make_cron_trigger')
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Fields
+#
+# same names, order, limits and defaults as CronTrigger
+#
+_g_field_names = ('year', 'month', 'day', 'week', 'day_of_week',
+                  'hour', 'minute', 'second')
+_g_min_values = {'year': 1970, 'month': 1, 'day': 1, 'week': 1,
+                 'day_of_week': 0, 'hour': 0, 'minute': 0, 'second': 0}
+_g_max_values = {'year': 9999, 'month': 12, 'day': 31, 'week': 53,
+                 'day_of_week': 6, 'hour': 23, 'minute': 59, 'second': 59}
+_g_default_values = {'year': '*', 'month': 1, 'day': 1, 'week': '*',
+                     'day_of_week': '*', 'hour': 0, 'minute': 0,
+                     'second': 0}
+
+_g_weekdays = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+_g_all_re = re.compile(r'\*(?:/(?P<step>\d+))?$')
+_g_range_re = re.compile(
+    r'(?P<first>\d+)(?:-(?P<last>\d+))?(?:/(?P<step>\d+))?$')
+_g_weekday_re = re.compile(r'(?P<first>[a-z]+)(?:-(?P<last>[a-z]+))?$',
+                           re.IGNORECASE)
+
+# the second field with fractions; its values are kept
+# in microseconds, a range without a step is one value
+# per second
+_g_fraction_re = re.compile(
+    r'(?:(?P<all>\*)|(?P<first>\d+(?:\.\d*)?)(?:-(?P<last>\d+(?:\.\d*)?))?)'
+    r'(?:/(?P<step>\d+(?:\.\d*)?|\.\d+))?$')
+_g_second_us = 1000000
+
+# stop looking for a fire time after this many years without one
+_g_max_empty_years = 2000
+
+
+class UnsupportedExpression(ValueError):
+    """
+    Raised when a field expression is valid for
+    CronTrigger but cannot be compiled to a bitmask.
+    """
+
+
+def _parse_field(name, exprs):
+    """
+    Parses the expressions of one field into a list
+    of (first, last, step) ranges; last is None for
+    an open ended range.
+    """
+    ranges = []
+    for expr in str(exprs).strip().split(','):
+        expr = expr.strip()
+        match = _g_all_re.match(expr)
+        if match:
+            first, last, step = _g_min_values[name], None, match.group('step')
+        else:
+            match = _g_range_re.match(expr)
+            if match:
+                first, last, step = match.group('first', 'last', 'step')
+                if last is None and step is None:
+                    last = first
+            elif name == 'day_of_week' and _g_weekday_re.match(expr):
+                first, last = _g_weekday_re.match(expr).group('first', 'last')
+                first, last = _weekday(first), _weekday(last or first)
+                step = None
+            elif name == 'day':
+                raise UnsupportedExpression('Expression "%s" of field "%s" '
+                                            'cannot be compiled' % (expr, name))
+            else:
+                raise ValueError('Unrecognized expression "%s" for field "%s"'
+                                 % (expr, name))
+
+        first = int(first)
+        last = last if last is None else int(last)
+        step = int(step or 1)
+        if step == 0:
+            raise ValueError('Increment must be higher than 0')
+        highest = first if last is None else last
+        if highest > _g_max_values[name]:
+            raise ValueError('Value %d of field "%s" is higher than its '
+                             'maximum, %d' % (highest, name,
+                                              _g_max_values[name]))
+        if last is not None and first > last:
+            raise ValueError('The minimum value in a range must not be '
+                             'higher than the maximum')
+        ranges.append((max(first, _g_min_values[name]), last, step))
+    return ranges
+
+
+def _parse_fractions(exprs):
+    """
+    Parses the expressions of a second field with
+    fractions into second -> sorted microseconds 
+    within that second; None if it has no fraction.
+    """
+    if '.' not in str(exprs):
+        return None
+    maxval = (_g_max_values['second'] + 1) * _g_second_us - 1
+    fractions = {}
+    for expr in str(exprs).strip().split(','):
+        match = _g_fraction_re.match(expr.strip())
+        if not match:
+            raise ValueError('Unrecognized expression "%s" for field '
+                             '"second"' % expr)
+        first, last, step = [value if value is None else 
+                             int(round(float(value) * _g_second_us))
+                             for value in match.group('first', 'last', 
+                                                      'step')]
+        if match.group('all'):
+            first, last = 0, maxval
+        elif last is None:
+            last = first if step is None else maxval
+        if step == 0:
+            raise ValueError('Increment must be higher than 0')
+        if max(first, last) > maxval:
+            raise ValueError('Value %s of field "second" is higher than '
+                             'its maximum, %d' % (expr.strip(), 
+                                                  _g_max_values['second']))
+        if first > last:
+            raise ValueError('The minimum value in a range must not be '
+                             'higher than the maximum')
+        for value in range(first, min(last, maxval) + 1, 
+                           step or _g_second_us):
+            fractions.setdefault(value // _g_second_us, set()).add(
+                value % _g_second_us)
+    return dict((second, sorted(values)) 
+                for second, values in fractions.items())
+
+
+def _weekday(name):
+    try:
+        return _g_weekdays.index(name.lower())
+    except ValueError:
+        raise ValueError('Invalid weekday name "%s"' % name)
+
+
+def _bitmask(name, ranges):
+    """
+    Returns the bitmask of the values matched
+    by the given ranges of the field.
+    """
+    mask = 0
+    maxval = _g_max_values[name]
+    for first, last, step in ranges:
+        if last is None or last > maxval:
+            last = maxval
+        for value in range(first, last + 1, step):
+            mask |= 1 << value
+    return mask
+
+
+def _bits(mask):
+    """
+    Yields the positions of the set bits
+    of the given mask, lowest first.
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _from(value):
+    """
+    Mask of all the bits at or above 'value'.
+    """
+    return ~((1 << value) - 1)
+#
+# End of Fields
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Compiled Expressions
+#
+# _g_specs : interned expressions, keyed by the tuple
+#            of the (normalized) field expressions
+#
+_g_specs = weakref.WeakValueDictionary()
+_g_specs_lock = threading.Lock()
+
+# bits 1..n, the days of a month with n days
+_g_month_days = dict((n, (1 << (n + 1)) - 2) for n in range(28, 32))
+
+
+class _CronSpec(object):
+    """
+    A compiled cron expression: one bitmask per field
+    (year is kept as ranges, it has no upper bound).
+    Instances are immutable and shared; use _intern().
+    """
+
+    def __init__(self, exprs):
+        fields = dict(zip(_g_field_names, exprs))
+        self.exprs = exprs
+        self.years = _parse_field('year', fields['year'])
+        self.months = _bitmask('month', _parse_field('month', fields['month']))
+        self.days = _bitmask('day', _parse_field('day', fields['day']))
+        self.weeks = _bitmask('week', _parse_field('week', fields['week']))
+        self.weekdays = _bitmask('day_of_week',
+                                 _parse_field('day_of_week',
+                                              fields['day_of_week']))
+        self.hours = _bitmask('hour', _parse_field('hour', fields['hour']))
+        self.minutes = _bitmask('minute',
+                                _parse_field('minute', fields['minute']))
+        self.fractions = _parse_fractions(fields['second'])
+        if self.fractions is None:
+            self.seconds = _bitmask('second', 
+                                    _parse_field('second', fields['second']))
+        else:
+            self.seconds = sum(1 << second for second in self.fractions)
+        for name, mask in (('month', self.months), ('day', self.days),
+                           ('week', self.weeks), 
+                           ('day_of_week', self.weekdays),
+                           ('hour', self.hours), ('minute', self.minutes),
+                           ('second', self.seconds)):
+            if not mask:
+                raise ValueError('Field "%s" matches no value' % name)
+        self.all_weeks = self.weeks == _bitmask('week', [(1, None, 1)])
+        self.all_weekdays = self.weekdays == 0x7f
+
+        # days of the month matching the weekdays,
+        # by the weekday of the first day of the month
+        self.weekday_days = []
+        for first_weekday in range(7):
+            mask = 0
+            for day in range(1, 32):
+                if self.weekdays >> ((first_weekday + day - 1) % 7) & 1:
+                    mask |= 1 << day
+            self.weekday_days.append(mask)
+
+    def next_year(self, year):
+        """
+        Returns the first matching year at or
+        after the given one, or None.
+        """
+        best = None
+        for first, last, step in self.years:
+            if year <= first:
+                candidate = first
+            else:
+                candidate = first + -(-(year - first) // step) * step
+            if last is not None and candidate > last:
+                continue
+            if best is None or candidate < best:
+                best = candidate
+        if best is not None and best <= _g_max_values['year']:
+            return best
+
+    def month_days(self, year, month):
+        """
+        Returns the bitmask of the matching days
+        of the given month.
+        """
+        first_weekday, ndays = monthrange(year, month)
+        mask = self.days & _g_month_days[ndays]
+        if not self.all_weekdays:
+            mask &= self.weekday_days[first_weekday]
+        if not self.all_weeks and mask:
+            for day in _bits(mask):
+                week = date(year, month, day).isocalendar()[1]
+                if not self.weeks >> week & 1:
+                    mask &= ~(1 << day)
+        return mask
+
+    def fire_times(self, start):
+        """
+        Yields all the fire times at or after 'start'
+        (a datetime without microseconds), in order.
+
+        The fields of 'start' only restrict the values
+        of a field while all the more significant
+        fields are still equal to those of 'start'.
+        """
+        year = start.year
+        empty_years = 0
+        while empty_years < _g_max_empty_years:
+            year = self.next_year(year)
+            if year is None:
+                return
+            empty_years += 1
+
+            months = self.months
+            if year == start.year:
+                months &= _from(start.month)
+            for month in _bits(months):
+                on_month = year == start.year and month == start.month
+                days = self.month_days(year, month)
+                if on_month:
+                    days &= _from(start.day)
+                for day in _bits(days):
+                    on_day = on_month and day == start.day
+                    hours = self.hours
+                    if on_day:
+                        hours &= _from(start.hour)
+                    for hour in _bits(hours):
+                        on_hour = on_day and hour == start.hour
+                        minutes = self.minutes
+                        if on_hour:
+                            minutes &= _from(start.minute)
+                        for minute in _bits(minutes):
+                            seconds = self.seconds
+                            if on_hour and minute == start.minute:
+                                seconds &= _from(start.second)
+                            for second in _bits(seconds):
+                                empty_years = 0
+                                yield datetime(year, month, day, hour,
+                                               minute, second)
+            year += 1
+
+    def fraction_times(self, start):
+        """
+        Yields all the fire times at or after 'start'
+        of an expression with fractional seconds.
+        """
+        for fire_time in self.fire_times(start.replace(microsecond=0)):
+            for microsecond in self.fractions[fire_time.second]:
+                fire_time = fire_time.replace(microsecond=microsecond)
+                if fire_time >= start:
+                    yield fire_time
+
+
+def _intern(exprs):
+    """
+    Returns the shared compiled expression
+    for the given field expressions.
+    """
+    spec = _g_specs.get(exprs)
+    if spec is None:
+        spec = _CronSpec(exprs)
+        _g_specs_lock.acquire()
+        try:
+            spec = _g_specs.setdefault(exprs, spec)
+        finally:
+            _g_specs_lock.release()
+    return spec
+#
+# End of Compiled Expressions
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Trigger
+#
+class CompiledCronTrigger(object):
+    """
+    Drop-in replacement for CronTrigger which
+    uses a shared, compiled expression.
+    """
+
+    def __init__(self, **values):
+        self.start_date = values.pop('start_date', None)
+        if self.start_date:
+            self.start_date = convert_to_datetime(self.start_date)
+
+        # same defaults as CronTrigger: the fields less
+        # significant than the last given one default
+        # to their minimum, the others to '*'
+        for key, value in list(values.items()):
+            if key not in _g_field_names:
+                raise TypeError('Invalid field name: %s' % key)
+            if value is None:
+                del values[key]
+
+        exprs = []
+        self.defaults = []
+        assign_defaults = False
+        for name in _g_field_names:
+            if name in values:
+                expr = values.pop(name)
+                assign_defaults = not values
+                self.defaults.append(False)
+            elif assign_defaults:
+                expr = _g_default_values[name]
+                self.defaults.append(True)
+            else:
+                expr = '*'
+                self.defaults.append(True)
+            exprs.append(str(expr).strip())
+        self.spec = _intern(tuple(exprs))
+
+    def fire_times(self, start_date):
+        """
+        Yields the fire times at or after the given 
+        date, in order, walked in one pass.
+        """
+        if self.start_date:
+            start_date = max(start_date, self.start_date)
+        if self.spec.fractions is None:
+            return self.spec.fire_times(datetime_ceil(start_date))
+        return self.spec.fraction_times(start_date)
+
+    def get_next_fire_time(self, start_date):
+        for fire_time in self.fire_times(start_date):
+            return fire_time
+
+    def next_n_fire_times(self, n, start_date=None):
+        """
+        Returns the next n fire times (fewer if the
+        expression runs out) from the given date,
+        [default: now]. The fire times are walked
+        in one pass, not searched for one by one.
+        """
+        return list(islice(self.fire_times(start_date or datetime.now()), n))
+
+    def __getstate__(self):
+        # the compiled expression is not pickled, it
+        # is interned again when the job is loaded
+        return {'exprs': self.spec.exprs, 'defaults': self.defaults,
+                'start_date': self.start_date}
+
+    def __setstate__(self, state):
+        self.start_date = state['start_date']
+        self.defaults = state['defaults']
+        self.spec = _intern(tuple(state['exprs']))
+
+    def __options(self):
+        return ["%s='%s'" % (name, expr) for name, expr, default
+                in zip(_g_field_names, self.spec.exprs, self.defaults)
+                if not default]
+
+    def __str__(self):
+        return 'cron[%s]' % ', '.join(self.__options())
+
+    def __repr__(self):
+        options = self.__options()
+        if self.start_date:
+            options.append("start_date='%s'" % self.start_date.isoformat(' '))
+        return '<%s (%s)>' % (self.__class__.__name__, ', '.join(options))
+
+
+# the step from a fire time to search for the next one
+_g_tick = timedelta(microseconds=1)
+
+
+class PlainCronTrigger(CronTrigger):
+    """
+    CronTrigger, for the expressions which cannot be
+    compiled, with the next_n_fire_times() of
+    CompiledCronTrigger.
+    """
+
+    def next_n_fire_times(self, n, start_date=None):
+        """
+        Returns the next n fire times (fewer if the
+        expression runs out) from the given date,
+        [default: now], searched for one by one.
+        """
+        fire_times = []
+        fire_time = self.get_next_fire_time(start_date or datetime.now())
+        while fire_time is not None and len(fire_times) < n:
+            fire_times.append(fire_time)
+            fire_time = self.get_next_fire_time(fire_time + _g_tick)
+        return fire_times
+
+
+def make_cron_trigger(**values):
+    """
+    Returns a CompiledCronTrigger for the given fields,
+    or a PlainCronTrigger if they cannot be compiled.
+    """
+    try:
+        return CompiledCronTrigger(**values)
+    except UnsupportedExpression:
+        return PlainCronTrigger(**values)
+#
+# End of Trigger
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,332 @@
+"""
+Job
+
+The jobs created by the Scheduler (see scheduler.py).
+
+FrameworkJob is an APScheduler Job with the Scheduler's
+own job options; they are persisted together in the
+'options' column of the job store (see jobstore.py).
+The reference and name of its callable are taken from
+the registry (see registry.py), once per job.
+
+The fire times of a job can be shifted by a fixed offset
+(its jitter), so that jobs with the same schedule do not
+all start at the same instant.
+
+The args and kwargs of a job loaded from a job store may
+be left encoded (see codec.py) until they are used.
+
+A run which fails can be retried, with backoff, as a 
+run of the same job (see the retry options below).
+"""
+
+from apscheduler.job import Job
+from apscheduler.util import ref_to_obj
+from registry import callable_ref, callable_name
+from codec import Encoded, encode_value
+from datetime import timedelta
+import traceback
+import pickle
+import random
+import zlib
+
+__all__ = ('FrameworkJob', 'dump_call', 'call_in_process')
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Job Options
+#
+# executor  : where the job runs, 'thread' for the
+#             thread pool or 'process' for the process
+#             pool [default: thread]
+# shard_key : key which selects the shard of the job in
+#             a ShardedJobStore (see jobstore.py); jobs
+#             with the same key are in the same shard
+#             [default: none, the shards in turn]
+# jitter    : width, in seconds, of the window over which
+#             the fire times of jobs with the same schedule
+#             are spread [default: 0, no jitter]
+# priority  : the runs of the jobs with a higher priority
+#             start first when the threads are busy 
+#             [default: 0]
+# max_concurrency : max number of runs of the callable of
+#             the job in the thread pool at once (see 
+#             runqueue.py) [default: none, the value of
+#             apscheduler.runqueue.max_concurrency]
+# max_attempts : max number of attempts of a run, the 
+#             first one and its retries [default: 1, 
+#             no retry]
+# retry_backoff : seconds before the first retry, doubled
+#             for each next one [default: 1]
+# retry_max_backoff : max seconds between two attempts
+#             [default: 300]
+# retry_jitter : the backoff is increased by up to that 
+#             fraction of it, at random [default: 0.1]
+# retry_on  : exception class (or tuple of them) of the
+#             failures to retry [default: none, any 
+#             Exception]
+#
+# the pending retry of a job is kept in retry_at (its 
+# time) and retry_attempt (its number, from 2); the job 
+# runs at retry_at as if it were one of its fire times, 
+# and its job store keeps both with the next run time.
+#
+# the fire times of a job are shifted by its offset, a
+# fraction of the jitter given by a hash of the name (by
+# default the callable) and the encoded arguments of the
+# job, as its job store keeps them: the same on every
+# run, restart and node, without decoding the arguments. The offset is at most the job's 
+# misfire_grace_time, so that a job does not start later
+# than it tolerates because of jitter (the scheduler 
+# refuses a higher jitter option, and warns when it cuts
+# apscheduler.jitter).
+#
+_g_job_options = {
+    'executor'  : 'thread',
+    'shard_key' : None,
+    'jitter'    : 0,
+    'priority'  : 0,
+    'max_concurrency' : None,
+    'max_attempts' : 1,
+    'retry_backoff' : 1,
+    'retry_max_backoff' : 300,
+    'retry_jitter' : 0.1,
+    'retry_on'  : None,
+}
+_g_executors = ('thread', 'process')
+
+_g_no_ref_msg = 'Cannot determine the reference to %s; ' \
+                'it can be registered with Scheduler.register()'
+
+
+class FrameworkJob(Job):
+    """
+    APScheduler Job with the Scheduler's job options.
+    """
+
+    retry_at = None
+    retry_attempt = 1
+
+    def __decoded(self, key):
+        # decoding twice (in two threads) is harmless;
+        # the offset is keyed on the encoded values
+        value = self.__dict__[key]
+        if isinstance(value, Encoded):
+            self.offset
+            value = self.__dict__[key] = value.decode()
+        return value
+
+    def __encoded(self, key):
+        # the encoding of args or kwargs, as stored
+        value = self.__dict__[key]
+        if isinstance(value, Encoded):
+            return bytes(value.data)
+        return encode_value(value)
+
+    @property
+    def args(self):
+        return self.__decoded('_args')
+
+    @args.setter
+    def args(self, args):
+        self._args = args
+
+    @property
+    def kwargs(self):
+        return self.__decoded('_kwargs')
+
+    @kwargs.setter
+    def kwargs(self, kwargs):
+        self._kwargs = kwargs
+
+    def __init__(self, trigger, func, args, kwargs, misfire_grace_time,
+                 coalesce, name=None, **options):
+        for key, default in _g_job_options.items():
+            setattr(self, key, options.pop(key, default))
+        if self.executor not in _g_executors:
+            raise ValueError('executor must be one of: %s' %
+                             ', '.join(_g_executors))
+        self.jitter = float(self.jitter or 0)
+        if self.jitter < 0:
+            raise ValueError('jitter must not be negative')
+        self.priority = int(self.priority or 0)
+        if self.max_concurrency is not None and self.max_concurrency < 1:
+            raise ValueError('max_concurrency must be a positive value')
+        self.max_attempts = int(self.max_attempts or 1)
+        if self.max_attempts < 1:
+            raise ValueError('max_attempts must be a positive value')
+        if isinstance(self.retry_on, list):
+            self.retry_on = tuple(self.retry_on)
+        if self.retry_backoff < 0 or self.retry_max_backoff < 0 or \
+           self.retry_jitter < 0:
+            raise ValueError('retry_backoff, retry_max_backoff and '
+                             'retry_jitter must not be negative')
+        if hasattr(func, '__call__'):
+            name = name or callable_name(func)
+        Job.__init__(self, trigger, func, args, kwargs, misfire_grace_time,
+                     coalesce, name, **options)
+
+        # only the reference of the callable is sent to
+        # the process pool; make sure there is one
+        self.func_ref = callable_ref(func)
+        if self.executor == 'process' and self.func_ref is None:
+            raise ValueError(_g_no_ref_msg % repr(func))
+
+    def __getstate__(self):
+        if self.func_ref is None:
+            self.func_ref = callable_ref(self.func)
+            if self.func_ref is None:
+                raise ValueError(_g_no_ref_msg % repr(self.func))
+        # same as Job.__getstate__(), with the cached reference
+        state = self.__dict__.copy()
+        state.pop('instances', None)
+        state.pop('func', None)
+        state.pop('_lock', None)
+        state.pop('_offset', None)
+        state.pop('_retry_run', None)
+        state.pop('_args', None)
+        state.pop('_kwargs', None)
+        state['args'] = self.args
+        state['kwargs'] = self.kwargs
+        state['options'] = dict((key, state.pop(key))
+                                for key in _g_job_options if key in state)
+        return state
+
+    def __setstate__(self, state):
+        """
+        state is as returned by __getstate__(); args
+        and kwargs may be Encoded, to be decoded when 
+        they are first used.
+        """
+        options = state.pop('options', None) or {}
+        func_ref = state['func_ref']
+        state['_args'] = state.pop('args')
+        state['_kwargs'] = state.pop('kwargs')
+        Job.__setstate__(self, state)
+        for key, default in _g_job_options.items():
+            setattr(self, key, options.get(key, default))
+        self.func_ref = func_ref
+        self.retry_attempt = self.retry_attempt or 1
+
+    @property
+    def offset(self):
+        """
+        The shift (timedelta) of the fire times of this job.
+        """
+        offset = self.__dict__.get('_offset')
+        if offset is None:
+            window = min(self.jitter, self.misfire_grace_time)
+            if window > 0:
+                # keyed on the encoded args and kwargs, so
+                # that they need not be decoded for it
+                name = self.name
+                if isinstance(name, unicode):
+                    name = name.encode('utf-8')
+                crc = zlib.crc32(name or '')
+                crc = zlib.crc32(self.__encoded('_args'), crc)
+                crc = zlib.crc32(self.__encoded('_kwargs'), crc)
+                fraction = (crc & 0xffffffff) / 4294967296.0
+                offset = timedelta(seconds=window * fraction)
+            else:
+                offset = timedelta(0)
+            self._offset = offset
+        return offset
+
+    def compute_next_run_time(self, now):
+        offset = self.offset
+        if not offset:
+            Job.compute_next_run_time(self, now)
+        elif self.runs == self.max_runs:
+            self.next_run_time = None
+        else:
+            fire_time = self.trigger.get_next_fire_time(now - offset)
+            self.next_run_time = fire_time and fire_time + offset
+        # a pending retry comes first
+        if self.retry_at is not None and (self.next_run_time is None or
+                                          self.retry_at < self.next_run_time):
+            self.next_run_time = self.retry_at
+        return self.next_run_time
+
+    def retry_delay(self, attempt):
+        """
+        Returns the seconds to wait before the given 
+        attempt (2 for the first retry) of a run.
+        """
+        delay = min(self.retry_backoff * 2 ** (attempt - 2), 
+                    self.retry_max_backoff)
+        return delay + random.uniform(0, delay * self.retry_jitter)
+
+    def is_retryable(self, exception):
+        """
+        True if a run which raised the given exception 
+        is to be retried, attempts permitting.
+        """
+        return isinstance(exception, self.retry_on or Exception)
+
+    def get_run_times(self, now):
+        offset = self.offset
+        if not offset:
+            return Job.get_run_times(self, now)
+        run_times = []
+        run_time = self.next_run_time
+        increment = timedelta(microseconds=1)
+        while ((not self.max_runs or self.runs < self.max_runs) and
+               run_time and run_time <= now):
+            run_times.append(run_time)
+            fire_time = self.trigger.get_next_fire_time(run_time - offset +
+                                                        increment)
+            run_time = fire_time and fire_time + offset
+        return run_times
+#
+# End of Job Options
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Process Execution
+#
+# only the reference of the callable and the args
+# cross the process boundary; they are pickled by the
+# scheduler (dump_call), so that a job with arguments 
+# which cannot be pickled fails when it is dispatched
+#
+# callables resolved in this (worker) process
+_g_resolved_refs = {}
+
+
+def dump_call(job):
+    """
+    Returns the pickled call of the given
+    job, to be passed to call_in_process().
+    """
+    return pickle.dumps((job.func_ref, job.args, job.kwargs),
+                        pickle.HIGHEST_PROTOCOL)
+
+
+def call_in_process(call):
+    """
+    Runs the pickled call (see dump_call) in a
+    process pool worker. Returns ('executed', retval)
+    or ('error', exception, formatted traceback); the
+    value (or exception) is replaced with its repr()
+    when it cannot be pickled back to the scheduler.
+    """
+    try:
+        func_ref, args, kwargs = pickle.loads(call)
+        func = _g_resolved_refs.get(func_ref)
+        if func is None:
+            func = _g_resolved_refs[func_ref] = ref_to_obj(func_ref)
+        result = ('executed', func(*args, **kwargs))
+    except Exception as exc:
+        result = ('error', exc, traceback.format_exc())
+
+    try:
+        pickle.loads(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        result = (result[0], repr(result[1])) + result[2:]
+    return result
+#
+# End of Process Execution
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
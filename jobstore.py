@@ -0,0 +1,1102 @@
+"""
+JobStore
+
+Job stores used by the Scheduler (see scheduler.py).
+
+ [1] FrameworkJobStore : SQLAlchemy backed store for the
+                         Framework_Jobs table
+ [2] ShardedJobStore   : FrameworkJobStore spread over
+                         several tables or databases
+ [3] MemoryJobStore    : in-memory store, no persistence
+
+All keep their jobs in a JobList, indexed by job id.
+FrameworkJobStore also provides the claims and the
+heartbeats of the clustered mode (see cluster.py).
+"""
+
+from apscheduler.jobstores.sqlalchemy_store import SQLAlchemyJobStore
+from apscheduler.jobstores.ram_store import RAMJobStore
+from apscheduler.jobstores.base import JobStore
+from apscheduler.util import asint
+from sqlalchemy import Table, Column, LargeBinary, String, DateTime, Integer
+from sqlalchemy import Index
+from sqlalchemy import select, and_, or_, func, bindparam, create_engine
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.exc import IntegrityError
+from collections import OrderedDict
+from heapq import merge
+from datetime import datetime, timedelta
+from job import FrameworkJob, _g_job_options
+from registry import callable_ref
+from codec import Encoded, encode_value, decode_value
+from codec import encode_trigger, decode_trigger
+import itertools
+import threading
+import sys
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Job List
+#
+class JobList(object):
+    """
+    Ordered collection of jobs keyed by the job id.
+    It is used as the 'jobs' attribute of the job 
+    stores, so that a job can be found or removed 
+    without scanning all the jobs.
+    """
+
+    def __init__(self, jobs=()):
+        self.__jobs = OrderedDict()
+        self.extend(jobs)
+
+    def append(self, job):
+        self.__jobs[job.id] = job
+
+    def extend(self, jobs):
+        for job in jobs:
+            self.__jobs[job.id] = job
+
+    def remove(self, job):
+        try:
+            del self.__jobs[job.id]
+        except KeyError:
+            raise ValueError('Job "%s" is not in the list' % job)
+
+    def get(self, jobid):
+        """
+        Returns the job with the given id or None.
+        """
+        return self.__jobs.get(jobid)
+
+    def __contains__(self, job):
+        return getattr(job, 'id', None) in self.__jobs
+
+    def __iter__(self):
+        return self.__jobs.itervalues()
+
+    def __len__(self):
+        return len(self.__jobs)
+
+    def __repr__(self):
+        return '<%s (%d jobs)>' % (self.__class__.__name__, len(self))
+#
+# End of Job List
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Job Stores
+#
+# batch_size : number of rows written per transaction
+#              by add_jobs() [default: 1000]
+# shard, shards : the store is shard number 'shard' of
+#              'shards' (see ShardedJobStore); the id of
+#              a job is its row id * shards + shard
+#              [default: 0 of 1, the row id]
+#
+# FrameworkJobStore adds an 'options' column to the 
+# APScheduler table for the options of FrameworkJob 
+# (see job.py), the 'trigger_kind', 'trigger_date' and
+# 'trigger_spec' columns of the compact encoding of the
+# jobs (see codec.py), and the 'lease_owner' and 
+# 'lease_expires' columns of the clustered mode (see 
+# cluster.py), and the 'retry_at' and 'retry_attempt' 
+# columns of the pending retry of a job (see job.py), 
+# and the indexed 'updated_at' column, the time of the
+# last write of the row; they are added to existing 
+# tables too. 
+# The heartbeats of the nodes are kept in the 
+# <tablename>_nodes table, created on the first heartbeat.
+#
+# the nodes of a cluster sync with the rows changed since
+# their previous sync (see peek_changes()), and with the
+# rows removed since then: once track_removals() is 
+# called, the ids of the removed rows are kept in the 
+# <tablename>_removed table (see removed_since()) for 
+# _g_removed_ttl, in the transaction of the DELETE.
+#
+# the trigger, args, kwargs and options columns hold the
+# bytes written by codec.py (the same column type as the
+# pickles of APScheduler); the options which have their
+# default value are not stored. Only the next_run_time, 
+# runs, retry and lease columns are written after a job
+# is added;
+# in the write-behind mode of the Scheduler, with many 
+# rows per transaction (see write_behind()).
+#
+# _g_delete_chunk : max number of job ids per DELETE 
+#                   (or SELECT) statement
+#
+# add_jobs() gives the rows their ids itself, so that a
+# transaction sends all its rows in one executemany() 
+# INSERT (one multi-row INSERT on MySQL) instead of one
+# INSERT per row to read back each auto-increment id.
+# The ids are taken from the single row of the 
+# <tablename>_seq table, in the transaction of the 
+# INSERT, and never handed out again: the id of a 
+# removed job is not reused (by any node) for a new
+# one, which removed_since() would report as removed.
+# The sequence starts after the highest id of the table
+# (and of <tablename>_removed) when it is created by the
+# first add_jobs(). If another process took some of the
+# ids first, the transaction is retried with new ones,
+# up to _g_insert_attempts times.
+#
+# page_size : number of rows per page of a streaming
+#             load; 0 loads all the jobs at once
+#             [default: 0]
+# horizon   : seconds; with page_size, the jobs whose
+#             next run time is further than that at 
+#             load time are not loaded but kept as 
+#             stubs, (job id, next run time), and 
+#             fetched when they are about to be due; 
+#             0 loads all the jobs [default: 0]
+#
+# a streaming load_jobs() loads the first page only, in
+# next_run_time order; the Scheduler loads the other
+# pages with load_next_page() once it has started.
+#
+_g_delete_chunk = 500
+_g_removed_ttl = timedelta(hours=1)
+_g_insert_attempts = 5
+_g_lease_columns = ('lease_owner', 'lease_expires')
+_g_trigger_columns = ('trigger', 'trigger_kind', 'trigger_date', 
+                      'trigger_spec')
+
+# the listing of the jobs (see iter_ids() and count_jobs())
+# is done in SQL: the criteria of a JobFilter (see 
+# scheduler.py), but its predicate, become a WHERE clause.
+# The trigger kinds of the JobFilter are the trigger_kind
+# of codec.py; the rows with a pickled trigger (no 
+# trigger_kind) are restored to be matched.
+#
+_g_sql_trigger_kinds = {
+    'at'    : 'date',
+    'after' : 'date',
+    'every' : 'interval',
+    'cron'  : 'cron',
+}
+_g_order_columns = ('id', 'name', 'next_run_time')
+
+class FrameworkJobStore(SQLAlchemyJobStore):
+    """
+    SQLAlchemyJobStore which can persist (and 
+    remove) many jobs in a few transactions.
+    """
+
+    def __init__(self, batch_size=1000, shard=0, shards=1, page_size=0,
+                 horizon=0, **options):
+        SQLAlchemyJobStore.__init__(self, **options)
+        self.batch_size = max(asint(batch_size), 1)
+        self.shard = asint(shard)
+        self.shards = max(asint(shards), 1)
+        self.page_size = max(asint(page_size), 0)
+        self.horizon = timedelta(seconds=float(horizon))
+        self.__cursor = None
+        for column in ('trigger', 'args', 'kwargs'):
+            self.jobs_t.c[column].type = LargeBinary()
+        self.jobs_t.append_column(Column('options', LargeBinary))
+        self.jobs_t.append_column(Column('trigger_kind', String(16)))
+        self.jobs_t.append_column(Column('trigger_date', DateTime))
+        self.jobs_t.append_column(Column('trigger_spec', String(1024)))
+        self.jobs_t.append_column(Column('lease_owner', String(255)))
+        self.jobs_t.append_column(Column('lease_expires', DateTime))
+        self.jobs_t.append_column(Column('retry_at', DateTime))
+        self.jobs_t.append_column(Column('retry_attempt', Integer))
+        self.jobs_t.append_column(Column('updated_at', DateTime))
+        self.__add_missing_columns()
+        self.jobs = JobList(self.jobs)
+        self.nodes_t = Table(self.jobs_t.name + '_nodes', 
+                             self.jobs_t.metadata,
+                             Column('node', String(255), primary_key=True),
+                             Column('expires', DateTime, nullable=False))
+        self.__nodes_created = False
+        self.removed_t = Table(self.jobs_t.name + '_removed', 
+                               self.jobs_t.metadata,
+                               Column('id', Integer, nullable=False),
+                               Column('removed_at', DateTime, 
+                                      nullable=False, index=True))
+        self.__track_removals = False
+        self.seq_t = Table(self.jobs_t.name + '_seq', 
+                           self.jobs_t.metadata,
+                           Column('id', Integer, primary_key=True,
+                                  autoincrement=False),
+                           Column('next_id', Integer, nullable=False))
+        self.__seq_created = False
+
+    def __add_missing_columns(self):
+        inspector = Inspector.from_engine(self.engine)
+        existing = set(column['name'] for column in
+                       inspector.get_columns(self.jobs_t.name))
+        dialect = self.engine.dialect
+        table = dialect.identifier_preparer.format_table(self.jobs_t)
+        for column in self.jobs_t.columns:
+            if column.name in existing:
+                continue
+            self.engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % 
+                                (table, column.name, 
+                                 column.type.compile(dialect=dialect)))
+            logger.info('Added column "%s" to table %s', column.name, table)
+        name = self.jobs_t.name + '_updated_at'
+        if name not in set(index['name'] for index in 
+                           inspector.get_indexes(self.jobs_t.name)):
+            Index(name, self.jobs_t.c.updated_at).create(self.engine)
+            logger.info('Added index "%s" to table %s', name, table)
+
+    def _job_id(self, rowid):
+        return rowid * self.shards + self.shard
+
+    def _row_id(self, jobid):
+        return (jobid - self.shard) // self.shards
+
+    def __encode_job(self, job):
+        state = job.__getstate__()
+        options = state['options']
+        state['options'] = encode_value(dict(
+            (key, value) for key, value in options.items() 
+            if value != _g_job_options[key]))
+        state.update(zip(_g_trigger_columns, 
+                         encode_trigger(state['trigger'])))
+        state['args'] = encode_value(state['args'])
+        state['kwargs'] = encode_value(state['kwargs'])
+        return state
+
+    def __restore_jobs(self, rows):
+        jobs = []
+        for row in rows:
+            job_dict = dict(row.items())
+            for column in _g_lease_columns:
+                job_dict.pop(column, None)
+            try:
+                job_dict['trigger'] = decode_trigger(*[
+                    job_dict.pop(column) for column in _g_trigger_columns])
+                job_dict['args'] = Encoded(job_dict['args'])
+                job_dict['kwargs'] = Encoded(job_dict['kwargs'])
+                if job_dict['options'] is not None:
+                    job_dict['options'] = decode_value(job_dict['options'])
+                job = FrameworkJob.__new__(FrameworkJob)
+                job.__setstate__(job_dict)
+                job.id = self._job_id(job.id)
+                jobs.append(job)
+            except Exception:
+                logger.exception('Unable to restore job "%s"',
+                                 job_dict.get('name', '(unknown)'))
+        return jobs
+
+    def load_jobs(self):
+        if not self.page_size:
+            rows = self.engine.execute(select([self.jobs_t]))
+            self.jobs = JobList(self.__restore_jobs(rows))
+            return
+
+        # streaming: the first page now, the others 
+        # with load_next_page()
+        until = None
+        if self.horizon:
+            until = datetime.now() + self.horizon
+        self.__cursor = ['jobs', None, None, until]
+        self.jobs = JobList()
+        self.jobs.extend(self.load_next_page()[0])
+
+    def __next_rows(self, columns, where):
+        # the next page of rows after the cursor, 
+        # in (next_run_time, id) order
+        kind, last_time, last_id, until = self.__cursor
+        c = self.jobs_t.c
+        if last_time is not None:
+            where.append(or_(c.next_run_time > last_time,
+                             and_(c.next_run_time == last_time, 
+                                  c.id > last_id)))
+        query = select(columns).where(and_(*where)).\
+                order_by(c.next_run_time, c.id).limit(self.page_size)
+        rows = self.engine.execute(query).fetchall()
+        if len(rows) < self.page_size:
+            self.__cursor = ['stubs', None, None, until] \
+                            if kind == 'jobs' and until else None
+        else:
+            last = rows[-1]
+            self.__cursor[1:3] = last['next_run_time'], last['id']
+        return rows
+
+    def load_next_page(self):
+        """
+        Loads the next page of a streaming load. Returns 
+        the jobs and the stubs, (job id, next run time),
+        of the page, or None once all the rows were read.
+        The jobs are not added to the jobs of this store.
+        """
+        if self.__cursor is None:
+            return None
+        c = self.jobs_t.c
+        kind, until = self.__cursor[0], self.__cursor[3]
+        if kind == 'jobs':
+            where = [c.next_run_time <= until] if until else []
+            rows = self.__next_rows([self.jobs_t], where)
+            return self.__restore_jobs(rows), []
+        rows = self.__next_rows([c.id, c.next_run_time], 
+                                [c.next_run_time > until])
+        return [], [(self._job_id(row[0]), row[1]) for row in rows]
+
+    def add_job(self, job):
+        self.add_jobs([job])
+
+    def add_jobs(self, jobs):
+        """
+        Adds the given jobs to this store, batch_size 
+        rows per transaction, each sent in a single
+        INSERT statement.
+
+        If a transaction fails, the jobs committed by
+        the earlier transactions stay in the store.
+        """
+        insert = self.jobs_t.insert()
+        columns = [column.name for column in self.jobs_t.columns]
+        conn = self.engine.connect()
+        try:
+            for i in range(0, len(jobs), self.batch_size):
+                chunk = jobs[i:i + self.batch_size]
+                rows = []
+                now = datetime.now()
+                for job in chunk:
+                    state = self.__encode_job(job)
+                    state['updated_at'] = now
+                    rows.append(dict((column, state.get(column)) 
+                                     for column in columns))
+                ids = self.__insert_rows(conn, insert, rows)
+                for job, rowid in zip(chunk, ids):
+                    job.id = self._job_id(rowid)
+                self.jobs.extend(chunk)
+                logger.debug('Stored %d jobs in one transaction', len(chunk))
+        finally:
+            conn.close()
+
+    def __insert_rows(self, conn, insert, rows):
+        # inserts the rows in one transaction, with ids
+        # taken from the sequence; returns the ids
+        if not self.__seq_created:
+            self.seq_t.create(self.engine, True)
+            self.__seq_created = True
+        for attempt in range(1, _g_insert_attempts + 1):
+            trans = conn.begin()
+            try:
+                first = self.__take_ids(conn, len(rows))
+                ids = range(first, first + len(rows))
+                for row, rowid in zip(rows, ids):
+                    row['id'] = rowid
+                conn.execute(insert, rows)
+                trans.commit()
+                return ids
+            except IntegrityError:
+                trans.rollback()
+                if attempt == _g_insert_attempts:
+                    raise
+                logger.info('Ids %d to %d were taken by another process, '
+                            'retrying', first, first + len(rows) - 1)
+            except:
+                trans.rollback()
+                raise
+
+    def __take_ids(self, conn, count):
+        # the UPDATE locks the row of the sequence until
+        # the end of the transaction; the first insert
+        # starts it after the ids in use or removed
+        c = self.seq_t.c
+        update = self.seq_t.update().where(c.id == 1)
+        if conn.execute(update.values(next_id=c.next_id + count)).rowcount:
+            query = select([c.next_id]).where(c.id == 1)
+            return conn.execute(query).scalar() - count
+        top = conn.execute(select([func.max(self.jobs_t.c.id)])).scalar()
+        first = (top or 0) + 1
+        if self.engine.dialect.has_table(conn, self.removed_t.name):
+            top = conn.execute(select([func.max(self.removed_t.c.id)])).\
+                  scalar()
+            first = max(first, (top or 0) + 1)
+        conn.execute(self.seq_t.insert(), id=1, next_id=first + count)
+        return first
+
+    def remove_jobs(self, jobs):
+        """
+        Removes the given jobs from this store with 
+        set-based DELETEs in a single transaction.
+        """
+        ids = [self._row_id(job.id) for job in jobs]
+        conn = self.engine.connect()
+        try:
+            trans = conn.begin()
+            try:
+                for i in range(0, len(ids), _g_delete_chunk):
+                    chunk = ids[i:i + _g_delete_chunk]
+                    conn.execute(self.jobs_t.delete().
+                                 where(self.jobs_t.c.id.in_(chunk)))
+                self.__record_removed(conn, ids)
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+        finally:
+            conn.close()
+
+        for job in jobs:
+            self.jobs.remove(job)
+
+    def remove_job(self, job):
+        self.remove_jobs([job])
+
+    def remove_all_jobs(self):
+        """
+        Removes all the jobs from this store 
+        with a single DELETE.
+        """
+        conn = self.engine.connect()
+        try:
+            trans = conn.begin()
+            try:
+                if self.__track_removals:
+                    c = self.jobs_t.c
+                    conn.execute(self.removed_t.insert().from_select(
+                        ['id', 'removed_at'], 
+                        select([c.id, bindparam('now', datetime.now(),
+                                                type_=DateTime)])))
+                conn.execute(self.jobs_t.delete())
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+        finally:
+            conn.close()
+        self.jobs = JobList()
+
+    def __record_removed(self, conn, ids):
+        # keeps the ids of the removed rows, for the
+        # sync of the other nodes
+        if self.__track_removals and ids:
+            now = datetime.now()
+            conn.execute(self.removed_t.insert(), 
+                         [{'id': rowid, 'removed_at': now} for rowid in ids])
+
+    def update_job(self, job):
+        update = self.jobs_t.update().\
+                 where(self.jobs_t.c.id == self._row_id(job.id)).\
+                 values(next_run_time=job.next_run_time, runs=job.runs,
+                        retry_at=job.retry_at, 
+                        retry_attempt=job.retry_attempt,
+                        updated_at=datetime.now())
+        self.engine.execute(update)
+
+    def write_behind(self, updates, ids):
+        """
+        Stores the given (job id, next_run_time, runs,
+        retry_at, retry_attempt) updates and deletes the rows of the given job ids,
+        batch_size rows per transaction, over one pooled 
+        connection (see the write-behind mode of the 
+        Scheduler). The rows which are gone are skipped.
+
+        If a transaction fails, the rows written by the 
+        earlier transactions stay written.
+        """
+        c = self.jobs_t.c
+        update = self.jobs_t.update().where(c.id == bindparam('row_id')).\
+                 values(next_run_time=bindparam('new_next_run_time'),
+                        runs=bindparam('new_runs'),
+                        retry_at=bindparam('new_retry_at'),
+                        retry_attempt=bindparam('new_retry_attempt'),
+                        updated_at=bindparam('new_updated_at'))
+        now = datetime.now()
+        params = [{'row_id': self._row_id(jobid), 
+                   'new_next_run_time': next_run_time, 'new_runs': runs,
+                   'new_retry_at': retry_at, 
+                   'new_retry_attempt': retry_attempt,
+                   'new_updated_at': now}
+                  for jobid, next_run_time, runs, retry_at, retry_attempt
+                  in updates]
+        ids = [self._row_id(jobid) for jobid in ids]
+        conn = self.engine.connect()
+        try:
+            for i in range(0, max(len(params), len(ids)), self.batch_size):
+                trans = conn.begin()
+                try:
+                    chunk = params[i:i + self.batch_size]
+                    if chunk:
+                        conn.execute(update, chunk)
+                    chunk = ids[i:i + self.batch_size]
+                    for k in range(0, len(chunk), _g_delete_chunk):
+                        conn.execute(self.jobs_t.delete().where(
+                            c.id.in_(chunk[k:k + _g_delete_chunk])))
+                    self.__record_removed(conn, chunk)
+                    trans.commit()
+                except:
+                    trans.rollback()
+                    raise
+        finally:
+            conn.close()
+
+    def claim_job(self, job, node, now, expires):
+        """
+        Leases the given job to the given node until 
+        'expires', if its row still has the runs of the 
+        job and no other node holds a lease on it at 
+        'now'. Returns True if the job was claimed.
+        """
+        c = self.jobs_t.c
+        claim = self.jobs_t.update().where(and_(
+            c.id == self._row_id(job.id), c.runs == job.runs,
+            or_(c.lease_owner == None, c.lease_owner == node,
+                c.lease_expires < now))).\
+            values(lease_owner=node, lease_expires=expires)
+        return self.engine.execute(claim).rowcount == 1
+
+    def release_job(self, job, node):
+        """
+        Stores the next run time, the runs and the retry
+        of a job claimed by the given node, and releases
+        its lease.
+        Returns False if the node no longer holds the lease.
+        """
+        c = self.jobs_t.c
+        release = self.jobs_t.update().where(and_(
+            c.id == self._row_id(job.id), c.lease_owner == node)).\
+            values(next_run_time=job.next_run_time, runs=job.runs,
+                   retry_at=job.retry_at, retry_attempt=job.retry_attempt,
+                   lease_owner=None, lease_expires=None,
+                   updated_at=datetime.now())
+        return self.engine.execute(release).rowcount == 1
+
+    def peek_job(self, job):
+        """
+        Returns the runs, next_run_time, lease_owner and
+        lease_expires of the row of the given job, or None
+        if the job is no longer stored.
+        """
+        c = self.jobs_t.c
+        query = select([c.runs, c.next_run_time, c.lease_owner,
+                        c.lease_expires]).\
+                where(c.id == self._row_id(job.id))
+        return self.engine.execute(query).first()
+
+    def peek_jobs(self):
+        """
+        Returns job id -> (runs, next_run_time) for
+        all the stored jobs, without loading them.
+        """
+        c = self.jobs_t.c
+        query = select([c.id, c.runs, c.next_run_time])
+        return dict((self._job_id(row[0]), (row[1], row[2])) 
+                    for row in self.engine.execute(query))
+
+    def peek_changes(self, since):
+        """
+        Same as peek_jobs(), for the jobs whose row was
+        added or written at or after 'since' only; 
+        through the index of updated_at.
+        """
+        c = self.jobs_t.c
+        query = select([c.id, c.runs, c.next_run_time]).\
+                where(c.updated_at >= since)
+        return dict((self._job_id(row[0]), (row[1], row[2])) 
+                    for row in self.engine.execute(query))
+
+    def track_removals(self):
+        """
+        Keeps the ids of the rows removed from now on
+        (see removed_since()).
+        """
+        if not self.__track_removals:
+            self.removed_t.create(self.engine, True)
+            self.__track_removals = True
+
+    def removed_since(self, since):
+        """
+        Returns the ids of the jobs removed at or after
+        'since', or None if they are no longer known 
+        (see track_removals()). Forgets the removals 
+        older than _g_removed_ttl.
+        """
+        if not self.__track_removals:
+            return None
+        horizon = datetime.now() - _g_removed_ttl
+        if since < horizon:
+            return None
+        c = self.removed_t.c
+        self.engine.execute(self.removed_t.delete().
+                            where(c.removed_at < horizon))
+        query = select([c.id]).where(c.removed_at >= since)
+        return [self._job_id(row[0]) for row in self.engine.execute(query)]
+
+    def read_jobs(self, ids):
+        """
+        Returns the stored jobs with the given ids, 
+        without adding them to this store.
+        """
+        jobs = []
+        ids = [self._row_id(jobid) for jobid in ids]
+        for i in range(0, len(ids), _g_delete_chunk):
+            chunk = ids[i:i + _g_delete_chunk]
+            query = select([self.jobs_t]).where(self.jobs_t.c.id.in_(chunk))
+            jobs.extend(self.__restore_jobs(self.engine.execute(query)))
+        return jobs
+
+    def fetch_jobs(self, ids):
+        """
+        Loads the stored jobs with the given ids (stored 
+        by other nodes, or stubs) and adds them to this 
+        store. Returns the loaded jobs.
+        """
+        jobs = self.read_jobs(ids)
+        self.jobs.extend(jobs)
+        return jobs
+
+    def __filter_where(self, job_filter, pickled_triggers):
+        # the WHERE clauses of the criteria of the given
+        # JobFilter; the rows with a pickled trigger match
+        # any trigger kind if pickled_triggers is True
+        c = self.jobs_t.c
+        where = []
+        if job_filter is None:
+            return where
+        if job_filter.trigger is not None:
+            kind = c.trigger_kind == _g_sql_trigger_kinds[job_filter.trigger]
+            if pickled_triggers:
+                kind = or_(kind, c.trigger_kind == None)
+            where.append(kind)
+        if job_filter.func is not None:
+            where.append(c.func_ref == callable_ref(job_filter.func))
+        if job_filter.name_prefix is not None:
+            prefix = job_filter.name_prefix
+            if isinstance(prefix, str):
+                prefix = prefix.decode('utf-8')
+            prefix = prefix.replace(u'\\', u'\\\\').\
+                     replace(u'%', u'\\%').replace(u'_', u'\\_')
+            where.append(c.name.like(prefix + u'%', escape='\\'))
+        if job_filter.next_run_after is not None:
+            where.append(c.next_run_time >= job_filter.next_run_after)
+        if job_filter.next_run_before is not None:
+            where.append(c.next_run_time < job_filter.next_run_before)
+        return where
+
+    def iter_ids(self, job_filter=None, order_by=None):
+        """
+        Yields (key, job id) for the stored jobs which 
+        may match the given JobFilter, in the order of
+        the key: the order_by column ('id', 'name' or 
+        'next_run_time'), else the job id. The rows are 
+        read a page at a time, as they are consumed. 
+        The predicate (and the trigger kind of the rows 
+        with a pickled trigger) is left to the caller.
+        """
+        if order_by not in (None,) + _g_order_columns:
+            raise ValueError('Cannot order the jobs by "%s"' % order_by)
+        c = self.jobs_t.c
+        column = c[order_by or 'id']
+        where = self.__filter_where(job_filter, True)
+        last = None
+        while True:
+            page = list(where)
+            if column is c.id:
+                if last is not None:
+                    page.append(c.id > last[0])
+                query = select([c.id]).order_by(c.id)
+            else:
+                if last is not None:
+                    page.append(or_(column > last[0], 
+                                    and_(column == last[0], c.id > last[1])))
+                query = select([column, c.id]).order_by(column, c.id)
+            query = query.where(and_(*page)).limit(_g_delete_chunk)
+            rows = self.engine.execute(query).fetchall()
+            for row in rows:
+                jobid = self._job_id(row[-1])
+                yield (jobid if column is c.id else row[0]), jobid
+            if len(rows) < _g_delete_chunk:
+                return
+            last = rows[-1]
+
+    def count_jobs(self, job_filter=None):
+        """
+        Returns the number of stored jobs matching the 
+        given JobFilter, which has no predicate, with a 
+        SELECT COUNT; only the rows with a pickled trigger
+        are restored, if the filter has a trigger kind.
+        """
+        c = self.jobs_t.c
+        where = self.__filter_where(job_filter, False)
+        query = select([func.count(c.id)]).where(and_(*where))
+        count = self.engine.execute(query).scalar()
+        if job_filter is not None and job_filter.trigger is not None:
+            where = self.__filter_where(job_filter, True)
+            query = select([self.jobs_t]).where(and_(
+                c.trigger_kind == None, *where))
+            count += sum(1 for job in 
+                         self.__restore_jobs(self.engine.execute(query))
+                         if job_filter.matches(job))
+        return count
+
+    def heartbeat(self, node, now, expires):
+        """
+        Records that the given node is live until 
+        'expires', forgets the nodes which expired 
+        before 'now' and returns the live nodes.
+        """
+        if not self.__nodes_created:
+            self.nodes_t.create(self.engine, True)
+            self.__nodes_created = True
+        c = self.nodes_t.c
+        conn = self.engine.connect()
+        try:
+            trans = conn.begin()
+            try:
+                conn.execute(self.nodes_t.delete().where(c.expires < now))
+                update = self.nodes_t.update().where(c.node == node).\
+                         values(expires=expires)
+                if conn.execute(update).rowcount == 0:
+                    conn.execute(self.nodes_t.insert().
+                                 values(node=node, expires=expires))
+                nodes = [row[0] for row in conn.execute(select([c.node]))]
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+        finally:
+            conn.close()
+        return nodes
+
+
+class MemoryJobStore(RAMJobStore):
+    """
+    RAMJobStore which can add many jobs at once.
+    The jobs are given ids of the form 'memory-N'.
+    """
+
+    # ids are unique across all the memory stores
+    __ids = itertools.count(1)
+
+    def __init__(self):
+        self.jobs = JobList()
+
+    def add_job(self, job):
+        job.id = 'memory-%d' % next(MemoryJobStore.__ids)
+        self.jobs.append(job)
+
+    def add_jobs(self, jobs):
+        """
+        Adds the given jobs to this store.
+        """
+        for job in jobs:
+            self.add_job(job)
+
+    def remove_jobs(self, jobs):
+        """
+        Removes the given jobs from this store.
+        """
+        for job in jobs:
+            self.jobs.remove(job)
+
+    def remove_all_jobs(self):
+        """
+        Removes all the jobs from this store.
+        """
+        self.jobs = JobList()
+#
+# End of Job Stores
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Sharded Job Store
+#
+# ShardedJobStore options:
+#
+# url, shards : 'shards' tables in the database at url;
+#               shard 0 is the table 'tablename' and
+#               shard k the table 'tablename_k'
+# urls        : one database per shard (a list, or a
+#               comma separated string); the table is
+#               'tablename' in all of them
+#
+# the other options (tablename, batch_size, page_size,
+# ...) are passed to the FrameworkJobStore of every
+# shard; a streaming load reads a page of every shard
+# at a time.
+#
+# A new job goes to the shard of its shard_key (see 
+# job.py), by a stable hash of the key, or else to 
+# the next shard in turn. The id of a job tells its 
+# shard (id % shards), so everything else goes 
+# straight to the shard of the job. The ids of the 
+# jobs change when the number of shards changes.
+#
+def _in_parallel(calls):
+    """
+    Makes the given (func, args) calls, in a thread
+    each if there are several, and waits for all of
+    them. Raises the first exception, if any.
+    """
+    if len(calls) < 2:
+        return [func(*args) for func, args in calls]
+
+    results = [None] * len(calls)
+    errors = []
+    def call(i, func, args):
+        try:
+            results[i] = func(*args)
+        except Exception:
+            errors.append(sys.exc_info())
+    threads = [threading.Thread(target=call, args=(i, func, args))
+               for i, (func, args) in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        exc_type, exc, tb = errors[0]
+        raise exc_type, exc, tb
+    return results
+
+
+class _ShardedJobList(object):
+    """
+    JobList of a ShardedJobStore: a view of 
+    the JobLists of its shards.
+    """
+
+    def __init__(self, store):
+        self.__store = store
+
+    def append(self, job):
+        self.__store.shard_of(job.id).jobs.append(job)
+
+    def extend(self, jobs):
+        for job in jobs:
+            self.append(job)
+
+    def remove(self, job):
+        self.__store.shard_of(job.id).jobs.remove(job)
+
+    def get(self, jobid):
+        return self.__store.shard_of(jobid).jobs.get(jobid)
+
+    def __contains__(self, job):
+        jobid = getattr(job, 'id', None)
+        return jobid is not None and job in self.__store.shard_of(jobid).jobs
+
+    def __iter__(self):
+        return itertools.chain(*[shard.jobs for shard 
+                                 in self.__store.shards])
+
+    def __len__(self):
+        return sum(len(shard.jobs) for shard in self.__store.shards)
+
+    def __repr__(self):
+        return '<%s (%d jobs)>' % (self.__class__.__name__, len(self))
+
+
+class ShardedJobStore(JobStore):
+    """
+    Job store which spreads its jobs over several 
+    FrameworkJobStore shards, tables of one database 
+    or separate databases. Jobs are routed by their
+    shard_key or their id.
+    """
+
+    def __init__(self, url=None, urls=None, shards=None, 
+                 tablename='apscheduler_jobs', **options):
+        if urls:
+            if isinstance(urls, basestring):
+                urls = [u.strip() for u in urls.split(',') if u.strip()]
+            tables = [tablename] * len(urls)
+        elif url:
+            count = max(asint(shards) or 1, 1)
+            urls = [url] * count
+            tables = [tablename] + ['%s_%d' % (tablename, k) 
+                                    for k in range(1, count)]
+        else:
+            raise ValueError('Need either "url" or "urls" defined')
+
+        engines = {}
+        self.shards = []
+        for k, (shard_url, table) in enumerate(zip(urls, tables)):
+            if shard_url not in engines:
+                engines[shard_url] = create_engine(shard_url)
+            self.shards.append(FrameworkJobStore(
+                engine=engines[shard_url], tablename=table, shard=k, 
+                shards=len(urls), **options))
+        self.__turns = itertools.count()
+        self.__loading = []
+        self.jobs = _ShardedJobList(self)
+
+    def shard_of(self, jobid):
+        """
+        Returns the shard storing the job with the given id.
+        """
+        return self.shards[jobid % len(self.shards)]
+
+    def __route(self, job):
+        key = getattr(job, 'shard_key', None)
+        if key is None:
+            k = next(self.__turns)
+        else:
+            if isinstance(key, unicode):
+                key = key.encode('utf-8')
+            k = zlib.crc32(str(key)) & 0xffffffff
+        return self.shards[k % len(self.shards)]
+
+    def __by_shard(self, jobs, route):
+        grouped = OrderedDict()
+        for job in jobs:
+            grouped.setdefault(route(job), []).append(job)
+        return grouped.items()
+
+    @property
+    def horizon(self):
+        return self.shards[0].horizon
+
+    def load_jobs(self):
+        _in_parallel([(shard.load_jobs, ()) for shard in self.shards])
+        self.__loading = list(self.shards)
+
+    def load_next_page(self):
+        """
+        Loads the next page of every shard still 
+        loading, the shards in parallel (see 
+        FrameworkJobStore.load_next_page()).
+        """
+        pages = _in_parallel([(shard.load_next_page, ()) 
+                              for shard in self.__loading])
+        jobs, stubs = [], []
+        for shard, page in zip(list(self.__loading), pages):
+            if page is None:
+                self.__loading.remove(shard)
+            else:
+                jobs.extend(page[0])
+                stubs.extend(page[1])
+        if not self.__loading:
+            return None
+        return jobs, stubs
+
+    def add_job(self, job):
+        self.add_jobs([job])
+
+    def add_jobs(self, jobs):
+        """
+        Adds the given jobs to their shards, the 
+        shards in parallel.
+        """
+        _in_parallel([(shard.add_jobs, (shard_jobs,)) for shard, shard_jobs
+                      in self.__by_shard(jobs, self.__route)])
+
+    def update_job(self, job):
+        self.shard_of(job.id).update_job(job)
+
+    def write_behind(self, updates, ids):
+        """
+        Writes the updates and deletes of every shard 
+        (see FrameworkJobStore.write_behind()), the
+        shards in parallel.
+        """
+        grouped = OrderedDict()
+        for update in updates:
+            grouped.setdefault(self.shard_of(update[0]), 
+                               ([], []))[0].append(update)
+        for jobid in ids:
+            grouped.setdefault(self.shard_of(jobid), ([], []))[1].append(jobid)
+        _in_parallel([(shard.write_behind, shard_writes) 
+                      for shard, shard_writes in grouped.items()])
+
+    def remove_job(self, job):
+        self.shard_of(job.id).remove_jobs([job])
+
+    def remove_jobs(self, jobs):
+        _in_parallel([(shard.remove_jobs, (shard_jobs,)) 
+                      for shard, shard_jobs in 
+                      self.__by_shard(jobs, lambda job: 
+                                      self.shard_of(job.id))])
+
+    def remove_all_jobs(self):
+        _in_parallel([(shard.remove_all_jobs, ()) for shard in self.shards])
+
+    def claim_job(self, job, node, now, expires):
+        return self.shard_of(job.id).claim_job(job, node, now, expires)
+
+    def release_job(self, job, node):
+        return self.shard_of(job.id).release_job(job, node)
+
+    def peek_job(self, job):
+        return self.shard_of(job.id).peek_job(job)
+
+    def peek_jobs(self):
+        rows = {}
+        for shard_rows in _in_parallel([(shard.peek_jobs, ()) 
+                                        for shard in self.shards]):
+            rows.update(shard_rows)
+        return rows
+
+    def peek_changes(self, since):
+        rows = {}
+        for shard_rows in _in_parallel([(shard.peek_changes, (since,)) 
+                                        for shard in self.shards]):
+            rows.update(shard_rows)
+        return rows
+
+    def track_removals(self):
+        for shard in self.shards:
+            shard.track_removals()
+
+    def removed_since(self, since):
+        ids = []
+        for shard_ids in _in_parallel([(shard.removed_since, (since,)) 
+                                       for shard in self.shards]):
+            if shard_ids is None:
+                return None
+            ids.extend(shard_ids)
+        return ids
+
+    def __by_shard_ids(self, method, ids):
+        grouped = {}
+        for jobid in ids:
+            grouped.setdefault(self.shard_of(jobid), []).append(jobid)
+        jobs = []
+        for shard_jobs in _in_parallel([(getattr(shard, method), 
+                                         (shard_ids,)) 
+                                        for shard, shard_ids 
+                                        in grouped.items()]):
+            jobs.extend(shard_jobs)
+        return jobs
+
+    def read_jobs(self, ids):
+        return self.__by_shard_ids('read_jobs', ids)
+
+    def fetch_jobs(self, ids):
+        return self.__by_shard_ids('fetch_jobs', ids)
+
+    def iter_ids(self, job_filter=None, order_by=None):
+        """
+        Merges the iter_ids() of the shards, in the 
+        order of the key.
+        """
+        return merge(*[shard.iter_ids(job_filter, order_by) 
+                       for shard in self.shards])
+
+    def count_jobs(self, job_filter=None):
+        return sum(_in_parallel([(shard.count_jobs, (job_filter,)) 
+                                 for shard in self.shards]))
+
+    def heartbeat(self, node, now, expires):
+        # the nodes table of the first shard
+        return self.shards[0].heartbeat(node, now, expires)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def __repr__(self):
+        return '<%s (%d shards)>' % (self.__class__.__name__, 
+                                     len(self.shards))
+#
+# End of Sharded Job Store
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,140 @@
+"""
+LogUtil
+
+Logging helpers of the Scheduler (see scheduler.py):
+
+ [1] QueueHandler : hands the log records to a thread
+                    which formats and writes them, so
+                    that logging does no I/O in the
+                    scheduler and worker threads
+ [2] log_event()  : logs a job lifecycle event (run,
+                    executed, ...) sampled: only 1 in N
+                    of the events of a kind is logged,
+                    the others cost a counter increment
+"""
+
+from threading import Thread
+import itertools
+import logging
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+__all__ = ('QueueHandler', 'log_event', 'set_sampling')
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Queue Handler
+#
+# the records are formatted by the logging thread, so
+# the arguments of a record (a job, for instance) are
+# shown as they are when it is written. When the queue
+# is full, records are dropped, and the number of the
+# dropped records is logged with the next one written.
+#
+class QueueHandler(logging.Handler):
+    """
+    Handler which queues the records for a
+    thread writing them with another handler.
+    """
+
+    def __init__(self, target, maxsize=10000):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.dropped = 0
+        self.__queue = Queue(maxsize)
+        self.__thread = Thread(target=self.__write, name='SchedulerLogging')
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def handle(self, record):
+        # no lock needed, the queue has its own
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        try:
+            self.__queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def __write(self):
+        while True:
+            record = self.__queue.get()
+            try:
+                if record is None:
+                    break
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    self.target.handle(logging.makeLogRecord({
+                        'name': __name__, 'levelno': logging.WARNING,
+                        'levelname': 'WARNING',
+                        'msg': '%d log records were dropped, the logging '
+                               'queue was full' % dropped}))
+                self.target.handle(record)
+            except Exception:
+                self.handleError(record)
+            finally:
+                self.__queue.task_done()
+
+    def flush(self):
+        """
+        Waits until the queued records are written.
+        """
+        if self.__thread.is_alive():
+            self.__queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+        self.target.close()
+        logging.Handler.close(self)
+#
+# End of Queue Handler
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Sampled Events
+#
+# _g_sampling : event -> N, only 1 in N of the events
+#               is logged; 0 for none [default: 1, all]
+# _g_counts   : event -> counter of its occurrences
+#
+_g_sampling = {}
+_g_counts = {}
+
+
+def set_sampling(sampling):
+    """
+    Sets the sampling of the events from a dict
+    event -> N; the events not given log all.
+    """
+    global _g_sampling, _g_counts
+    _g_counts = dict((event, itertools.count())
+                     for event in sampling)
+    _g_sampling = dict((event, int(n)) for event, n in sampling.items())
+
+
+def log_event(logger, event, level, msg, *args, **kwargs):
+    """
+    Logs msg % args with the given logger and level,
+    if this occurrence of the event is sampled.
+    """
+    n = _g_sampling.get(event, 1)
+    if n != 1:
+        if n <= 0 or next(_g_counts[event]) % n:
+            return
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args, **kwargs)
+#
+# End of Sampled Events
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
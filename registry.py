@@ -0,0 +1,205 @@
+"""
+Registry
+
+Stable references for the callables of the jobs
+(see job.py).
+
+APScheduler refers to a callable as 'module:name'.
+For a bound method, get_callable_name() (patched by
+apscheduler-patch) finds the name of the instance
+by comparing it with every attribute of its module,
+on every job added and every job persisted; and an
+instance which is not a module attribute has no
+reference at all.
+
+ [1] register(name, obj) : obj (an instance, function
+     or class) is referred to as
+     'registry:registered.<name>' and its methods as
+     'registry:registered.<name>.<method>'. These are
+     resolved by APScheduler's ref_to_obj(), so the
+     jobs of a persistent job store are loaded again
+     after a restart, once obj is registered again
+     (before the scheduler starts).
+ [2] callable_ref(), callable_name() : reference and
+     name of a callable, cached by the identity of
+     the callable (of the instance and function for
+     a bound method), for as long as it lives.
+"""
+
+from apscheduler.util import obj_to_ref, get_callable_name
+import threading
+import weakref
+import re
+
+__all__ = ('register', 'registered', 'callable_ref', 'callable_name')
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Registered Objects
+#
+# registered : namespace of the registered objects,
+#              looked up by ref_to_obj()
+# _g_names   : id of a registered object -> its name
+#
+class _Registered(object):
+    """
+    Namespace of the registered objects.
+    """
+
+    def __repr__(self):
+        return '<registered (%s)>' % ', '.join(sorted(self.__dict__))
+
+
+registered = _Registered()
+_g_names = {}
+_g_lock = threading.Lock()
+_g_prefix = '%s:registered.' % __name__
+_g_name_re = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def register(name, obj):
+    """
+    Registers obj under the given name, replacing
+    the object registered under that name, if any.
+    The name must be a valid Python identifier.
+    """
+    if not _g_name_re.match(name):
+        raise ValueError('Invalid name "%s": it must be a valid '
+                         'Python identifier' % name)
+    _g_lock.acquire()
+    try:
+        old = registered.__dict__.get(name)
+        if old is not None and _g_names.get(id(old)) == name:
+            del _g_names[id(old)]
+        setattr(registered, name, obj)
+        _g_names[id(obj)] = name
+
+        # the cached references may change
+        _g_refs.clear()
+        _g_method_refs.clear()
+    finally:
+        _g_lock.release()
+
+
+def _registered_name(obj):
+    name = _g_names.get(id(obj))
+    if name is not None and registered.__dict__.get(name) is obj:
+        return name
+#
+# End of Registered Objects
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Reference Cache
+#
+# _g_refs        : callable -> (reference, name)
+# _g_method_refs : instance -> {function: (reference,
+#                  name)}, for the bound methods,
+#                  which are new objects on every
+#                  attribute access
+#
+# a callable without a reference is not cached: it
+# may get one later (a decorated function becomes a
+# module attribute only after the decorator returns)
+#
+class _IdentityCache(object):
+    """
+    Maps objects, by identity, to values for as long as
+    the objects live. Objects which cannot be weakly
+    referenced are not cached.
+    """
+
+    def __init__(self):
+        self.__values = {}
+
+    def get(self, obj, default=None):
+        entry = self.__values.get(id(obj))
+        if entry is not None and entry[0]() is obj:
+            return entry[1]
+        return default
+
+    def set(self, obj, value):
+        key = id(obj)
+        values = self.__values
+        def forget(wref):
+            entry = values.get(key)
+            if entry is not None and entry[0] is wref:
+                del values[key]
+        try:
+            values[key] = (weakref.ref(obj, forget), value)
+        except TypeError:
+            pass
+
+    def clear(self):
+        self.__values.clear()
+
+
+_g_refs = _IdentityCache()
+_g_method_refs = _IdentityCache()
+
+
+def _find_ref(func):
+    """
+    Returns the (reference, name) of the given
+    callable; the reference is None if it has none.
+    """
+    name = _registered_name(func)
+    if name is not None:
+        return _g_prefix + name, name
+
+    f_self = getattr(func, '__self__', None)
+    if f_self is not None and hasattr(func, '__name__'):
+        name = _registered_name(f_self)
+        if name is not None:
+            name = '%s.%s' % (name, func.__name__)
+            return _g_prefix + name, name
+
+    try:
+        ref = obj_to_ref(func)
+    except Exception:
+        return None, get_callable_name(func)
+    return ref, ref.split(':', 1)[1]
+
+
+def _cached_ref(func):
+    f_self = getattr(func, '__self__', None)
+    f_func = getattr(func, '__func__', None)
+    if f_self is not None and f_func is not None:
+        refs = _g_method_refs.get(f_self)
+        if refs is None:
+            refs = {}
+            _g_method_refs.set(f_self, refs)
+        entry = refs.get(f_func)
+        if entry is None:
+            entry = _find_ref(func)
+            if entry[0] is not None:
+                refs[f_func] = entry
+        return entry
+
+    entry = _g_refs.get(func)
+    if entry is None:
+        entry = _find_ref(func)
+        if entry[0] is not None:
+            _g_refs.set(func, entry)
+    return entry
+
+
+def callable_ref(func):
+    """
+    Returns the reference of the given callable,
+    or None if it cannot be referred to.
+    """
+    return _cached_ref(func)[0]
+
+
+def callable_name(func):
+    """
+    Returns the display name of the given callable.
+    """
+    return _cached_ref(func)[1]
+#
+# End of Reference Cache
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,329 @@
+"""
+RunQueue
+
+The queue of the runs waiting for a thread of the
+Scheduler's thread pool (see scheduler.py):
+
+ [1] priority        : the runs of the jobs with a higher
+                       priority start first; first in,
+                       first out within a priority
+ [2] max_concurrency : max number of runs of a callable
+                       in the threads at once; the other
+                       runs of that callable wait, without
+                       holding back the other callables
+ [3] maxsize         : max number of runs waiting; when
+                       the queue is full, a new run is
+                       handled by the overflow policy
+
+overflow policies:
+
+  skip        : the new run is missed
+  coalesce    : the new run is merged into the waiting
+                run of the same job, if any, else missed
+  block       : the scheduler waits for room, at most
+                block_timeout seconds, then skips; the
+                timeout can be shared by the runs of
+                one pass of the scheduler (see since
+                in put_run())
+  drop_oldest : the oldest waiting run of the lowest
+                priority is missed instead of the new
+                one, unless its priority is higher
+
+The missed runs are returned to the scheduler, which
+reports them as missed jobs. A shutdown of the thread
+pool which waits for the jobs starts the runs queued
+before it first.
+"""
+
+from apscheduler.threadpool import ThreadPool
+from heapq import heappush, heappop, heapify
+from threading import currentThread
+import threading
+import itertools
+import time
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+__all__ = ('RunQueue', 'RunThreadPool')
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Run Queue
+#
+# _ready  : min-heap of (-priority, seq, run), the runs
+#           which may start, highest priority first
+# _parked : callable -> heap of its runs waiting for
+#           one of its runs to finish (max_concurrency)
+# _evict  : min-heap of (priority, seq, run), the runs to
+#           drop first; only kept for drop_oldest
+#
+# a run leaves the queue by starting or being dropped;
+# the heap entries of such a run are stale and skipped.
+#
+_g_overflows = ('skip', 'coalesce', 'block', 'drop_oldest')
+
+
+class _Run(object):
+    __slots__ = ('job', 'run_times', 'run', 'priority', 'group', 'cap',
+                 'seq', 'queued')
+
+    def __init__(self, job, run_times, run, priority, group, cap, seq):
+        self.job = job
+        self.run_times = run_times
+        self.run = run
+        self.priority = priority
+        self.group = group
+        self.cap = cap
+        self.seq = seq
+        self.queued = True
+
+
+class RunQueue(object):
+    """
+    Bounded priority queue of the runs of the jobs, with
+    a concurrency cap per callable. It is the queue of a
+    RunThreadPool: get() is called by its threads.
+    """
+
+    def __init__(self, maxsize=0, overflow='skip', block_timeout=10):
+        if overflow not in _g_overflows:
+            raise ValueError('overflow must be one of: %s' %
+                             ', '.join(_g_overflows))
+        self.maxsize = int(maxsize or 0)
+        self.overflow = overflow
+        self.block_timeout = float(block_timeout)
+        self._ready = []
+        self._parked = {}
+        self._evict = []
+        self._running = {}
+        self._waiting_jobs = {}
+        self._tasks = []
+        self._size = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def qsize(self):
+        """
+        Number of runs waiting.
+        """
+        return self._size
+
+    def join(self):
+        """
+        Waits until no run is waiting: all of them
+        were started or dropped.
+        """
+        self._cond.acquire()
+        try:
+            while self._size:
+                self._cond.wait()
+        finally:
+            self._cond.release()
+
+    def put(self, task, block=True, timeout=None):
+        """
+        Queues a (func, args, kwargs) task of the thread
+        pool itself; it goes before all the runs.
+        """
+        self._cond.acquire()
+        try:
+            self._tasks.append(task)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def put_run(self, job, run_times, run, priority=0, group=None, cap=None,
+                since=None):
+        """
+        Queues the runs of a job, to be started with
+        run(job, run_times) by a thread of the pool.
+        group is the callable of the job, limited to
+        cap runs at once (None for no limit). With the
+        block overflow, the wait ends block_timeout 
+        seconds after since (a time.time(), default 
+        now).
+
+        Returns the (job, run_times) which are missed
+        because the queue is full: the new one, or the
+        one dropped for it.
+        """
+        self._cond.acquire()
+        try:
+            new = _Run(job, run_times, run, priority, group, cap,
+                       next(self._seq))
+            dropped = []
+            if self.maxsize and self._size >= self.maxsize:
+                if self.overflow == 'block':
+                    deadline = (since or time.time()) + self.block_timeout
+                    while self._size >= self.maxsize:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return [(job, run_times)]
+                        self._cond.wait(remaining)
+                elif self.overflow == 'coalesce':
+                    waiting = self._waiting_jobs.get(job.id)
+                    if waiting is not None and waiting.queued:
+                        waiting.run_times.extend(run_times)
+                        return []
+                    return [(job, run_times)]
+                elif self.overflow == 'drop_oldest':
+                    victim = self.__pop_victim(priority)
+                    if victim is None:
+                        return [(job, run_times)]
+                    dropped.append((victim.job, victim.run_times))
+                else:
+                    return [(job, run_times)]
+
+            self._size += 1
+            self._waiting_jobs[job.id] = new
+            heappush(self._ready, (-priority, new.seq, new))
+            if self.overflow == 'drop_oldest':
+                if len(self._evict) > 2 * self._size + 1024:
+                    self._evict = [entry for entry in self._evict
+                                   if entry[2].queued]
+                    heapify(self._evict)
+                heappush(self._evict, (priority, new.seq, new))
+            self._cond.notify()
+            return dropped
+        finally:
+            self._cond.release()
+
+    def __pop_victim(self, priority):
+        # the oldest run of the lowest priority, if it is
+        # not higher than the given priority
+        heap = self._evict
+        while heap and not heap[0][2].queued:
+            heappop(heap)
+        if not heap or heap[0][0] > priority:
+            return None
+        victim = heappop(heap)[2]
+        self.__dequeue(victim)
+        return victim
+
+    def __dequeue(self, run):
+        run.queued = False
+        self._size -= 1
+        if self._waiting_jobs.get(run.job.id) is run:
+            del self._waiting_jobs[run.job.id]
+        # room for a blocked put_run()
+        self._cond.notify_all()
+
+    def __pop_ready(self):
+        if self._tasks:
+            return self._tasks.pop(0)
+        heap = self._ready
+        while heap:
+            run = heappop(heap)[2]
+            if not run.queued:
+                continue
+            if run.cap and self._running.get(run.group, 0) >= run.cap:
+                heappush(self._parked.setdefault(run.group, []),
+                         (-run.priority, run.seq, run))
+                continue
+            self.__dequeue(run)
+            if run.cap:
+                self._running[run.group] = \
+                    self._running.get(run.group, 0) + 1
+            return (self.__start, (run,), {})
+
+    def get(self, block=True, timeout=None):
+        """
+        Returns the next (func, args, kwargs) task for
+        a thread; raises Empty as Queue.get() does.
+        """
+        self._cond.acquire()
+        try:
+            deadline = timeout is not None and time.time() + timeout
+            while True:
+                task = self.__pop_ready()
+                if task is not None:
+                    return task
+                if not block:
+                    raise Empty
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Empty
+                    self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+
+    def __start(self, run):
+        try:
+            run.run(run.job, run.run_times)
+        finally:
+            if run.cap:
+                self.__done(run.group)
+
+    def __done(self, group):
+        # a run of group finished, one of its parked runs may start
+        self._cond.acquire()
+        try:
+            count = self._running.get(group, 1) - 1
+            if count:
+                self._running[group] = count
+            else:
+                self._running.pop(group, None)
+            parked = self._parked.get(group)
+            while parked:
+                entry = heappop(parked)
+                if entry[2].queued:
+                    heappush(self._ready, entry)
+                    self._cond.notify()
+                    break
+            if not parked:
+                self._parked.pop(group, None)
+        finally:
+            self._cond.release()
+#
+# End of Run Queue
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Run Thread Pool
+#
+class RunThreadPool(ThreadPool):
+    """
+    APScheduler ThreadPool whose threads take
+    their work from a RunQueue.
+    """
+
+    def __init__(self, queue, **options):
+        ThreadPool.__init__(self, **options)
+        self._queue = queue
+
+    def submit_run(self, job, run_times, run, priority=0, group=None,
+                   cap=None, since=None):
+        """
+        Queues the runs of a job (see RunQueue.put_run());
+        returns the runs missed as the queue is full.
+        """
+        if self._shutdown:
+            raise RuntimeError('Cannot schedule new tasks after shutdown')
+        dropped = self._queue.put_run(job, run_times, run, priority,
+                                      group, cap, since)
+        self._adjust_threadcount()
+        return dropped
+
+    def shutdown(self, wait=True):
+        """
+        Shuts down the pool; with wait, once the queued
+        runs are started, as the threads leave on their
+        next task after a shutdown. From a thread of
+        the pool, the queued runs are not waited for.
+        """
+        if wait and not self._shutdown and \
+           currentThread() not in self._threads:
+            self._queue.join()
+        ThreadPool.shutdown(self, wait)
+#
+# End of Run Thread Pool
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -13,7 +13,37 @@ the following functions (and its decorators):
 
 from apscheduler.scheduler import SchedulerAlreadyRunningError
 from apscheduler.scheduler import Scheduler as APScheduler
+from apscheduler.triggers import SimpleTrigger, IntervalTrigger, CronTrigger
+from apscheduler.events import JobStoreEvent, EVENT_JOBSTORE_JOB_ADDED
+from apscheduler.events import EVENT_JOBSTORE_JOB_REMOVED
+from apscheduler.events import JobEvent, EVENT_JOB_MISSED
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from apscheduler.events import SchedulerEvent, EVENT_SCHEDULER_START
+from apscheduler.events import EVENT_SCHEDULER_SHUTDOWN
+from apscheduler.job import MaxInstancesReachedError
+from apscheduler.util import combine_opts, asint, asbool, maybe_ref
+from apscheduler.util import time_difference
+from cronexpr import CompiledCronTrigger, make_cron_trigger
+from job import FrameworkJob, dump_call, call_in_process
+from registry import register
+from stats import Stats
+from runqueue import RunQueue, RunThreadPool
+from logutil import QueueHandler, log_event, set_sampling
+from cluster import Cluster
+from clock import PreciseEvent
+from simulate import simulate
+from sinks import Subscription, event_mask
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from heapq import heappush, heappop, heapify, merge, nsmallest
+from operator import attrgetter
+import itertools
+import threading
+import traceback
+import time
+import sys
+import os
 import logging
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -27,19 +57,74 @@ import logging
 # __g_log_format    : logging format for the scheduler
 #                     [default: "date & time : level : msg"]
 #
-# TODO: Sechudler.configure() should accept the above
-#       mentioned logging parameters from the user and 
-#       configure the logging.basicConfig accordingly
-#       (or) read these input from a config file.
+# Scheduler.configure() takes these (and more) as
+# apscheduler.logging.* parameters:
+#
+#   file   : log file [default: __g_log_file]
+#   level  : log level [default: __g_log_level]
+#   format : logging format [default: __g_log_format]
+#   levels : log levels of given loggers, as a dict or
+#            as 'name=LEVEL, ...', for instance 
+#            'apscheduler=WARNING' [default: none]
+#   queue  : True to format and write the log in a 
+#            thread of its own (see logutil.py), not in
+#            the scheduler threads [default: False]
+#   queue_size : max number of records waiting to be
+#            written; more are dropped [default: 10000]
+#   sample.<event> : log only 1 in N of the job events 
+#            of that kind, 0 for none [default: 1, all];
+#            events: run, executed, error, missed, 
+#            skipped, overflow, added and removed
+#
+# like logging.basicConfig(), no log file is set up if
+# the application has handlers of its own on the root
+# logger; levels and sampling apply all the same.
 #
 __g_log_file   = '/tmp/scheduler_logs'
 __g_log_level  = logging.DEBUG
 __g_log_format = '[%(asctime)s]: %(levelname)s : %(message)s'
 
-# configure logging
-logging.basicConfig(filename=__g_log_file, 
-                    level=__g_log_level, 
-                    format=__g_log_format)
+# the handler set up by _configure_logging(), if any
+_g_log_state = {'configured': False, 'handler': None}
+
+
+def _log_level(level):
+    if isinstance(level, basestring):
+        return logging.getLevelName(level.strip().upper())
+    return level
+
+
+# configure logging, this is done when the 
+# APScheduler handle is created (not on import)
+# and when the logging parameters change
+def _configure_logging(opts={}):
+    set_sampling(combine_opts(opts, 'sample.'))
+    levels = opts.get('levels') or {}
+    if isinstance(levels, basestring):
+        levels = dict(item.split('=', 1) for item in levels.split(',')
+                      if '=' in item)
+    for name, level in levels.items():
+        logging.getLogger(name.strip()).setLevel(_log_level(level))
+
+    root = logging.getLogger()
+    old = _g_log_state['handler']
+    _g_log_state['configured'] = True
+    if old is None and root.handlers:
+        return
+    handler = logging.FileHandler(opts.get('file', __g_log_file))
+    handler.setFormatter(logging.Formatter(opts.get('format', 
+                                                    __g_log_format)))
+    if asbool(opts.get('queue', False)):
+        handler = QueueHandler(handler, 
+                               asint(opts.get('queue_size', 10000)))
+    root.addHandler(handler)
+    root.setLevel(_log_level(opts.get('level', __g_log_level)))
+    _g_log_state['handler'] = handler
+    if old is not None:
+        root.removeHandler(old)
+        old.close()
+
+logger = logging.getLogger(__name__)
 #
 # End of Logging
 # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -75,6 +160,15 @@ class UnSupportedFeature(Exception):
     def __str__(self):
         return 'This feature is not ' \
                'currently supported.'
+
+class BackendAlreadyCreatedError(Exception):
+    """
+    Raised when attempting to replace the 
+    APScheduler backend after it was created.
+    """
+    def __str__(self):
+        return 'The scheduler backend ' \
+               'has already been created'
 #
 # Add more exception classes above!
 #
@@ -133,8 +227,110 @@ __db_url = 'mysql://%s:%s@%s/%s' % \
 #                 [default: apscheduler.jobstore.default.url]
 # __jbs_table   : apscheduler class name for default table name
 #                 [default: apscheduler.jobstore.default.tablename]
-# __jbs_sqlalchemy : apscheduler class name for SQLAlchemy jobstore
-# [default: apscheduler.jobstores.sqlalchemy_store:SQLAlchemyJobStore]
+# __jbs_sqlalchemy : class name for SQLAlchemy jobstore
+#                 [default: jobstore:FrameworkJobStore]
+#
+# the jobs can be spread over several tables or databases
+# with the class jobstore:ShardedJobStore and either
+#   apscheduler.jobstore.default.shards : number of tables
+#                 in the database at the url
+#   apscheduler.jobstore.default.urls   : one database url
+#                 per shard (comma separated)
+# see jobstore.py
+#
+# apscheduler.jobstore.default.page_size : load the jobs 
+#                 in pages of that many rows, the most 
+#                 imminent first; the scheduler starts 
+#                 firing once the first page is loaded
+#                 [default: 0, all the jobs at once]
+# apscheduler.jobstore.default.horizon : seconds; with 
+#                 page_size, the jobs due later than that
+#                 are kept as stubs until they are about
+#                 to be due [default: 0, none]
+#
+# apscheduler.processpool.max_workers : number of worker
+#                 processes running the jobs scheduled
+#                 with executor='process'
+#                 [default: number of CPUs]
+#
+# apscheduler.stats.export : callable (or 'module:name' 
+#                 reference) called with the snapshot 
+#                 of Scheduler.get_stats() every 
+#                 export_interval [default: none]
+# apscheduler.stats.export_interval : seconds between 
+#                 two exports [default: 60]
+#
+# apscheduler.runqueue.maxsize : max number of runs 
+#                 waiting for a thread [default: 0, no limit]
+# apscheduler.runqueue.overflow : what happens to a run 
+#                 when the run queue is full: skip, 
+#                 coalesce, block or drop_oldest 
+#                 (see runqueue.py) [default: skip]
+# apscheduler.runqueue.block_timeout : max seconds the 
+#                 scheduler waits for room with the block
+#                 policy, in all for the runs due at once;
+#                 the job stores are not locked meanwhile
+#                 [default: 10]
+# apscheduler.runqueue.max_concurrency : default max 
+#                 number of runs of a callable at once
+#                 [default: none, no limit]
+#
+# apscheduler.jitter : default jitter of the jobs, in 
+#                 seconds: their fire times are spread 
+#                 over that window (see job.py) [default: 0];
+#                 the window of a job is at most its 
+#                 misfire_grace_time, a warning is logged
+#                 when it is cut short
+#
+# apscheduler.ephemeral.horizon : seconds; the at() and 
+#                 after() jobs due within that time, and the
+#                 jobs scheduled with durable=False, are kept
+#                 in a memory job store instead of the SQL 
+#                 'default' one: they are not written to the
+#                 database and do not survive a restart
+#                 [default: 0, only the durable=False jobs]
+# apscheduler.ephemeral.jobstore : alias of that memory 
+#                 job store, added on its first job
+#                 [default: ephemeral]
+#
+# apscheduler.writebehind.interval : seconds between two
+#                 writes of the next run times (and deletes
+#                 of the finished jobs) to the SQL job store,
+#                 grouped in a few transactions instead of 
+#                 one per fire [default: 0, written at once]
+# apscheduler.writebehind.batch_size : the writes are also
+#                 done once that many are waiting 
+#                 [default: 1000]
+#
+# apscheduler.wakeup.precise : the main loop sleeps until 
+#                 the next fire time in select(), on a 
+#                 monotonic clock, and wakes up within a 
+#                 fraction of a millisecond (see clock.py); 
+#                 else in threading.Event.wait(), which 
+#                 times out on the wall clock and, in 
+#                 Python 2, is woken up (for a job added)
+#                 up to 50 ms late [default: True]
+# apscheduler.wakeup.spin : seconds; the last part of each
+#                 wait is spent spinning, for fire times 
+#                 within microseconds [default: 0]
+#
+# with sub-second schedules (milliseconds in every() and 
+# after(), fractional seconds in cron()), the runs start
+# sooner on the threads of apscheduler.threadpool.
+# core_threads, which wait for them without a timeout.
+#
+# apscheduler.sinks.maxsize : max number of events queued
+#                 for each sink of subscribe(); the others
+#                 are dropped and counted (see sinks.py)
+#                 [default: 10000]
+#
+# apscheduler.cluster.enabled : several processes share
+#                 the jobs of the SQL job store, and each
+#                 fire time is run by one of them only
+#                 (see cluster.py) [default: False]
+# apscheduler.cluster.node, .lease_time, .handoff,
+#                 .sync_interval and .sync_overlap : see 
+#                 cluster.py
 # 
 # TODO: update __jbs_tn with appropriate table name
 # TODO: read these parameters from a config file
@@ -144,7 +340,7 @@ __jbs_tn    = 'Framework_Jobs'
 __jbs_class = 'apscheduler.jobstore.%s.class' % __jbs_name
 __jbs_url   = 'apscheduler.jobstore.%s.url' % __jbs_name
 __jbs_table = 'apscheduler.jobstore.%s.tablename' % __jbs_name
-__jbs_sqlalchemy = 'apscheduler.jobstores.sqlalchemy_store:SQLAlchemyJobStore'
+__jbs_sqlalchemy = 'jobstore:FrameworkJobStore'
 
 # APScheduler (preferred) default configuration
 _g_aps_default_sql_config = {
@@ -161,6 +357,1750 @@ _g_aps_default_sql_config = {
 # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Job Filter
+#
+# trigger kinds, as named by the Scheduler functions
+#
+_g_trigger_kinds = {
+    'at'    : SimpleTrigger,
+    'after' : SimpleTrigger,
+    'every' : IntervalTrigger,
+    'cron'  : (CronTrigger, CompiledCronTrigger),
+}
+
+# orders of the job listing (see iter_jobs()), by key
+_g_job_orders = {
+    'id'            : attrgetter('id'),
+    'name'          : attrgetter('name'),
+    'next_run_time' : attrgetter('next_run_time'),
+}
+
+class JobFilter(object):
+    """
+    Selects jobs by the given criteria; a job 
+    matches when it meets all of them.
+
+    predicate   : callable which takes a job and 
+                  returns True to select it
+    trigger     : 'at', 'after', 'every' or 'cron'
+    func        : the callable function of the job
+    name_prefix : prefix of the job name
+    next_run_after  : next run time is at or after
+    next_run_before : next run time is before
+    """
+
+    def __init__(self, predicate=None, trigger=None, func=None, 
+                 name_prefix=None, next_run_after=None, 
+                 next_run_before=None):
+        if trigger is not None and trigger not in _g_trigger_kinds:
+            raise UnSupportedParameter
+        self.predicate = predicate
+        self.trigger = trigger
+        self.func = func
+        self.name_prefix = name_prefix
+        self.next_run_after = next_run_after
+        self.next_run_before = next_run_before
+
+    def is_empty(self):
+        """
+        True if no criteria were given.
+        """
+        return self.predicate is None and self.trigger is None and \
+               self.func is None and self.name_prefix is None and \
+               self.next_run_after is None and \
+               self.next_run_before is None
+
+    def matches(self, job):
+        """
+        True if the given job meets all the criteria.
+        """
+        if self.trigger is not None and \
+           not isinstance(job.trigger, _g_trigger_kinds[self.trigger]):
+            return False
+        if self.func is not None and job.func != self.func:
+            return False
+        if self.name_prefix is not None and \
+           not job.name.startswith(self.name_prefix):
+            return False
+        if self.next_run_after is not None and \
+           (job.next_run_time is None or 
+            job.next_run_time < self.next_run_after):
+            return False
+        if self.next_run_before is not None and \
+           (job.next_run_time is None or 
+            job.next_run_time >= self.next_run_before):
+            return False
+        if self.predicate is not None and not self.predicate(job):
+            return False
+        return True
+#
+# End of Job Filter
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# APScheduler Backend
+#
+# _Backend extends APScheduler so that many jobs can
+# be validated and persisted together: each job store
+# gets one add_jobs() call (when it has one) and the
+# scheduler thread is woken up only once.
+#
+# It also keeps the stored jobs indexed in memory, 
+# guarded by _jobstores_lock:
+#
+# _jobs_by_id   : job id -> (job, jobstore alias)
+# _jobs_by_func : callable -> {job id: job}
+#
+# the indexes are updated whenever a job is added, 
+# removed or finished (after its last run), and when 
+# a job store is added (loaded) or removed.
+#
+# _due_heap : min-heap of (next run time, seq, job id)
+#
+# the main loop pops the due jobs from _due_heap, 
+# instead of walking all the jobs on every wakeup.
+# Entries are not removed with their jobs; an entry 
+# is stale (and skipped) when its job is gone or has 
+# another next run time. The heap is rebuilt when it 
+# holds too many stale entries.
+#
+# _process_pool : multiprocessing.Pool running the jobs
+#                 with executor='process'; created when 
+#                 the scheduler starts if any such job 
+#                 is scheduled (else on the first one), 
+#                 before the scheduler threads run jobs
+#
+# _stats : counters and histograms of the runs and 
+#          of the job store operations (see stats.py)
+#
+# _threadpool : RunThreadPool, whose threads take the 
+#          runs from a RunQueue (see runqueue.py) by 
+#          priority and within the max_concurrency of 
+#          their callables; unless apscheduler.threadpool
+#          gives a thread pool of its own
+#
+# _cluster  : Cluster of the clustered mode, else None;
+#             the jobs of the job stores which can claim
+#             jobs are run only once claimed
+# _deferred : min-heap of (time, seq, job id, runs), the
+#             due jobs to claim again at 'time' (after the
+#             handoff delay, or when a lease expires);
+#             an entry is stale once the job's runs change
+#
+# _loading   : aliases of the job stores still loading 
+#              pages (see load_next_page() in jobstore.py);
+#              the SchedulerLoader thread loads one page 
+#              of each in turn once the scheduler started
+# _stubs     : job id -> jobstore alias, the stored jobs 
+#              not loaded yet as they are due beyond the
+#              horizon of their job store
+# _stub_heap : min-heap of (time, job id), when to fetch 
+#              the stubs (their next run time - horizon);
+#              an entry is stale once its stub is gone
+#
+# _dirty : job id -> (job, jobstore alias), the jobs whose
+#          next run time and runs are to be written, in 
+#          the write-behind mode
+# _dead  : (jobstore alias, job id) of the finished jobs 
+#          whose rows are to be deleted, in that mode
+#
+# in the write-behind mode, the SchedulerWriter thread 
+# writes them every writebehind.interval, or once there 
+# are writebehind.batch_size of them, with one 
+# write_behind() call per job store, holding the lock so 
+# that the writes cannot interleave with the other 
+# changes of the job store; and once more on shutdown. 
+# Only the latest next run time of a job is written.
+#
+# A crash loses the writes waiting: on restart, the jobs 
+# fired in the last interval are loaded with their 
+# previous next run time and runs, and are fired again, 
+# once if they coalesce, if within their 
+# misfire_grace_time (else they are missed); the at() and
+# after() jobs which finished in that interval are fired
+# (or missed) again, then removed. The jobs of a 
+# clustered job store are always written at once.
+#
+# _settled : deque of (job, run time, exception or None),
+#            the runs finished (or missed), queued by the
+#            threads which ran them; the main loop settles
+#            them under the lock: it schedules the retry of
+#            a failed run (see the retry options in job.py),
+#            and removes a finished job once it has neither 
+#            a run left nor a retry pending
+#
+# a retry is checkpointed to the job store of its job 
+# (retry_at and retry_attempt, with the next run time) 
+# and fired from the due heap like a fire time, as a run
+# of the same job; in the clustered mode, the at() and 
+# after() jobs are not retried after their last run.
+#
+# the operations which need all the jobs (unschedule_func(),
+# unschedule_where() with a filter, or a lookup of a job 
+# not loaded yet) first load the pages left and fetch all
+# the stubs. The job listing (iter_jobs()) reads the jobs
+# not loaded from their job store instead.
+#
+# _g_list_chunk : number of jobs listed by iter_jobs() 
+#                 per acquisition of the lock
+#
+_g_list_chunk = 500
+
+class _Backend(APScheduler):
+    """
+    APScheduler with bulk job registration 
+    and job lookup by id or by callable.
+    """
+
+    def __init__(self, gconfig={}, **options):
+        # the indexes must exist before the job 
+        # stores are loaded by configure()
+        self._jobs_by_id = {}
+        self._jobs_by_func = {}
+        self._due_heap = []
+        self._due_seq = itertools.count()
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self._stats = Stats()
+        self._stats_stop = threading.Event()
+        self._cluster = None
+        self._cluster_stop = threading.Event()
+        self._cluster_thread = None
+        self._deferred = []
+        self._loading = []
+        self._stubs = {}
+        self._stub_heap = []
+        self._loader_stop = threading.Event()
+        self._loader_thread = None
+        self._dirty = {}
+        self._dead = []
+        self._writer_stop = threading.Event()
+        self._writer_wakeup = threading.Event()
+        self._writer_thread = None
+        self._ephemeral_lock = threading.Lock()
+        self._settled = deque()
+        self._unsettled = set()
+        self._subscriptions = []
+        self._synced = {}
+        self._sync_added = None
+        APScheduler.__init__(self, gconfig, **options)
+        if self._precise_wakeup:
+            self._wakeup = PreciseEvent(self._wakeup_spin)
+
+    def configure(self, gconfig={}, **options):
+        APScheduler.configure(self, gconfig, **options)
+        config = combine_opts(gconfig, 'apscheduler.', options)
+        logging_opts = combine_opts(config, 'logging.')
+        if logging_opts or not _g_log_state['configured']:
+            _configure_logging(logging_opts)
+        runqueue_opts = combine_opts(config, 'runqueue.')
+        self._max_concurrency = asint(runqueue_opts.pop('max_concurrency', 
+                                                        None)) or None
+        if 'threadpool' not in config:
+            threadpool = self._threadpool
+            self._threadpool = RunThreadPool(
+                RunQueue(**runqueue_opts), 
+                **combine_opts(config, 'threadpool.'))
+            threadpool.shutdown(False)
+        pool_opts = combine_opts(config, 'processpool.')
+        self._process_workers = asint(pool_opts.get('max_workers')) or None
+        self.jitter = float(config.get('jitter', 0))
+        self._jitter_warned = set()
+        ephemeral_opts = combine_opts(config, 'ephemeral.')
+        self._ephemeral_horizon = timedelta(
+            seconds=float(ephemeral_opts.get('horizon', 0)))
+        self._ephemeral_alias = ephemeral_opts.get('jobstore', 'ephemeral')
+        writer_opts = combine_opts(config, 'writebehind.')
+        self._write_interval = float(writer_opts.get('interval', 0))
+        self._write_size = max(asint(writer_opts.get('batch_size', 1000)), 1)
+        wakeup_opts = combine_opts(config, 'wakeup.')
+        self._precise_wakeup = asbool(wakeup_opts.get('precise', True))
+        self._wakeup_spin = float(wakeup_opts.get('spin', 0))
+        if isinstance(self._wakeup, PreciseEvent):
+            self._wakeup.spin = self._wakeup_spin
+        sink_opts = combine_opts(config, 'sinks.')
+        self._sink_maxsize = asint(sink_opts.get('maxsize', 10000))
+        stats_opts = combine_opts(config, 'stats.')
+        self._stats_export = maybe_ref(stats_opts.get('export'))
+        self._stats_interval = float(stats_opts.get('export_interval', 60))
+        cluster_opts = combine_opts(config, 'cluster.')
+        if asbool(cluster_opts.pop('enabled', False)):
+            self._cluster = Cluster(**cluster_opts)
+        else:
+            self._cluster = None
+
+    def _index_job(self, job, jobstore):
+        self._jobs_by_id[job.id] = (job, jobstore)
+        if self._sync_added is not None:
+            # see _sync_cluster()
+            self._sync_added.add(job.id)
+        try:
+            self._jobs_by_func.setdefault(job.func, {})[job.id] = job
+        except TypeError:
+            # unhashable callable, unschedule_func() scans for it
+            pass
+        self._push_due(job)
+
+    def _push_due(self, job):
+        if job.next_run_time is None:
+            return
+        if len(self._due_heap) > 2 * len(self._jobs_by_id) + 1024:
+            # mostly stale entries, rebuild from the index
+            self._due_heap = [(j.next_run_time, next(self._due_seq), j.id)
+                              for j, alias in self._jobs_by_id.values()
+                              if j.next_run_time is not None]
+            heapify(self._due_heap)
+        else:
+            heappush(self._due_heap, 
+                     (job.next_run_time, next(self._due_seq), job.id))
+
+    def _pop_due(self, now):
+        """
+        Pops the next due (job, jobstore alias), 
+        skipping the stale entries. Returns None 
+        if no job is due at 'now'.
+        """
+        heap = self._due_heap
+        while heap and heap[0][0] <= now:
+            run_time, seq, jobid = heappop(heap)
+            entry = self._jobs_by_id.get(jobid)
+            if entry is not None and entry[0].next_run_time == run_time:
+                return entry
+
+    def _next_due_time(self):
+        """
+        Returns the earliest next run time of 
+        all the jobs, skipping the stale entries.
+        """
+        heap = self._due_heap
+        while heap:
+            run_time, seq, jobid = heap[0]
+            entry = self._jobs_by_id.get(jobid)
+            if entry is not None and entry[0].next_run_time == run_time:
+                return run_time
+            heappop(heap)
+
+    def _unindex_job(self, job):
+        self._jobs_by_id.pop(job.id, None)
+        self._dirty.pop(job.id, None)
+        self._unsettled.discard(job.id)
+        self._stats.forget_job(job.id)
+        try:
+            jobs = self._jobs_by_func.get(job.func)
+        except TypeError:
+            return
+        if jobs is not None:
+            jobs.pop(job.id, None)
+            if not jobs:
+                del self._jobs_by_func[job.func]
+
+    def add_jobstore(self, jobstore, alias, quiet=False):
+        started = time.time()
+        APScheduler.add_jobstore(self, jobstore, alias, quiet)
+        self._stats.jobstore('load_jobs', started)
+        self._jobstores_lock.acquire()
+        try:
+            self._synced.pop(alias, None)
+            for job in jobstore.jobs:
+                self._index_job(job, alias)
+            if hasattr(jobstore, 'load_next_page'):
+                self._loading.append(alias)
+                if self.running:
+                    self._start_loader()
+        finally:
+            self._jobstores_lock.release()
+
+    def remove_jobstore(self, alias, close=True):
+        self._write_behind()
+        self._jobstores_lock.acquire()
+        try:
+            self._synced.pop(alias, None)
+            for job in self._jobstores[alias].jobs:
+                self._unindex_job(job)
+            self.__forget_stubs(alias)
+        finally:
+            self._jobstores_lock.release()
+        APScheduler.remove_jobstore(self, alias, close)
+
+    def __forget_stubs(self, alias):
+        # stops loading the job store, drops its stubs
+        if alias in self._loading:
+            self._loading.remove(alias)
+        for jobid, stub_alias in list(self._stubs.items()):
+            if stub_alias == alias:
+                del self._stubs[jobid]
+
+    def _load_page(self, alias):
+        """
+        Loads the next page of a job store still 
+        loading, with the lock held. The jobs loaded 
+        already (added or fetched since) are skipped.
+        """
+        jobstore = self._jobstores[alias]
+        started = time.time()
+        page = jobstore.load_next_page()
+        self._stats.jobstore('load_page', started)
+        if page is None:
+            self._loading.remove(alias)
+            logger.info('Loaded all the jobs of job store "%s" (%d stubs)',
+                        alias, len(self._stubs))
+            return
+        jobs, stubs = page
+        jobs = [job for job in jobs if job.id not in self._jobs_by_id]
+        jobstore.jobs.extend(jobs)
+        for job in jobs:
+            self._index_job(job, alias)
+        for jobid, next_run_time in stubs:
+            if jobid not in self._jobs_by_id:
+                self._stubs[jobid] = alias
+                heappush(self._stub_heap, 
+                         (next_run_time - jobstore.horizon, jobid))
+
+    def _hydrate_stubs(self, now):
+        """
+        Fetches the stubs whose time has come, with
+        one fetch_jobs() call per job store.
+        """
+        grouped = {}
+        heap = self._stub_heap
+        while heap and heap[0][0] <= now:
+            when, jobid = heappop(heap)
+            alias = self._stubs.pop(jobid, None)
+            if alias is not None:
+                grouped.setdefault(alias, []).append(jobid)
+        for alias, ids in grouped.items():
+            self.__fetch_jobs(alias, ids)
+
+    def __fetch_jobs(self, alias, ids):
+        started = time.time()
+        jobs = self._jobstores[alias].fetch_jobs(ids)
+        self._stats.jobstore('fetch_jobs', started)
+        for job in jobs:
+            self._index_job(job, alias)
+
+    def _next_stub_time(self):
+        heap = self._stub_heap
+        while heap:
+            when, jobid = heap[0]
+            if jobid in self._stubs:
+                return when
+            heappop(heap)
+
+    def _load_all(self):
+        """
+        Loads the pages left and fetches all the 
+        stubs, with the lock held.
+        """
+        while self._loading:
+            self._load_page(self._loading[0])
+        if self._stubs:
+            self._hydrate_stubs(datetime.max)
+        self._stub_heap = []
+
+    def __load_pages(self):
+        while not self._loader_stop.is_set():
+            self._jobstores_lock.acquire()
+            try:
+                if not self._loading:
+                    self._loader_thread = None
+                    break
+                # one page of each job store in turn
+                alias = self._loading.pop(0)
+                self._loading.append(alias)
+                self._load_page(alias)
+            except Exception:
+                logger.exception('Loading the jobs of job store "%s" failed',
+                                 alias)
+                if alias in self._loading:
+                    self._loading.remove(alias)
+            finally:
+                self._jobstores_lock.release()
+            self._wakeup.set()
+
+    def _start_loader(self):
+        # with the lock held
+        if not self._loading or self._loader_thread is not None:
+            return
+        self._loader_stop.clear()
+        thread = threading.Thread(target=self.__load_pages,
+                                  name='SchedulerLoader')
+        thread.setDaemon(True)
+        thread.start()
+        self._loader_thread = thread
+
+    def _remove_job(self, job, alias, jobstore):
+        started = time.time()
+        APScheduler._remove_job(self, job, alias, jobstore)
+        self._stats.jobstore('remove_job', started)
+        self._unindex_job(job)
+
+    def _remove_jobs(self, jobs, alias, jobstore):
+        """
+        Removes many jobs of one job store, with a single 
+        remove_jobs() call when the job store has one.
+        """
+        started = time.time()
+        if hasattr(jobstore, 'remove_jobs'):
+            jobstore.remove_jobs(jobs)
+        else:
+            for job in jobs:
+                jobstore.remove_job(job)
+        self._stats.jobstore('remove_jobs', started)
+
+        for job in jobs:
+            self._unindex_job(job)
+            event = JobStoreEvent(EVENT_JOBSTORE_JOB_REMOVED, alias, job)
+            self._notify_listeners(event)
+        log_event(logger, 'removed', logging.INFO, 
+                  'Removed %d jobs from job store "%s"', len(jobs), alias)
+
+    def _remove_all_jobs(self, alias, jobstore):
+        jobs = list(jobstore.jobs)
+        if not hasattr(jobstore, 'remove_all_jobs'):
+            return self._remove_jobs(jobs, alias, jobstore)
+
+        started = time.time()
+        jobstore.remove_all_jobs()
+        self._stats.jobstore('remove_all_jobs', started)
+        self.__forget_stubs(alias)
+        self._dead = [(dead_alias, jobid) for dead_alias, jobid 
+                      in self._dead if dead_alias != alias]
+        for job in jobs:
+            self._unindex_job(job)
+            event = JobStoreEvent(EVENT_JOBSTORE_JOB_REMOVED, alias, job)
+            self._notify_listeners(event)
+        log_event(logger, 'removed', logging.INFO, 
+                  'Removed all the %d jobs from job store "%s"', 
+                  len(jobs), alias)
+
+    def get_job(self, jobid):
+        """
+        Returns the scheduled job with 
+        the given id, or None.
+        """
+        entry = self._jobs_by_id.get(jobid)
+        if entry is None and (self._loading or jobid in self._stubs):
+            self._jobstores_lock.acquire()
+            try:
+                entry = self._lookup(jobid)
+            finally:
+                self._jobstores_lock.release()
+        if entry is not None:
+            return entry[0]
+
+    def _lookup(self, jobid):
+        """
+        Returns the (job, jobstore alias) of the given 
+        job id, or None, with the lock held. A stub is
+        fetched, and the pages left are loaded if the
+        job is not found.
+        """
+        entry = self._jobs_by_id.get(jobid)
+        if entry is None and jobid in self._stubs:
+            self.__fetch_jobs(self._stubs.pop(jobid), [jobid])
+            entry = self._jobs_by_id.get(jobid)
+        if entry is None and self._loading:
+            self._load_all()
+            entry = self._jobs_by_id.get(jobid)
+        return entry
+
+    def iter_jobs(self, job_filter=None, order_by=None, limit=None, 
+                  offset=0, jobstore=None):
+        """
+        Yields the scheduled jobs matching the given 
+        JobFilter (all if None), of all the job stores 
+        or of the given one, ordered by 'id', 'name' or 
+        'next_run_time' if order_by is given; offset 
+        jobs are skipped and at most limit are yielded.
+
+        The job stores which can list their jobs in SQL
+        (iter_ids()) are read a page at a time, as the 
+        jobs are consumed; the lock is held for a chunk 
+        of jobs at a time, never for the whole listing.
+        The jobs not loaded (stubs, pages left) are read
+        from their job store, without loading them.
+        """
+        if order_by is not None and order_by not in _g_job_orders:
+            raise UnSupportedParameter
+        if job_filter is not None and job_filter.is_empty():
+            job_filter = None
+        stop = None if limit is None else offset + limit
+
+        sources = []
+        self._jobstores_lock.acquire()
+        try:
+            for alias, store in self._jobstores.items():
+                if jobstore is not None and alias != jobstore:
+                    continue
+                if hasattr(store, 'iter_ids'):
+                    pairs = store.iter_ids(job_filter, order_by)
+                else:
+                    pairs = self.__matching_ids(store, job_filter, 
+                                                order_by, stop)
+                sources.append(self.__tagged(alias, pairs))
+        finally:
+            self._jobstores_lock.release()
+
+        entries = merge(*sources) if order_by else itertools.chain(*sources)
+        jobs = self.__resolve(entries, job_filter)
+        return itertools.islice(jobs, offset, stop)
+
+    def __matching_ids(self, store, job_filter, order_by, stop):
+        # (key, job id) of the matching jobs of a store 
+        # which cannot list them in SQL, with the lock held
+        key = _g_job_orders.get(order_by or 'id')
+        pairs = ((key(job), job.id) for job in store.jobs 
+                 if job_filter is None or job_filter.matches(job))
+        if order_by is None:
+            return list(itertools.islice(pairs, stop))
+        if stop is not None:
+            return nsmallest(stop, pairs)
+        return sorted(pairs)
+
+    def __tagged(self, alias, pairs):
+        for key, jobid in pairs:
+            yield key, jobid, alias
+
+    def __resolve(self, entries, job_filter):
+        # yields the jobs of the (key, job id, alias) entries
+        # which still match, a chunk of entries at a time
+        while True:
+            chunk = list(itertools.islice(entries, _g_list_chunk))
+            if not chunk:
+                return
+            found = {}
+            missing = {}
+            self._jobstores_lock.acquire()
+            try:
+                for key, jobid, alias in chunk:
+                    entry = self._jobs_by_id.get(jobid)
+                    if entry is not None:
+                        found[jobid] = entry[0]
+                    elif jobid in self._stubs or alias in self._loading:
+                        missing.setdefault(alias, []).append(jobid)
+                stores = dict((alias, self._jobstores.get(alias)) 
+                              for alias in missing)
+            finally:
+                self._jobstores_lock.release()
+
+            # not loaded: read, outside the lock
+            for alias, ids in missing.items():
+                if stores[alias] is None:
+                    continue
+                started = time.time()
+                for job in stores[alias].read_jobs(ids):
+                    found[job.id] = job
+                self._stats.jobstore('read_jobs', started)
+
+            for key, jobid, alias in chunk:
+                job = found.get(jobid)
+                if job is not None and (job_filter is None or 
+                                        job_filter.matches(job)):
+                    yield job
+
+    def simulate(self, horizon=86400, bucket=1, duration=None, clock=None):
+        """
+        Forecasts the runs of all the jobs, the pending
+        ones too, over the horizon (see simulate.py). 
+        Without a duration, a run lasts the mean duration
+        of the runs of its callable so far (else 0).
+        """
+        self._jobstores_lock.acquire()
+        try:
+            jobs = None
+            if not self._loading and not self._stubs:
+                jobs = [job for job, alias in self._jobs_by_id.values()]
+            pending = [job for job, jobstore in self._pending_jobs]
+        finally:
+            self._jobstores_lock.release()
+        if jobs is None:
+            # the jobs not loaded are read from their store
+            jobs = self.iter_jobs()
+
+        if duration is None:
+            callables = self._stats.snapshot()['callables']
+            observed = dict((name, stats['duration']['mean']) 
+                            for name, stats in callables.items() 
+                            if 'duration' in stats)
+            duration = lambda job: observed.get(
+                getattr(job, 'func_ref', None) or job.name, 0)
+        return simulate(itertools.chain(jobs, pending), clock, horizon, 
+                        bucket, duration)
+
+    def count_jobs(self, job_filter=None):
+        """
+        Returns the number of scheduled jobs matching the
+        given JobFilter (all if None). The job stores which 
+        can count in SQL (count_jobs()) do, unless the 
+        filter has a predicate; the others go through 
+        iter_jobs(). Without a filter, the count is that
+        of the indexes.
+        """
+        if job_filter is not None and job_filter.is_empty():
+            job_filter = None
+        self._jobstores_lock.acquire()
+        try:
+            if job_filter is None and not self._loading:
+                return len(self._jobs_by_id) + len(self._stubs)
+            stores = list(self._jobstores.items())
+        finally:
+            self._jobstores_lock.release()
+
+        count = 0
+        in_sql = job_filter is None or job_filter.predicate is None
+        for alias, store in stores:
+            if in_sql and hasattr(store, 'count_jobs'):
+                started = time.time()
+                count += store.count_jobs(job_filter)
+                self._stats.jobstore('count_jobs', started)
+            elif job_filter is None:
+                count += len(store.jobs)
+            else:
+                count += sum(1 for job in self.iter_jobs(job_filter, 
+                                                         jobstore=alias))
+        return count
+
+    def get_jobs(self):
+        """
+        Returns a list of all the scheduled jobs 
+        (see iter_jobs() to go through them instead).
+        """
+        return list(self.iter_jobs())
+
+    def print_jobs(self, out=None):
+        """
+        Prints the scheduled jobs, a line at a time, 
+        by job store (see APScheduler.print_jobs()).
+        """
+        out = out or sys.stdout
+        self._jobstores_lock.acquire()
+        try:
+            aliases = list(self._jobstores)
+        finally:
+            self._jobstores_lock.release()
+        for alias in aliases:
+            out.write('Jobstore %s:%s' % (alias, os.linesep))
+            empty = True
+            for job in self.iter_jobs(jobstore=alias):
+                out.write('    %s%s' % (job, os.linesep))
+                empty = False
+            if empty:
+                out.write('    No scheduled jobs%s' % os.linesep)
+
+    def unschedule_job(self, job):
+        """
+        Removes a job, preventing it from being run any more.
+        """
+        if job.id is None:
+            # never stored, let APScheduler report it
+            return APScheduler.unschedule_job(self, job)
+        self.unschedule_jobid(job.id)
+
+    def unschedule_jobid(self, jobid):
+        """
+        Removes the job with the given id.
+        """
+        self._jobstores_lock.acquire()
+        try:
+            entry = self._lookup(jobid)
+            if entry is not None:
+                job, alias = entry
+                self._remove_job(job, alias, self._jobstores[alias])
+                return
+        finally:
+            self._jobstores_lock.release()
+
+        raise KeyError('Job id "%s" is not scheduled in any job store' 
+                       % jobid)
+
+    def unschedule_func(self, func):
+        """
+        Removes all jobs that would execute the given function.
+        """
+        try:
+            hash(func)
+        except TypeError:
+            self._jobstores_lock.acquire()
+            try:
+                self._load_all()
+            finally:
+                self._jobstores_lock.release()
+            return APScheduler.unschedule_func(self, func)
+
+        self._jobstores_lock.acquire()
+        try:
+            self._load_all()
+            jobs = list(self._jobs_by_func.get(func, {}).values())
+            self.__remove_grouped(jobs)
+        finally:
+            self._jobstores_lock.release()
+
+        if not jobs:
+            raise KeyError('The given function is not scheduled in this '
+                           'scheduler')
+
+    def __remove_grouped(self, jobs):
+        # removes the given indexed jobs, one 
+        # _remove_jobs() call per job store
+        grouped = {}
+        for job in jobs:
+            alias = self._jobs_by_id[job.id][1]
+            grouped.setdefault(alias, []).append(job)
+        for alias, store_jobs in grouped.items():
+            self._remove_jobs(store_jobs, alias, self._jobstores[alias])
+
+    def unschedule_where(self, job_filter=None):
+        """
+        Removes all the jobs matching the given JobFilter 
+        (all the jobs if it is None), including the jobs 
+        pending until the scheduler starts. The whole 
+        removal is done holding the job stores lock once.
+
+        Returns the number of removed jobs.
+        """
+        self._jobstores_lock.acquire()
+        try:
+            pending = len(self._pending_jobs)
+            if job_filter is None:
+                del self._pending_jobs[:]
+                count = len(self._jobs_by_id) + len(self._stubs)
+                for alias, jobstore in self._jobstores.items():
+                    self._remove_all_jobs(alias, jobstore)
+                self._due_heap = []
+                return count + pending
+
+            self._load_all()
+
+            self._pending_jobs[:] = [(job, alias) for job, alias 
+                                     in self._pending_jobs
+                                     if not job_filter.matches(job)]
+            pending -= len(self._pending_jobs)
+
+            # only look at the jobs of the callable, if given
+            candidates = None
+            if job_filter.func is not None:
+                try:
+                    candidates = self._jobs_by_func.get(job_filter.func, {})
+                    candidates = candidates.values()
+                except TypeError:
+                    pass
+            if candidates is None:
+                candidates = [job for job, alias in self._jobs_by_id.values()]
+            jobs = [job for job in candidates if job_filter.matches(job)]
+            self.__remove_grouped(jobs)
+            return len(jobs) + pending
+        finally:
+            self._jobstores_lock.release()
+
+    def make_job(self, trigger, func, args=None, kwargs=None, **options):
+        """
+        Creates (and validates) a job without scheduling it.
+        Returns the job and the alias of its job store.
+        """
+        jobstore = options.pop('jobstore', None)
+        durable = options.pop('durable', None)
+        if jobstore is None:
+            jobstore = 'default'
+            if not self.__is_durable(trigger, durable):
+                jobstore = self.__ephemeral_jobstore()
+        grace = options.pop('misfire_grace_time', self.misfire_grace_time)
+        if options.get('jitter') is None:
+            options['jitter'] = self.jitter
+            if self.jitter > grace and grace not in self._jitter_warned:
+                # once per grace time, not once per job
+                self._jitter_warned.add(grace)
+                logger.warning('apscheduler.jitter (%ss) is cut to the '
+                               'misfire_grace_time of the jobs (%ss)',
+                               self.jitter, grace)
+        elif float(options['jitter']) > grace:
+            raise ValueError('jitter (%ss) must not be higher than '
+                             'misfire_grace_time (%ss)' % 
+                             (options['jitter'], grace))
+        job = FrameworkJob(trigger, func, args or [], kwargs or {}, grace,
+                           options.pop('coalesce', self.coalesce), **options)
+        return job, jobstore
+
+    def __is_durable(self, trigger, durable):
+        if durable is not None:
+            return durable
+        if self._ephemeral_horizon and isinstance(trigger, SimpleTrigger):
+            return trigger.run_date > datetime.now() + \
+                   self._ephemeral_horizon
+        return True
+
+    def __ephemeral_jobstore(self):
+        # imported here, see _prepare_start()
+        from jobstore import MemoryJobStore
+
+        alias = self._ephemeral_alias
+        if alias not in self._jobstores:
+            self._ephemeral_lock.acquire()
+            try:
+                if alias not in self._jobstores:
+                    self.add_jobstore(MemoryJobStore(), alias, True)
+            finally:
+                self._ephemeral_lock.release()
+        return alias
+
+    def add_job(self, trigger, func, args, kwargs, jobstore=None,
+                **options):
+        job, jobstore = self.make_job(trigger, func, args, kwargs,
+                                      jobstore=jobstore, **options)
+        self.add_jobs([(job, jobstore)])
+        return job
+
+    def add_jobs(self, jobs, now=None):
+        """
+        Schedules the given (job, jobstore) pairs. All the
+        jobs are validated before any of them is scheduled,
+        against now [default: the current time]. If the
+        scheduler is not running, they are kept pending
+        until it starts.
+        """
+        self._validate_jobs(jobs, now)
+        if not self.running:
+            self._pending_jobs.extend(jobs)
+            logger.info('Adding %d jobs tentatively -- they will be '
+                        'properly scheduled when the scheduler starts',
+                        len(jobs))
+        else:
+            self._real_add_jobs(jobs, True, now)
+
+    def _validate_jobs(self, jobs, now=None):
+        now = now or datetime.now()
+        for job, jobstore in jobs:
+            job.compute_next_run_time(now)
+            if not job.next_run_time:
+                raise ValueError('Not adding job "%s" since it would '
+                                 'never be run' % job)
+
+    def _real_add_job(self, job, jobstore, wakeup):
+        self._real_add_jobs([(job, jobstore)], wakeup)
+
+    def _real_add_jobs(self, jobs, wakeup, now=None):
+        # validate everything before touching any job store
+        self._validate_jobs(jobs, now)
+
+        grouped = {}
+        for job, jobstore in jobs:
+            grouped.setdefault(jobstore, []).append(job)
+
+        self._jobstores_lock.acquire()
+        try:
+            for jobstore in grouped:
+                if jobstore not in self._jobstores:
+                    raise KeyError('No such job store: %s' % jobstore)
+            for jobstore, store_jobs in grouped.items():
+                store = self._jobstores[jobstore]
+                started = time.time()
+                try:
+                    if hasattr(store, 'add_jobs'):
+                        store.add_jobs(store_jobs)
+                    else:
+                        for job in store_jobs:
+                            store.add_job(job)
+                finally:
+                    self._stats.jobstore('add_jobs', started)
+                    # index whatever made it into the store
+                    for job in store_jobs:
+                        if job.id is not None:
+                            self._index_job(job, jobstore)
+        finally:
+            self._jobstores_lock.release()
+
+        for job, jobstore in jobs:
+            event = JobStoreEvent(EVENT_JOBSTORE_JOB_ADDED, jobstore, job)
+            self._notify_listeners(event)
+        log_event(logger, 'added', logging.INFO, 
+                  'Added %d jobs to job stores %s', 
+                  len(jobs), ', '.join(grouped))
+
+        # wake up the scheduler once for all the jobs
+        if wakeup:
+            self._wakeup.set()
+
+    def _main_loop(self):
+        """
+        APScheduler's main loop; the wait for the next 
+        wakeup is measured once the due jobs are started,
+        so that it does not add their start-up time to 
+        the lag of the next fire.
+        """
+        logger.info('Scheduler started')
+        self._notify_listeners(SchedulerEvent(EVENT_SCHEDULER_START))
+
+        self._wakeup.clear()
+        while not self._stopped:
+            next_wakeup_time = self._process_jobs(datetime.now())
+            if next_wakeup_time is not None:
+                wait_seconds = time_difference(next_wakeup_time, 
+                                               datetime.now())
+                if wait_seconds > 0:
+                    try:
+                        self._wakeup.wait(wait_seconds)
+                    except IOError:  # errno 514 on some Linux kernels
+                        pass
+                self._wakeup.clear()
+            elif self.standalone and not self._live_runs():
+                logger.debug('No jobs left; shutting down scheduler')
+                self.shutdown()
+                break
+            else:
+                try:
+                    self._wakeup.wait()
+                except IOError:
+                    pass
+                self._wakeup.clear()
+
+        logger.info('Scheduler has been shut down')
+        self._notify_listeners(SchedulerEvent(EVENT_SCHEDULER_SHUTDOWN))
+
+    def _process_jobs(self, now):
+        """
+        Starts the due jobs and returns the next wakeup 
+        time. Only the due jobs are visited, by popping 
+        them from _due_heap. The jobs which are finished 
+        are removed together, one call per job store.
+        The stubs about to be due are fetched first, and
+        the finished runs are settled.
+
+        The runs are handed to the thread pool once the
+        job stores are unlocked: with the block overflow 
+        of the run queue, the wait for room does not 
+        hold back the other threads, and it is at most
+        block_timeout for all the runs of the pass.
+        """
+        finished = []
+        dispatches = []
+        behind = self._write_interval > 0
+        self._jobstores_lock.acquire()
+        try:
+            self._hydrate_stubs(now)
+            self._settle_runs(now)
+            # stops once shut down, the thread pool may be gone
+            while not self._stopped:
+                entry = self._pop_due(now) or self._pop_deferred(now)
+                if entry is None:
+                    break
+                job, alias = entry
+                jobstore = self._jobstores[alias]
+                claimed = self._cluster is not None and \
+                          hasattr(jobstore, 'claim_job')
+                if claimed and not self._claim_job(job, alias, jobstore, 
+                                                   now):
+                    continue
+
+                run_times = job.get_run_times(now)
+                if run_times:
+                    if job.retry_at in run_times:
+                        # the retry is now the run of _retry_run
+                        job._retry_run = job.retry_at
+                        job.retry_at = None
+                    dispatches.append((job, run_times))
+
+                    # Increase the job's run count
+                    if job.coalesce:
+                        job.runs += 1
+                        if len(run_times) > 1:
+                            self._stats.count('coalesced', 
+                                              len(run_times) - 1)
+                    else:
+                        job.runs += len(run_times)
+
+                # Update the job, but don't keep finished jobs around
+                later = behind and not claimed and \
+                        hasattr(jobstore, 'write_behind')
+                if job.compute_next_run_time(now + timedelta(microseconds=1)):
+                    started = time.time()
+                    if claimed:
+                        self.__release_job(job, jobstore)
+                    elif later:
+                        self._dirty[job.id] = (job, alias)
+                    else:
+                        jobstore.update_job(job)
+                    if not later:
+                        self._stats.jobstore('update_job', started)
+                    self._push_due(job)
+                elif run_times and not claimed and \
+                     getattr(job, 'max_attempts', 1) > 1:
+                    # kept until its last run succeeds or 
+                    # gives up (see _settle_runs())
+                    self._unsettled.add(job.id)
+                elif later:
+                    self.__remove_later(job, alias, jobstore)
+                else:
+                    finished.append(job)
+
+            self.__remove_grouped(finished)
+            if len(self._dirty) + len(self._dead) >= self._write_size:
+                self._writer_wakeup.set()
+            wakeups = [wakeup for wakeup in (self._next_due_time(),
+                                             self._next_deferred_time(),
+                                             self._next_stub_time())
+                       if wakeup is not None]
+        finally:
+            self._jobstores_lock.release()
+
+        since = time.time()
+        for job, run_times in dispatches:
+            self._dispatch(job, run_times, since)
+        return min(wakeups) if wakeups else None
+
+    def _settle_runs(self, now):
+        """
+        Settles the finished runs: schedules (and stores)
+        the retry of the failed runs which have attempts 
+        left, and removes the jobs left with nothing to 
+        run. Called by the main loop, with the lock held.
+        """
+        finished = []
+        behind = self._write_interval > 0
+        while self._settled:
+            job, run_time, exception = self._settled.popleft()
+            entry = self._jobs_by_id.get(job.id)
+            if entry is None or entry[0] is not job:
+                continue
+            alias = entry[1]
+            jobstore = self._jobstores[alias]
+            later = behind and hasattr(jobstore, 'write_behind')
+            if job.instances == 0:
+                # retried or removed below, or still to run
+                self._unsettled.discard(job.id)
+            if exception is not None and job.is_retryable(exception):
+                attempt = 1
+                if run_time == getattr(job, '_retry_run', None):
+                    attempt = job.retry_attempt
+                if attempt < job.max_attempts:
+                    self.__retry(job, alias, jobstore, attempt + 1, now, 
+                                 later)
+                    continue
+                if job.max_attempts > 1:
+                    logger.warning('Job "%s" gave up after %d attempts', 
+                                   job, attempt)
+            if job.next_run_time is None and job.instances == 0:
+                if later:
+                    self.__remove_later(job, alias, jobstore)
+                else:
+                    finished.append(job)
+        self.__remove_grouped(finished)
+
+    def __retry(self, job, alias, jobstore, attempt, now, later):
+        delay = job.retry_delay(attempt)
+        job.retry_at = now + timedelta(seconds=delay)
+        job.retry_attempt = attempt
+        job.compute_next_run_time(now)
+        self._stats.count('retries')
+        log_event(logger, 'retry', logging.INFO, 
+                  'Retrying job "%s" in %.3f seconds (attempt %d of %d)', 
+                  job, delay, attempt, job.max_attempts)
+        started = time.time()
+        if later:
+            self._dirty[job.id] = (job, alias)
+        else:
+            try:
+                jobstore.update_job(job)
+            except Exception:
+                # still retried, from memory
+                logger.exception('Storing the retry of job "%s" failed', 
+                                 job)
+            finally:
+                self._stats.jobstore('update_job', started)
+        self._push_due(job)
+
+    def _live_runs(self):
+        # runs still to be settled: a standalone 
+        # scheduler waits for their retries, if any
+        return bool(self._settled or self._unsettled)
+
+    def _run_settled(self, job, run_time, exception=None):
+        # queues a finished (or missed) run for _settle_runs(),
+        # only the runs of the jobs which can be retried
+        if getattr(job, 'max_attempts', 1) > 1:
+            self._settled.append((job, run_time, exception))
+            self._wakeup.set()
+
+    def __remove_later(self, job, alias, jobstore):
+        # removes a finished job now, and its row 
+        # with the next write_behind()
+        jobstore.jobs.remove(job)
+        self._unindex_job(job)
+        self._dead.append((alias, job.id))
+        event = JobStoreEvent(EVENT_JOBSTORE_JOB_REMOVED, alias, job)
+        self._notify_listeners(event)
+        log_event(logger, 'removed', logging.INFO, 
+                  'Removed job "%s" from job store "%s"', job, alias)
+
+    def _write_behind(self):
+        """
+        Writes the next run times and deletes the rows
+        waiting in the write-behind mode, one call per 
+        job store. The writes which fail wait for the
+        next call.
+        """
+        self._jobstores_lock.acquire()
+        try:
+            dirty, self._dirty = self._dirty, {}
+            dead, self._dead = self._dead, []
+            grouped = {}
+            for job, alias in dirty.values():
+                grouped.setdefault(alias, ([], []))[0].append(
+                    (job.id, job.next_run_time, job.runs, job.retry_at,
+                     job.retry_attempt))
+            for alias, jobid in dead:
+                grouped.setdefault(alias, ([], []))[1].append(jobid)
+            for alias, (updates, ids) in grouped.items():
+                jobstore = self._jobstores.get(alias)
+                if jobstore is None:
+                    continue
+                started = time.time()
+                try:
+                    jobstore.write_behind(updates, ids)
+                except Exception:
+                    logger.exception('Writing %d updates and %d deletes to '
+                                     'job store "%s" failed', len(updates),
+                                     len(ids), alias)
+                    for update in updates:
+                        jobid = update[0]
+                        if jobid in self._jobs_by_id:
+                            self._dirty.setdefault(jobid, dirty[jobid])
+                    self._dead.extend((alias, jobid) for jobid in ids)
+                finally:
+                    self._stats.jobstore('write_behind', started)
+        finally:
+            self._jobstores_lock.release()
+
+    def __write_behind(self):
+        while not self._writer_stop.is_set():
+            self._writer_wakeup.wait(self._write_interval)
+            self._writer_wakeup.clear()
+            self._write_behind()
+
+    def _defer(self, job, when):
+        heappush(self._deferred, (when, next(self._due_seq), job.id, 
+                                  job.runs))
+
+    def _pop_deferred(self, now):
+        """
+        Pops the next (job, jobstore alias) deferred
+        until 'now' or earlier, skipping the stale 
+        entries. Returns None if there is none.
+        """
+        heap = self._deferred
+        while heap and heap[0][0] <= now:
+            when, seq, jobid, runs = heappop(heap)
+            entry = self._jobs_by_id.get(jobid)
+            if entry is not None and entry[0].runs == runs:
+                return entry
+
+    def _next_deferred_time(self):
+        heap = self._deferred
+        while heap:
+            when, seq, jobid, runs = heap[0]
+            entry = self._jobs_by_id.get(jobid)
+            if entry is not None and entry[0].runs == runs:
+                return when
+            heappop(heap)
+
+    def _claim_job(self, job, alias, jobstore, now):
+        """
+        Claims a due job of a clustered job store (see 
+        cluster.py). Returns True if this node runs it; 
+        else the job is deferred, or updated from its 
+        row if another node has fired or removed it.
+        """
+        cluster = self._cluster
+        if cluster.owner(job.id, job.runs) != cluster.node:
+            handoff_time = job.next_run_time + cluster.handoff
+            if now < handoff_time:
+                self._defer(job, handoff_time)
+                return False
+            # its node is late or gone, unless the row says otherwise
+            if not self.__refresh_job(job, alias, jobstore, now):
+                return False
+
+        started = time.time()
+        claimed = jobstore.claim_job(job, cluster.node, now, 
+                                     now + cluster.lease_time)
+        self._stats.jobstore('claim_job', started)
+        if not claimed and self.__refresh_job(job, alias, jobstore, now):
+            self._defer(job, now + cluster.handoff)
+        return claimed
+
+    def __refresh_job(self, job, alias, jobstore, now):
+        # updates the job from its row; True if the row is
+        # unchanged and no other node holds a lease on it
+        row = jobstore.peek_job(job)
+        if row is None:
+            self.__forget_job(job, alias, jobstore)
+        elif row.runs != job.runs:
+            self.__adopt_job(job, row.runs, row.next_run_time)
+        elif row.lease_owner not in (None, self._cluster.node) and \
+             row.lease_expires >= now:
+            self._defer(job, row.lease_expires)
+        else:
+            return True
+        return False
+
+    def __forget_job(self, job, alias, jobstore):
+        # removed by another node
+        if job in jobstore.jobs:
+            jobstore.jobs.remove(job)
+        self._unindex_job(job)
+        logger.info('Job "%s" was removed from job store "%s" by another '
+                    'node', job, alias)
+
+    def __adopt_job(self, job, runs, next_run_time):
+        # fired by another node
+        job.runs = runs
+        job.next_run_time = next_run_time
+        self._push_due(job)
+
+    def __release_job(self, job, jobstore):
+        if not jobstore.release_job(job, self._cluster.node):
+            logger.warning('The lease of job "%s" expired before its next '
+                           'run time was stored', job)
+
+    def _sync_cluster(self):
+        """
+        Records the heartbeat of this node and loads the 
+        jobs added, removed or fired by the other nodes:
+        the rows written since the previous sync, and 
+        the rows removed since then, or all the rows if
+        these are not known (the first sync). The job 
+        stores are read unlocked; the lock is only held
+        to apply the changes.
+        """
+        cluster = self._cluster
+        now = datetime.now()
+        nodes = []
+        changes = []
+        self._jobstores_lock.acquire()
+        try:
+            # the jobs added from now on have no row in a
+            # full read, they are not removed ones
+            self._sync_added = set()
+            jobstores = [(alias, jobstore) for alias, jobstore 
+                         in self._jobstores.items() 
+                         if hasattr(jobstore, 'claim_job')]
+        finally:
+            self._jobstores_lock.release()
+
+        for alias, jobstore in jobstores:
+            nodes.extend(jobstore.heartbeat(cluster.node, now,
+                                            cluster.heartbeat_expiry(now)))
+            since = self._synced.get(alias)
+            removed = None
+            if since is not None:
+                removed = jobstore.removed_since(since)
+            if removed is None:
+                rows = jobstore.peek_jobs()
+            else:
+                rows = jobstore.peek_changes(since)
+            jobs = []
+            if alias not in self._loading:
+                # the rows of the jobs not loaded; the rows 
+                # left of a store loading come with the pages
+                ids = [jobid for jobid in rows 
+                       if jobstore.jobs.get(jobid) is None and 
+                       jobid not in self._stubs]
+                if ids:
+                    jobs = jobstore.read_jobs(ids)
+            changes.append((alias, jobstore, rows, removed, jobs))
+
+        changed = False
+        self._jobstores_lock.acquire()
+        try:
+            added, self._sync_added = self._sync_added, None
+            for alias, jobstore, rows, removed, jobs in changes:
+                if self._jobstores.get(alias) is not jobstore:
+                    continue
+                if removed is None:
+                    for job in list(jobstore.jobs):
+                        row = rows.get(job.id)
+                        if row is None:
+                            if job.id not in added:
+                                self.__forget_job(job, alias, jobstore)
+                        elif row[0] != job.runs:
+                            self.__adopt_job(job, row[0], row[1])
+                            changed = True
+                else:
+                    for jobid in removed:
+                        job = jobstore.jobs.get(jobid)
+                        if job is not None:
+                            self.__forget_job(job, alias, jobstore)
+                    for jobid, row in rows.items():
+                        job = jobstore.jobs.get(jobid)
+                        if job is not None and row[0] != job.runs:
+                            self.__adopt_job(job, row[0], row[1])
+                            changed = True
+                for job in jobs:
+                    if jobstore.jobs.get(job.id) is None and \
+                       job.id not in self._stubs and \
+                       alias not in self._loading:
+                        jobstore.jobs.append(job)
+                        self._index_job(job, alias)
+                        changed = True
+                # the rows written while this sync ran are
+                # read again by the next one
+                self._synced[alias] = now - cluster.sync_overlap
+        finally:
+            self._jobstores_lock.release()
+
+        cluster.set_nodes(nodes)
+        if changed:
+            self._wakeup.set()
+
+    def __sync_cluster(self):
+        while not self._cluster_stop.wait(self._cluster.sync_interval):
+            try:
+                self._sync_cluster()
+            except Exception:
+                logger.exception('Syncing with the cluster failed')
+
+    def _get_process_pool(self):
+        # imported here, like the job stores, to keep
+        # the import of scheduler.py light
+        import multiprocessing
+
+        if self._process_pool is None:
+            self._process_pool_lock.acquire()
+            try:
+                if self._process_pool is None:
+                    self._process_pool = multiprocessing.Pool(
+                        self._process_workers)
+                    logger.info('Started a process pool of %d workers', 
+                                self._process_workers or 
+                                multiprocessing.cpu_count())
+            finally:
+                self._process_pool_lock.release()
+        return self._process_pool
+
+    def _dispatch(self, job, run_times, since=None):
+        """
+        Starts the given runs of a due job: in the thread 
+        pool, or in the process pool for executor='process'.
+        since: see RunQueue.put_run()
+        """
+        if job.executor == 'process':
+            # only hands the runs to the process 
+            # pool, no need for a pool thread
+            self._launch_runs(job, run_times, self.__run_in_process)
+        else:
+            try:
+                if not hasattr(self._threadpool, 'submit_run'):
+                    self._threadpool.submit(self._run_job, job, run_times)
+                    return
+                cap = getattr(job, 'max_concurrency', None) or \
+                      self._max_concurrency
+                dropped = self._threadpool.submit_run(
+                    job, run_times, self._run_job, 
+                    getattr(job, 'priority', 0), 
+                    getattr(job, 'func_ref', None) or job.name, cap, 
+                    since)
+            except RuntimeError:
+                # the thread pool was shut down meanwhile
+                if not self._stopped:
+                    raise
+                return
+            for job, run_times in dropped:
+                self.__overflow(job, run_times)
+
+    def __overflow(self, job, run_times):
+        self._stats.count('overflows', len(run_times))
+        for run_time in run_times:
+            event = JobEvent(EVENT_JOB_MISSED, job, run_time)
+            self._notify_listeners(event)
+        log_event(logger, 'overflow', logging.WARNING, 
+                  'Run of job "%s" missed: the run queue is full', job)
+        self._run_settled(job, run_times[-1])
+
+    def _run_job(self, job, run_times):
+        """
+        Runs the job in this (thread pool) thread.
+        """
+        self._launch_runs(job, run_times, self.__run_in_thread)
+
+    def _launch_runs(self, job, run_times, launch):
+        """
+        Starts the runs of a job with launch(job, run_time), 
+        which calls _job_done() when the run is finished, 
+        then or later. Misfires and max instances are 
+        handled as by APScheduler._run_job().
+        """
+        for run_time in run_times:
+            difference = datetime.now() - run_time
+            grace_time = timedelta(seconds=job.misfire_grace_time)
+            if difference > grace_time:
+                self._stats.count('misfires')
+                event = JobEvent(EVENT_JOB_MISSED, job, run_time)
+                self._notify_listeners(event)
+                log_event(logger, 'missed', logging.WARNING, 
+                          'Run time of job "%s" was missed by %s', 
+                          job, difference)
+                self._run_settled(job, run_time)
+                continue
+
+            try:
+                job.add_instance()
+            except MaxInstancesReachedError:
+                self._stats.count('skipped')
+                event = JobEvent(EVENT_JOB_MISSED, job, run_time)
+                self._notify_listeners(event)
+                log_event(logger, 'skipped', logging.WARNING, 
+                          'Execution of job "%s" skipped: maximum number '
+                          'of running instances reached (%d)', 
+                          job, job.max_instances)
+                self._run_settled(job, run_time)
+                break
+
+            self._stats.count('runs')
+            self._stats.run('lag', job, difference.days * 86400 + 
+                            difference.seconds + 
+                            difference.microseconds / 1e6)
+            started = time.time()
+            try:
+                launch(job, run_time)
+            except Exception:
+                self._job_done(job, run_time, ('error', sys.exc_info()[1], 
+                                               traceback.format_exc()),
+                               started)
+
+            if job.coalesce:
+                break
+
+    def _job_done(self, job, run_time, result, started):
+        """
+        Reports a finished run, started by _launch_runs() 
+        at 'started' (time.time()); result is ('executed', 
+        retval) or ('error', exception, traceback), where 
+        the traceback is formatted unless the run was in 
+        this process. The run is then settled by the main 
+        loop (see _settle_runs()).
+        """
+        self._stats.run('duration', job, time.time() - started)
+        if result[0] == 'executed':
+            self._stats.count('executed')
+            event = JobEvent(EVENT_JOB_EXECUTED, job, run_time, 
+                             retval=result[1])
+            self._notify_listeners(event)
+            log_event(logger, 'executed', logging.INFO, 
+                      'Job "%s" executed successfully', job)
+        else:
+            self._stats.count('errors')
+            event = JobEvent(EVENT_JOB_ERROR, job, run_time,
+                             exception=result[1], traceback=result[2])
+            self._notify_listeners(event)
+            if isinstance(result[2], basestring):
+                log_event(logger, 'error', logging.ERROR, 
+                          'Job "%s" raised an exception\n%s', 
+                          job, result[2])
+            else:
+                log_event(logger, 'error', logging.ERROR, 
+                          'Job "%s" raised an exception', job, 
+                          exc_info=(type(result[1]), result[1], 
+                                    result[2]))
+        job.remove_instance()
+        self._run_settled(job, run_time, 
+                          result[1] if result[0] == 'error' else None)
+
+    def __run_in_thread(self, job, run_time):
+        log_event(logger, 'run', logging.INFO, 
+                  'Running job "%s" (scheduled at %s)', job, run_time)
+        started = time.time()
+        try:
+            result = ('executed', job.func(*job.args, **job.kwargs))
+        except:
+            result = ('error',) + sys.exc_info()[1:]
+        self._job_done(job, run_time, result, started)
+
+    def __run_in_process(self, job, run_time):
+        log_event(logger, 'run', logging.INFO, 
+                  'Running job "%s" in a process (scheduled at %s)', 
+                  job, run_time)
+        started = time.time()
+        def callback(result):
+            # called from the process pool's result thread
+            self._job_done(job, run_time, result, started)
+        self._get_process_pool().apply_async(call_in_process, 
+                                             (dump_call(job),),
+                                             callback=callback)
+
+    def _prepare_start(self):
+        """
+        Gets the job stores and the process pool ready and
+        schedules the pending jobs; start() then starts
+        the main loop.
+        """
+        # imported here so that importing scheduler.py
+        # does not pull in the job stores (and SQLAlchemy)
+        from jobstore import MemoryJobStore
+
+        if self.running:
+            raise SchedulerAlreadyRunningError
+        if 'default' not in self._jobstores:
+            self.add_jobstore(MemoryJobStore(), 'default', True)
+
+        # schedule all the pending jobs in one go
+        pending = list(self._pending_jobs)
+        del self._pending_jobs[:]
+        if pending:
+            self._real_add_jobs(pending, False)
+
+        # fork the workers before the scheduler threads start
+        for job, alias in self._jobs_by_id.values():
+            if getattr(job, 'executor', None) == 'process':
+                self._get_process_pool()
+                break
+
+        self._jobstores_lock.acquire()
+        try:
+            self._start_loader()
+        finally:
+            self._jobstores_lock.release()
+
+        if self._write_interval > 0:
+            self._writer_stop.clear()
+            thread = threading.Thread(target=self.__write_behind,
+                                      name='SchedulerWriter')
+            thread.setDaemon(True)
+            thread.start()
+            self._writer_thread = thread
+
+        if self._cluster is not None:
+            for jobstore in self._jobstores.values():
+                if hasattr(jobstore, 'track_removals'):
+                    jobstore.track_removals()
+            self._sync_cluster()
+            logger.info('Joined the cluster as node "%s" (%d live nodes)',
+                        self._cluster.node, len(self._cluster.nodes))
+            self._cluster_stop.clear()
+            thread = threading.Thread(target=self.__sync_cluster,
+                                      name='SchedulerCluster')
+            thread.setDaemon(True)
+            thread.start()
+            self._cluster_thread = thread
+
+        if self._stats_export is not None:
+            self._stats_stop.clear()
+            thread = threading.Thread(target=self.__export_stats,
+                                      name='SchedulerStats')
+            thread.setDaemon(True)
+            thread.start()
+
+    def __export_stats(self):
+        while not self._stats_stop.wait(self._stats_interval):
+            try:
+                self._stats_export(self.get_stats())
+            except Exception:
+                logger.exception('Exporting the scheduler stats failed')
+
+    def get_stats(self):
+        """
+        Returns a snapshot of the stats (see stats.py), 
+        with the state of the thread pool and the 
+        number of scheduled jobs.
+        """
+        stats = self._stats.snapshot()
+        queue = getattr(self._threadpool, '_queue', None)
+        stats['threadpool'] = {
+            'queue_depth': queue.qsize() if queue is not None else None,
+            'threads': getattr(self._threadpool, 'num_threads', None)}
+        stats['scheduled_jobs'] = len(self._jobs_by_id) + len(self._stubs)
+        stats['stub_jobs'] = len(self._stubs)
+        stats['pending_writes'] = len(self._dirty) + len(self._dead)
+        stats['pending_jobs'] = len(self._pending_jobs)
+        stats['sinks'] = [subscription.get_stats() for subscription 
+                          in tuple(self._subscriptions)]
+        return stats
+
+    def subscribe(self, sink, events=None, batch_size=100, 
+                  flush_interval=1, maxsize=None):
+        """
+        Subscribes the sink to the events (see sinks.py);
+        its listener only queues them, and returns the 
+        Subscription.
+        """
+        if maxsize is None:
+            maxsize = self._sink_maxsize
+        subscription = Subscription(sink, event_mask(events), batch_size, 
+                                    flush_interval, maxsize)
+        self._listeners_lock.acquire()
+        try:
+            self._subscriptions.append(subscription)
+        finally:
+            self._listeners_lock.release()
+        self.add_listener(subscription.offer, subscription.mask)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Unsubscribes the sink, once the events queued 
+        for it are delivered.
+        """
+        self.remove_listener(subscription.offer)
+        self._listeners_lock.acquire()
+        try:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+        finally:
+            self._listeners_lock.release()
+        subscription.close()
+
+    def start(self):
+        self._prepare_start()
+        APScheduler.start(self)
+
+    def shutdown(self, wait=True, shutdown_threadpool=True,
+                 close_jobstores=True):
+        running = self.running
+        self._stats_stop.set()
+        self._cluster_stop.set()
+        self._loader_stop.set()
+        # let a sync (or a page load) finish before 
+        # the job stores are closed
+        thread, self._cluster_thread = self._cluster_thread, None
+        if thread is not None:
+            thread.join()
+        thread, self._loader_thread = self._loader_thread, None
+        if thread is not None:
+            thread.join()
+        self._writer_stop.set()
+        self._writer_wakeup.set()
+        thread, self._writer_thread = self._writer_thread, None
+        if thread is not None:
+            thread.join()
+        if self._thread is threading.currentThread():
+            # shut down by the main loop itself (standalone,
+            # in its own thread with AsyncScheduler): it
+            # returns once this is done, not to be joined
+            self._thread = None
+        APScheduler.shutdown(self, wait, shutdown_threadpool, False)
+        if running and wait:
+            # the events of the last runs
+            for subscription in tuple(self._subscriptions):
+                subscription.flush()
+        if running:
+            # the writes left by the main loop
+            self._write_behind()
+            if close_jobstores:
+                for jobstore in self._jobstores.values():
+                    jobstore.close()
+        pool, self._process_pool = self._process_pool, None
+        if running and pool is not None:
+            if wait:
+                pool.close()
+                pool.join()
+            else:
+                pool.terminate()
+#
+# End of APScheduler Backend
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 #
 # Scheduler Class
@@ -173,19 +2113,64 @@ class Scheduler:
     at(), every(), after() and cron().
     """
 
-    # Handle to APScheduler
-    __aps = APScheduler(_g_aps_default_sql_config)
+    # Handle to APScheduler; created on first use by
+    # _backend() from __aps_factory and __aps_config, 
+    # so that importing this module (or creating a 
+    # Scheduler) does not touch the job store.
+    __aps = None
+    __aps_factory = _Backend
+    __aps_config = dict(_g_aps_default_sql_config)
+    __aps_lock = threading.Lock()
+
+    def __init__(self, aps_config={}, backend_factory=None):
+        self.__batch = threading.local()
+        self.configure(aps_config, backend_factory) 
 
-    def __init__(self, aps_config={}):
-        self.configure(aps_config) 
+    def _backend(self):
+        """
+        Returns the handle to APScheduler, 
+        creating it if this is the first use.
+        (AsyncScheduler has a backend of its own, 
+        see asyncscheduler.py)
+        """
+        if Scheduler.__aps is None:
+            Scheduler.__aps_lock.acquire()
+            try:
+                if Scheduler.__aps is None:
+                    factory = Scheduler.__aps_factory
+                    Scheduler.__aps = factory(Scheduler.__aps_config)
+            finally:
+                Scheduler.__aps_lock.release()
+        return Scheduler.__aps
 
-    def configure(self, aps_config={}):
+    def configure(self, aps_config={}, backend_factory=None):
         """
         Re-configure the Scheduler with the 
         user preferred parameters, if given.
+
+        aps_config      : APScheduler configuration, 
+                          merged into the defaults
+        backend_factory : callable which takes the 
+                          configuration and returns 
+                          the APScheduler to use; can 
+                          only be given before the 
+                          backend is created
         """
+        Scheduler.__aps_lock.acquire()
+        try:
+            if Scheduler.__aps is None:
+                # not created yet: remember for first use
+                if backend_factory:
+                    Scheduler.__aps_factory = staticmethod(backend_factory)
+                Scheduler.__aps_config.update(aps_config)
+                return
+        finally:
+            Scheduler.__aps_lock.release()
+
         if Scheduler.__aps.running: 
             raise SchedulerAlreadyRunningError
+        if backend_factory:
+            raise BackendAlreadyCreatedError
         if aps_config: 
             Scheduler.__aps.configure(aps_config)
 
@@ -193,15 +2178,15 @@ class Scheduler:
         """
         Start the Scheduler. 
         """
-        if Scheduler.__aps.running: 
+        if self._backend().running: 
             raise SchedulerAlreadyRunningError
-        Scheduler.__aps.start()
+        self._backend().start()
 
     def stop(self):
         """
         Stop the Scheduler.
         """
-        if not Scheduler.__aps.running: 
+        if not self.is_running(): 
             raise SchedulerNotRunningError
         Scheduler.__aps.shutdown()
 
@@ -209,98 +2194,255 @@ class Scheduler:
         """
         Scheduler is running or not.
         """
-        return Scheduler.__aps.running
+        return Scheduler.__aps is not None and Scheduler.__aps.running
+
+    def register(self, name, obj):
+        """
+        Registers obj (an instance, function or class) 
+        under the given name, as the stable reference 
+        of the jobs using it or its methods (see 
+        registry.py). 
+
+        The jobs of a persistent job store using it 
+        are loaded again after a restart if obj is 
+        registered again before the first use of the 
+        Scheduler.
+        """
+        register(name, obj)
+
+    def __add_job(self, trigger, func, args, kwargs, options):
+        """
+        Creates the job and either schedules it right
+        away or adds it to the current batch. The job
+        is validated against the time of the call, not
+        the time after the backend is created.
+        """
+        now = datetime.now()
+        job, jobstore = self._backend().make_job(trigger, func, args,
+                                                  kwargs, **options)
+        jobs = getattr(self.__batch, 'jobs', None)
+        if jobs is not None:
+            jobs.append((job, jobstore))
+        else:
+            self._backend().add_jobs([(job, jobstore)], now)
+        return job
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager which collects all the jobs
+        scheduled by at(), every(), after(), cron()
+        (and their decorators) within its block and
+        schedules them together on exit: the jobs are
+        validated first (against the time the block
+        was entered), then persisted with one
+        add_jobs() call per job store.
+
+        Nothing is scheduled if the block raises.
+        Nested batches are merged into the outer one.
+        """
+        if getattr(self.__batch, 'jobs', None) is not None:
+            yield
+            return
+
+        now = datetime.now()
+        self.__batch.jobs = []
+        try:
+            yield
+            jobs = self.__batch.jobs
+        finally:
+            self.__batch.jobs = None
+        if jobs:
+            self._backend().add_jobs(jobs, now)
+
+    def add_jobs(self, specs):
+        """
+        Schedules many jobs together (see batch()).
+        Returns the list of scheduled jobs.
+
+        specs : list of dicts; 'kind' is one of 'at',
+                'every', 'after' or 'cron' and the
+                remaining items are the parameters
+                of that function, for example:
+                {'kind': 'every', 'func': f, 'seconds': 5}
+        """
+        kinds = {'at': self.at, 'every': self.every,
+                 'after': self.after, 'cron': self.cron}
+        jobs = []
+        with self.batch():
+            for spec in specs:
+                spec = dict(spec)
+                kind = spec.pop('kind', None)
+                if kind not in kinds:
+                    raise UnSupportedParameter
+                jobs.append(kinds[kind](**spec))
+        return jobs
 
     def at(self, func, date, args=None, **options):
         """
         Schedules a job to be completed
         _at_ a specific future date and time.
 
+        Raises ValueError when the job would never run
+        (a date in the past); this is checked as it is
+        scheduled, before start() too, and not once the
+        scheduler starts.
+
         func : name of the callable function 
         date : date and time to be called
         args : arguments to the function 'func'
+        executor : 'thread' [default] or 'process', to 
+                   run a CPU-bound 'func' in the process 
+                   pool; 'func' must be importable and
+                   'args' picklable
+        priority : runs of jobs with a higher priority 
+                   start first when the threads are busy
+        max_concurrency: max number of runs of 'func' in
+                   the threads at once [default: 
+                   apscheduler.runqueue.max_concurrency]
+        shard_key: jobs with the same key are stored in
+                   the same shard of a sharded job store
+        jitter   : seconds over which the fire times of
+                   jobs with the same schedule are spread;
+                   each job gets a fixed offset in that
+                   window; ValueError if it is higher than
+                   misfire_grace_time [default: 
+                   apscheduler.jitter, cut to the grace]
+        durable  : True to store the job in the 'default'
+                   (SQL) job store, False to keep it in
+                   memory, where it does not survive a 
+                   restart [default: none, the at() and 
+                   after() jobs due within 
+                   apscheduler.ephemeral.horizon are kept 
+                   in memory]
+        max_attempts : attempts of a run which fails, 
+                   the first one and its retries, as
+                   runs of the same job [default: 1]
+        retry_backoff : seconds before the first retry,
+                   doubled for each next one [default: 1]
+        retry_max_backoff : max seconds between two
+                   attempts [default: 300]
+        retry_jitter : fraction of the backoff added to
+                   it at random [default: 0.1]
+        retry_on : exception class (or tuple) of the 
+                   failures to retry [default: any 
+                   Exception]; with executor='process',
+                   only the exceptions which pickle
         """
-        return Scheduler.__aps.add_date_job(func, date, args, options)
+        return self.__add_job(SimpleTrigger(date), func, args, None, options)
 
     def schedule_at(self, date, args=None, **options):
         """
         Decorator for Scheduler.at()
         """
         def decorator(func):
-            func.job = Scheduler.__aps.add_date_job(func, date, args, options)
+            func.job = self.at(func, date, args, **options)
             return func
         return decorator
 
-    # TODO: Scheduler.every() uses APScheduler's add_interval_job()
+    # TODO: Scheduler.every() uses APScheduler's IntervalTrigger
     #       which currently does not support scheduling parameters 
     #       like year and month. Provide a patch to support this!
     def every(self, func, weeks=0, days=0, hours=0, minutes=0, 
               seconds=0, start_date=None, args=None, kwargs=None, 
-              **options): 
+              milliseconds=0, **options): 
         """
         Schedules a job to be completed for 
         _every_ specified weeks, days, hours, 
-        minutes, and seconds starting from 
-        the given start date and time.
+        minutes, seconds and milliseconds 
+        starting from the given start date 
+        and time.
 
         func    : name of the callable function
         weeks   : number of weeks to wait
         days    : number of days to wait
         hours   : number of hours to wait
         minutes : number of minutes to wait
-        seconds : number of seconds to wait
+        seconds : number of seconds to wait (may
+                  be fractional)
+        milliseconds: number of milliseconds to wait
         start_date: when to first execute the job 
                     and start the counter (default 
                     is after the given interval)
         args    : arguments to the function 'func'
+        kwargs  : keyword arguments to the function 'func'
+        executor: 'thread' [default] or 'process' (see at())
+        shard_key: see at()
+        jitter  : see at()
+        durable : see at()
+        priority, max_concurrency: see at()
+        max_attempts, retry_*: see at()
+
+        Raises ValueError when the job would never run
+        (see at()).
         """
-        return Scheduler.__aps.add_interval_job(func, weeks, days, 
-                                                hours, minutes, seconds, 
-                                                start_date, args, options)
+        interval = timedelta(weeks=weeks, days=days, hours=hours,
+                             minutes=minutes, seconds=seconds,
+                             milliseconds=milliseconds)
+        trigger = IntervalTrigger(interval, start_date)
+        return self.__add_job(trigger, func, args, kwargs, options)
 
     def schedule_every(self, weeks=0, days=0, hours=0, 
                        minutes=0, seconds=0, start_date=None, 
-                       args=None, kwargs=None, **options): 
+                       args=None, kwargs=None, milliseconds=0,
+                       **options): 
         """
         Decorator for Scheduler.every()
         """
         def decorator(func):
-            func.job = Scheduler.__aps.add_interval_job(func, weeks, days, 
-                                                hours, minutes, seconds, 
-                                                start_date, args, options)
+            func.job = self.every(func, weeks, days, hours, minutes,
+                                  seconds, start_date, args, kwargs,
+                                  milliseconds, **options)
             return func
         return decorator
 
     def after(self, func, weeks=0, days=0, hours=0, minutes=0, 
-              seconds=0, args=None, kwargs=None, **options): 
+              seconds=0, args=None, kwargs=None, milliseconds=0, 
+              **options): 
         """
         Schedules a job to be completed _after_ 
         the specified weeks, days, hours, 
-        minutes and seconds; starting now.
+        minutes, seconds and milliseconds; 
+        starting now.
 
         func    : name of the callable function
         weeks   : number of weeks to wait
         days    : number of days to wait
         hours   : number of hours to wait
         minutes : number of minutes to wait
-        seconds : number of seconds to wait
+        seconds : number of seconds to wait (may
+                  be fractional)
+        milliseconds: number of milliseconds to wait
         args    : arguments to the function 'func'
+        kwargs  : keyword arguments to the function 'func'
+        executor: 'thread' [default] or 'process' (see at())
+        shard_key: see at()
+        jitter  : see at()
+        durable : see at()
+        priority, max_concurrency: see at()
+        max_attempts, retry_*: see at()
+
+        Raises ValueError when the job would never run
+        (see at()).
         """
         alarm_time = datetime.now() + \
                      timedelta(weeks=weeks, days=days, 
                                hours=hours, minutes=minutes, 
-                               seconds=seconds)
-        return Scheduler.__aps.add_date_job(func, alarm_time, args, options)
+                               seconds=seconds, 
+                               milliseconds=milliseconds)
+        return self.__add_job(SimpleTrigger(alarm_time), func, 
+                              args, kwargs, options)
 
     def schedule_after(self, weeks=0, days=0, hours=0, minutes=0, 
-                       seconds=0, args=None, kwargs=None, **options): 
+                       seconds=0, args=None, kwargs=None, 
+                       milliseconds=0, **options): 
         """
         Decorator for Scheduler.after()
         """
         def decorator(func):
-            alarm_time = datetime.now() + timedelta(weeks=weeks, days=days, 
-                         hours=hours, minutes=minutes, seconds=seconds)
-            func.job = Scheduler.__aps.add_date_job(func, alarm_time, args, options)
+            func.job = self.after(func, weeks, days, hours, minutes,
+                                  seconds, args, kwargs, milliseconds,
+                                  **options)
             return func
         return decorator
 
@@ -312,6 +2454,11 @@ class Scheduler:
         Schedules a job to be completed on times
         the matches the given expression.
 
+        The expression is compiled once and shared 
+        by all the jobs using it (see cronexpr.py); 
+        job.trigger.next_n_fire_times(n) previews 
+        the next n fire times.
+
         func    : name of the callable function
         year    : year to run on
         month   : month to run on
@@ -320,15 +2467,28 @@ class Scheduler:
         day_of_week: weekday to run on (0 = Monday)
         hour    : hour to run on
         minute  : number of minutes to wait
-        second  : second to run on
+        second  : second to run on; may be fractional,
+                  as may its steps: '30.5', '*/0.25'
         start_date: when to first execute the job 
                     and start the counter (default 
                     is after the given interval)
         args    : arguments to the function 'func'
+        kwargs  : keyword arguments to the function 'func'
+        executor: 'thread' [default] or 'process' (see at())
+        shard_key: see at()
+        jitter  : see at()
+        durable : see at()
+        priority, max_concurrency: see at()
+        max_attempts, retry_*: see at()
+
+        Raises ValueError when the job would never run
+        (see at()).
         """
-        return Scheduler.__aps.add_cron_job(func, year, month, day, week, 
-                                            day_of_week, hour, minute, second, 
-                                            start_date, args, options)
+        trigger = make_cron_trigger(year=year, month=month, day=day, 
+                                    week=week, day_of_week=day_of_week, 
+                                    hour=hour, minute=minute, 
+                                    second=second, start_date=start_date)
+        return self.__add_job(trigger, func, args, kwargs, options)
 
     def schedule_cron(self, year='*', month='*', day='*', 
                       week='*', day_of_week='*', hour='*', 
@@ -338,9 +2498,9 @@ class Scheduler:
         Decorator for Scheduler.cron()
         """
         def decorator(func):
-            func.job = Scheduler.__aps.add_cron_job(func, year, month, day, week, 
-                                            day_of_week, hour, minute, second, 
-                                            start_date, args, options)
+            func.job = self.cron(func, year, month, day, week,
+                                 day_of_week, hour, minute, second,
+                                 start_date, args, kwargs, **options)
             return func
         return decorator
 
@@ -349,40 +2509,167 @@ class Scheduler:
         Unschedule a given job or function or jobid.
         """
         if job is None and func is None and jobid is None:
-            # future compatibility: 
-            # TODO: unschedule all the jobs and functions
-            #       but for now, just raise an exception
-            raise UnSupportedFeature
+            # unschedule all the jobs and functions
+            self._backend().unschedule_where(None)
         elif job is None and func is not None and jobid is None:
             # unschedule the given function in 'func' parameter
             # ignore 'job' and 'jobid' parameters
-            Scheduler.__aps.unschedule_func(func)
+            self._backend().unschedule_func(func)
         elif job is not None and func is None and jobid is None:
             # unschedule the given job in 'job' parameter
             # ignore 'func' and 'jobid' parameters
-            Scheduler.__aps.unschedule_job(job)
+            self._backend().unschedule_job(job)
         elif job is None and func is None and jobid is not None:
             # unschedule the given job in 'jobid' parameter
             # ignore 'func' and 'job' parameters
-            # TODO: this feature is expected in APScheduler 3.0
-            #       placeholder till then!
-            raise UnSupportedFeature
+            self._backend().unschedule_jobid(jobid)
         else:
             # wrong incoming parameter combinations 
             raise UnSupportedParameter
             
+    def unschedule_where(self, predicate=None, trigger=None, 
+                         func=None, name_prefix=None, 
+                         next_run_after=None, next_run_before=None):
+        """
+        Unschedule all the jobs which match all 
+        the given criteria (see JobFilter). Jobs 
+        in a persistent job store are deleted 
+        together, not one DELETE per job.
+
+        predicate   : callable, takes a job and 
+                      returns True to unschedule it
+        trigger     : 'at', 'after', 'every' or 'cron'
+        func        : the callable function of the job
+        name_prefix : prefix of the job name
+        next_run_after  : next run time is at or after
+        next_run_before : next run time is before
+
+        Returns the number of unscheduled jobs.
+        """
+        job_filter = JobFilter(predicate, trigger, func, name_prefix,
+                               next_run_after, next_run_before)
+        if job_filter.is_empty():
+            # use unschedule() to unschedule everything
+            raise UnSupportedParameter
+        return self._backend().unschedule_where(job_filter)
+
+    def get_job(self, jobid):
+        """
+        Returns the scheduled job with the 
+        given id, or None if there is none.
+        """
+        return self._backend().get_job(jobid)
+
+    def get_stats(self):
+        """
+        Returns a snapshot of the instrumentation of 
+        the Scheduler (see stats.py): counters of runs, 
+        misfires, coalesced runs and errors; histograms 
+        of how late the runs start and of how long they 
+        take, in all, per job and per callable; the 
+        durations of the job store operations and the 
+        thread pool queue depth. 
+
+        The snapshot can also be exported periodically
+        (see apscheduler.stats.export).
+        """
+        return self._backend().get_stats()
+
+    def iter_jobs(self, filter=None, order_by=None, limit=None, 
+                  offset=0):
+        """
+        Returns an iterator over the scheduled jobs,
+        which reads them as it goes instead of copying 
+        all of them. The criteria of the filter, but its 
+        predicate, are done in SQL for the persistent 
+        job stores.
+
+        filter   : JobFilter selecting the jobs 
+                   [default: none, all the jobs]
+        order_by : 'id', 'name' or 'next_run_time'
+                   [default: none, in no given order]
+        limit    : max number of jobs [default: none]
+        offset   : number of jobs to skip [default: 0]
+        """
+        return self._backend().iter_jobs(filter, order_by, limit, offset)
+
+    def count_jobs(self, filter=None):
+        """
+        Returns the number of scheduled jobs matching 
+        the given JobFilter (all if None), counted in 
+        SQL for the persistent job stores.
+        """
+        return self._backend().count_jobs(filter)
+
+    def simulate(self, horizon=86400, bucket=1, duration=None, clock=None):
+        """
+        Forecasts the runs of the scheduled jobs over the
+        next 'horizon' seconds, from their triggers and 
+        without running them; returns a report (see 
+        simulate.py): the number of fires per 'bucket' 
+        seconds, the peak fires and the peak number of 
+        runs at once.
+
+        horizon  : seconds to forecast [default: a day]
+        bucket   : seconds per bucket [default: 1]
+        duration : expected seconds of a run, or a 
+                   callable taking the job [default: 
+                   the mean duration of the runs of
+                   its callable so far]
+        clock    : simulate.VirtualClock the forecast 
+                   starts at, advanced to its end 
+                   [default: one at now]
+        """
+        return self._backend().simulate(horizon, bucket, duration, clock)
+
+    def subscribe(self, sink, events=None, batch_size=100, 
+                  flush_interval=1, maxsize=None):
+        """
+        Subscribes a sink to the scheduler events; 
+        returns the Subscription (see sinks.py). The 
+        events are queued without blocking the scheduler
+        and the sink is called with lists of them, on a 
+        thread of its own.
+
+        sink           : callable taking a list of events
+                         (apscheduler.events.JobEvent, ...)
+        events         : names of the events ('executed',
+                         'error', 'missed', 'added', 
+                         'removed', 'start', 'shutdown') or
+                         an APScheduler event mask 
+                         [default: executed, error, missed]
+        batch_size     : max events per call [default: 100]
+        flush_interval : max seconds an event waits for its
+                         batch [default: 1]
+        maxsize        : max events queued, the others are
+                         dropped and counted [default: 
+                         apscheduler.sinks.maxsize]
+        """
+        return self._backend().subscribe(sink, events, batch_size, 
+                                         flush_interval, maxsize)
+
+    def unsubscribe(self, subscription):
+        """
+        Unsubscribes the sink of the Subscription 
+        returned by subscribe(), once the events 
+        queued for it are delivered.
+        """
+        self._backend().unsubscribe(subscription)
+
     def get_scheduled_jobs(self):
         """
-        Returns a list of all scheduled jobs. 
+        Returns a list of all scheduled jobs 
+        (see iter_jobs() and count_jobs()). 
         """
-        return Scheduler.__aps.get_jobs()
+        return self._backend().get_jobs()
 
     def get_scheduled_jobs_list(self):
         """
         Prints the list of all scheduled jobs 
-        in human readable format. 
+        in human readable format, a line at 
+        a time. 
         """
-        return Scheduler.__aps.print_jobs()
+        return self._backend().print_jobs()
 
 #
 # End of Scheduler Classes
@@ -406,6 +2693,72 @@ if __name__ == '__main__':
          for all the above mentioned functions. 
      [b] please refer the usage.py for examples
          on how to use the scheduler.
+     [c] many jobs can be scheduled together using 
+         batch() or add_jobs(); they are persisted 
+         in a few transactions instead of one each.
+     [d] CPU-bound functions can run in worker 
+         processes with executor='process'; see 
+         apscheduler.processpool.max_workers.
+     [e] asyncio services can use AsyncScheduler 
+         (asyncscheduler.py), which runs on their 
+         event loop and awaits coroutine jobs.
+     [f] objects whose methods are scheduled can be 
+         registered with register(name, obj); their 
+         jobs then survive restarts (see registry.py).
+     [g] get_stats() returns the run counters, the lag and
+         duration histograms and the job store timings
+         (see stats.py).
+     [h] several processes can share the SQL job store with
+         apscheduler.cluster.enabled: each fire time of a
+         job is claimed (leased) and run by one of them
+         (see cluster.py).
+     [i] the jobs can be spread over several tables or
+         databases with jobstore:ShardedJobStore; see
+         jobstore.py and the shard_key job option.
+     [j] jobs with the same schedule can be spread over a
+         window with the jitter option (or apscheduler.jitter).
+     [k] the runs wait for a thread in a bounded priority
+         queue (apscheduler.runqueue.*), with the priority
+         and max_concurrency job options; see runqueue.py.
+     [l] logging is configured with apscheduler.logging.*:
+         levels per logger, a queue writing the log in a
+         thread of its own and sampled job events.
+     [m] the jobs are stored in a compact encoding (trigger
+         columns, marshalled args); their args and kwargs
+         are decoded when they run; see codec.py.
+     [n] large job stores can be loaded in pages with
+         apscheduler.jobstore.default.page_size (and
+         .horizon): the scheduler fires the first jobs
+         while the rest are loaded.
+     [o] iter_jobs() and count_jobs() list and count the
+         jobs matching a JobFilter (ordered, with limit
+         and offset), in SQL for the persistent job store,
+         without copying all the jobs.
+     [p] with apscheduler.writebehind.interval, the next
+         run times are written to the SQL job store in
+         grouped transactions every interval; a crash
+         may fire the jobs of that interval again.
+     [q] short-lived jobs (durable=False, or at() and
+         after() jobs due within apscheduler.ephemeral.
+         horizon) are kept in memory, not in the SQL job
+         store; listing and unschedule() cover both.
+     [r] failed runs can be retried with backoff and 
+         jitter: max_attempts, retry_backoff and retry_on
+         job options (see at()); the pending retry is 
+         stored with the job.
+     [s] sub-second schedules: milliseconds in every()
+         and after(), fractional seconds in cron(); the
+         main loop wakes up on time within a fraction of
+         a millisecond (apscheduler.wakeup.*, clock.py).
+     [t] simulate() forecasts the fires per second and the
+         peak concurrency of the scheduled jobs over a 
+         horizon, from their triggers on a virtual clock,
+         without running them (see simulate.py).
+     [u] subscribe(sink) delivers the job outcomes to the 
+         sink in batches, on a thread of its own; the 
+         events are queued without blocking the scheduler,
+         in a bounded queue counting the dropped ones 
+         (see sinks.py).
 
     Thank you!!"""
 #
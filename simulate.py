@@ -0,0 +1,247 @@
+"""
+Simulate
+
+Forecast of the runs of the scheduled jobs over a
+horizon (see Scheduler.simulate() in scheduler.py),
+replayed from their triggers on a virtual clock, at
+once and without running the callables:
+
+ [1] histogram   : number of fires per bucket of the
+                   horizon
+ [2] concurrency : number of runs in progress, each
+                   lasting its expected duration
+ [3] peaks       : the bucket with the most fires and
+                   the one with the most runs at once
+
+The fire times are computed per series of jobs, not
+per job; the jobs of a series fire together, and the
+series is walked once for all of them:
+
+  at()    : the jobs due in the same bucket
+  every() : the jobs with the same interval whose first
+            fire in the horizon is in the same bucket,
+            if the interval is a whole number of buckets
+            (else at the same time); the series of the
+            same interval are then walked together, one
+            pass over the buckets with a count per phase
+  cron()  : the jobs with the same compiled expression
+            (see cronexpr.py), start date and offset
+
+the other triggers are walked job by job. A pending
+retry (see job.py) counts as one more fire.
+"""
+
+from apscheduler.triggers import SimpleTrigger, IntervalTrigger
+from cronexpr import CompiledCronTrigger
+from datetime import datetime, timedelta
+import math
+import time
+
+__all__ = ('VirtualClock', 'simulate')
+
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+class VirtualClock(object):
+    """
+    Clock of the simulations, which only moves
+    when it is advanced, and does so at once.
+    """
+
+    def __init__(self, start=None):
+        self.time = start or datetime.now()
+
+    def now(self):
+        return self.time
+
+    def advance(self, seconds):
+        """
+        Moves the clock forward; returns the new time.
+        """
+        self.time += timedelta(seconds=seconds)
+        return self.time
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Simulation
+#
+# duration : expected seconds of a run of a job, for the
+#            concurrency: a number, or a callable taking
+#            the job; a run counts in the buckets it
+#            overlaps, at least in its own [default: 0]
+#
+# the report is a dict:
+#   start, end, bucket (seconds), jobs, series,
+#   fires             : total number of fires
+#   histogram         : number of fires per bucket
+#   mean_fires_per_s  : fires / horizon
+#   peak_fires, peak_fires_at, peak_fires_per_s
+#   peak_concurrency, peak_concurrency_at
+#   elapsed           : seconds taken by the simulation
+#
+def simulate(jobs, clock=None, horizon=86400, bucket=1, duration=0):
+    """
+    Replays the triggers of the given jobs over the
+    'horizon' seconds from clock.now(), then advances
+    the clock to the end of the horizon. Returns the
+    report (see above).
+    """
+    started = time.time()
+    clock = clock or VirtualClock()
+    start = clock.now()
+    horizon = float(horizon)
+    bucket = float(bucket)
+    if horizon <= 0 or bucket <= 0:
+        raise ValueError('horizon and bucket must be positive values')
+    nbuckets = int(math.ceil(horizon / bucket))
+    fires = [0] * nbuckets
+    # +count where runs start, -count where they end
+    running = [0] * (nbuckets + 1)
+
+    def record(index, count, width):
+        fires[index] += count
+        running[index] += count
+        if index + width < nbuckets:
+            running[index + width] -= count
+
+    series = {}
+    # (buckets per interval, width) -> number of jobs
+    # by the bucket of their first fire
+    periodic = {}
+    njobs = 0
+    for job in jobs:
+        njobs += 1
+        seconds = duration(job) if callable(duration) else duration
+        width = max(int(math.ceil((seconds or 0) / bucket)), 1)
+        remaining = None
+        if job.max_runs:
+            remaining = max(job.max_runs - job.runs, 0)
+        offset = getattr(job, 'offset', None)
+        offset = _seconds(offset) if offset else 0.0
+
+        retry_at = getattr(job, 'retry_at', None)
+        if retry_at is not None:
+            at = _seconds(retry_at - start)
+            if 0 <= at < horizon:
+                record(int(at // bucket), 1, width)
+        if remaining == 0:
+            continue
+
+        trigger = job.trigger
+        kind = type(trigger)
+        if kind is SimpleTrigger:
+            at = _seconds(trigger.run_date - start) + offset
+            if 0 <= at < horizon:
+                record(int(at // bucket), 1, width)
+            continue
+        if kind is IntervalTrigger:
+            step = trigger.interval_length
+            first = _seconds(trigger.start_date - start) + offset
+            if first < 0:
+                first += math.ceil(-first / step) * step
+            if first >= horizon:
+                continue
+            ratio = step / bucket
+            if ratio == int(ratio) and remaining is None:
+                starts = periodic.setdefault((int(ratio), width), {})
+                index = int(first // bucket)
+                starts[index] = starts.get(index, 0) + 1
+                continue
+            elif ratio == int(ratio):
+                key = ('buckets', int(ratio), int(first // bucket),
+                       remaining, width)
+            else:
+                key = ('every', step, first, remaining, width)
+        elif kind is CompiledCronTrigger:
+            key = ('cron', trigger.spec, trigger.start_date, offset,
+                   remaining, width)
+        else:
+            key = ('job', id(job), trigger, offset, remaining, width)
+        entry = series.get(key)
+        if entry is None:
+            series[key] = [1, job]
+        else:
+            entry[0] += 1
+
+    end = start + timedelta(seconds=horizon)
+    for (ratio, width), starts in periodic.items():
+        # the jobs firing at index, by index % ratio
+        phases = [0] * ratio
+        for index in range(min(starts), nbuckets):
+            phase = index % ratio
+            count = phases[phase] + starts.get(index, 0)
+            if count:
+                phases[phase] = count
+                record(index, count, width)
+    for key, (count, job) in series.items():
+        kind, remaining, width = key[0], key[-2], key[-1]
+        if kind == 'buckets':
+            ratio, first = key[1], key[2]
+            stop = nbuckets
+            if remaining is not None:
+                stop = min(stop, first + remaining * ratio)
+            for index in range(first, stop, ratio):
+                record(index, count, width)
+        elif kind == 'every':
+            step, first = key[1], key[2]
+            n = 0
+            at = first
+            while at < horizon and (remaining is None or n < remaining):
+                record(int(at // bucket), count, width)
+                n += 1
+                at = first + n * step
+        else:
+            offset = key[3]
+            shift = timedelta(seconds=offset)
+            n = 0
+            for fire_time in _fire_times(job, start - shift):
+                at = _seconds(fire_time - start) + offset
+                if at >= horizon or (remaining is not None and
+                                     n >= remaining):
+                    break
+                if at >= 0:
+                    record(int(at // bucket), count, width)
+                    n += 1
+
+    peak, peak_index, level = 0, 0, 0
+    for index in range(nbuckets):
+        level += running[index]
+        if level > peak:
+            peak, peak_index = level, index
+    peak_fires = max(fires) if fires else 0
+    total = sum(fires)
+    clock.advance(horizon)
+    return {'start': start, 'end': end, 'bucket': bucket,
+            'jobs': njobs, 'fires': total,
+            'series': len(series) + sum(len(starts) for starts
+                                        in periodic.values()),
+            'histogram': fires, 'mean_fires_per_s': total / horizon,
+            'peak_fires': peak_fires,
+            'peak_fires_at': start + timedelta(
+                seconds=fires.index(peak_fires) * bucket if fires else 0),
+            'peak_fires_per_s': peak_fires / bucket,
+            'peak_concurrency': peak,
+            'peak_concurrency_at': start + timedelta(
+                seconds=peak_index * bucket),
+            'elapsed': time.time() - started}
+
+
+def _fire_times(job, start):
+    # the fire times of the trigger of a job
+    # (without its offset) from 'start', in order
+    trigger = job.trigger
+    if isinstance(trigger, CompiledCronTrigger):
+        for fire_time in trigger.fire_times(start):
+            yield fire_time
+        return
+    fire_time = trigger.get_next_fire_time(start)
+    while fire_time is not None:
+        yield fire_time
+        fire_time = trigger.get_next_fire_time(
+            fire_time + timedelta(microseconds=1))
+#
+# End of Simulation
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,211 @@
+"""
+Sinks
+
+Asynchronous delivery of the scheduler events (job
+executed, error, missed, ...) to the sinks subscribed
+with Scheduler.subscribe() (see scheduler.py):
+
+ [1] queue    : an event is queued without blocking,
+                by the thread which raised it; each
+                subscription has a bounded queue of
+                its own, and counts the events dropped
+                when it is full
+ [2] batches  : a thread per subscription calls the
+                sink with lists of events, at most
+                batch_size of them, at most
+                flush_interval seconds after the first
+                one was queued
+ [3] counters : queued, delivered, dropped and failed
+                (delivered to a sink which raised)
+                events of each subscription
+
+A slow sink only delays its own subscription; the
+scheduler and the worker threads never wait for it.
+"""
+
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOBSTORE_JOB_ADDED
+from apscheduler.events import EVENT_JOBSTORE_JOB_REMOVED
+from apscheduler.events import EVENT_SCHEDULER_START
+from apscheduler.events import EVENT_SCHEDULER_SHUTDOWN
+from clock import monotonic
+from threading import Thread
+import logging
+
+try:
+    from queue import Queue, Full, Empty
+except ImportError:
+    from Queue import Queue, Full, Empty
+
+__all__ = ('Subscription', 'event_mask')
+
+logger = logging.getLogger(__name__)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Events
+#
+# _g_event_names : name -> APScheduler event code, for
+#                  the events of subscribe()
+#
+# the job outcomes (executed, error, missed) are the
+# default events of a subscription.
+#
+_g_event_names = {
+    'executed'  : EVENT_JOB_EXECUTED,
+    'error'     : EVENT_JOB_ERROR,
+    'missed'    : EVENT_JOB_MISSED,
+    'added'     : EVENT_JOBSTORE_JOB_ADDED,
+    'removed'   : EVENT_JOBSTORE_JOB_REMOVED,
+    'start'     : EVENT_SCHEDULER_START,
+    'shutdown'  : EVENT_SCHEDULER_SHUTDOWN,
+}
+_g_outcomes = EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED
+
+
+def event_mask(events):
+    """
+    Returns the APScheduler event mask of the given
+    events: a mask, or names of _g_event_names.
+    """
+    if events is None:
+        return _g_outcomes
+    if isinstance(events, (int, long)):
+        return events
+    if isinstance(events, basestring):
+        events = [events]
+    mask = 0
+    for name in events:
+        if name not in _g_event_names:
+            raise ValueError('Unknown event "%s", choose from: %s' %
+                             (name, ', '.join(sorted(_g_event_names))))
+        mask |= _g_event_names[name]
+    return mask
+#
+# End of Events
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Subscription
+#
+# sink           : callable taking a list of events
+# mask           : APScheduler event mask of the events
+# batch_size     : max number of events per call of the
+#                  sink [default: 100]
+# flush_interval : max seconds an event waits for its
+#                  batch to fill up [default: 1]
+# maxsize        : max number of events queued; the
+#                  others are dropped [default: 10000]
+#
+# _g_flush and _g_close are queued by flush() and close():
+# the events queued before them are delivered at once.
+#
+_g_flush = object()
+_g_close = object()
+
+
+class Subscription(object):
+    """
+    A sink subscribed to the scheduler events, with
+    its queue and its delivery thread.
+    """
+
+    def __init__(self, sink, mask, batch_size=100, flush_interval=1,
+                 maxsize=10000):
+        if not callable(sink):
+            raise TypeError('sink must be callable')
+        self.sink = sink
+        self.mask = mask
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = max(float(flush_interval), 0)
+        self.queued = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.__queue = Queue(max(int(maxsize), 0))
+        self.__thread = Thread(target=self.__deliver,
+                               name='SchedulerSink')
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def offer(self, event):
+        """
+        Queues an event, without blocking; the APScheduler
+        listener of the subscription.
+        """
+        try:
+            self.__queue.put_nowait(event)
+            self.queued += 1
+        except Full:
+            self.dropped += 1
+
+    def __deliver(self):
+        closing = False
+        while not closing:
+            batch = []
+            taken = 1
+            item = self.__queue.get()
+            deadline = monotonic() + self.flush_interval
+            while True:
+                if item is _g_close:
+                    closing = True
+                    break
+                if item is _g_flush:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.__queue.get(True, remaining)
+                    taken += 1
+                except Empty:
+                    break
+            if batch:
+                self.__send(batch)
+            for _ in range(taken):
+                self.__queue.task_done()
+
+    def __send(self, batch):
+        try:
+            self.sink(batch)
+            self.delivered += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception('Sink %r failed on a batch of %d events',
+                             self.sink, len(batch))
+
+    def flush(self):
+        """
+        Waits until the events queued so far are
+        delivered.
+        """
+        if self.__thread.is_alive():
+            self.__queue.put(_g_flush)
+            self.__queue.join()
+
+    def close(self):
+        """
+        Delivers the events left, then stops the
+        delivery thread.
+        """
+        if self.__thread.is_alive():
+            self.__queue.put(_g_close)
+            self.__thread.join()
+
+    def get_stats(self):
+        """
+        Returns the counters of the subscription and
+        the number of events waiting.
+        """
+        return {'sink': repr(self.sink), 'queued': self.queued,
+                'delivered': self.delivered, 'dropped': self.dropped,
+                'failed': self.failed, 'waiting': self.__queue.qsize()}
+#
+# End of Subscription
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,245 @@
+"""
+Stats
+
+Instrumentation of the Scheduler (see scheduler.py),
+returned by Scheduler.get_stats():
+
+ [1] counters   : runs, executed, errors, misfires,
+                  skipped (max instances reached),
+                  overflows (missed as the run queue
+                  is full) and coalesced runs
+ [2] lag        : how late the runs start, after
+                  their scheduled run time
+ [3] duration   : how long the runs take
+ [4] jobstore   : duration of each job store operation
+
+lag and duration are histograms for all the runs,
+per job and per callable (job.func_ref, or the job
+name if it has none).
+
+Every thread records into a shard of its own, so
+recording takes no lock; the shards are added up
+when a snapshot is taken. The shards of the threads
+which are gone are folded into one.
+"""
+
+from datetime import datetime
+import threading
+import time
+
+__all__ = ('Stats', 'histogram_summary')
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Histograms
+#
+# a histogram is a list [count, sum, max, buckets],
+# where bucket k counts the values (in seconds) from
+# 2^(k-1) to 2^k microseconds, k from 0 to 40
+#
+_g_buckets = 41
+
+
+def _new_histogram():
+    return [0, 0.0, 0.0, [0] * _g_buckets]
+
+
+def _add(histogram, value):
+    histogram[0] += 1
+    histogram[1] += value
+    if value > histogram[2]:
+        histogram[2] = value
+    k = int(value * 1e6).bit_length() if value > 0 else 0
+    histogram[3][min(k, _g_buckets - 1)] += 1
+
+
+def _merge(into, histogram):
+    into[0] += histogram[0]
+    into[1] += histogram[1]
+    into[2] = max(into[2], histogram[2])
+    buckets = into[3]
+    for k, count in enumerate(histogram[3]):
+        if count:
+            buckets[k] += count
+
+
+def _upper_bound(k):
+    return (1 << k) / 1e6
+
+
+def histogram_summary(histogram):
+    """
+    Returns a histogram as a dict: count, sum, mean,
+    max, the p50, p90 and p99 estimates (the upper
+    bounds of their buckets, at most max) and the
+    non-empty buckets, by upper bound in seconds.
+    """
+    count, total, maximum, buckets = histogram
+    summary = {'count': count, 'sum': total, 'max': maximum,
+               'mean': total / count if count else 0.0,
+               'buckets': dict((_upper_bound(k), n)
+                               for k, n in enumerate(buckets) if n)}
+    for percent in (50, 90, 99):
+        rank, seen, value = count * percent / 100.0, 0, 0.0
+        for k, n in enumerate(buckets):
+            seen += n
+            if n and seen >= rank:
+                value = min(_upper_bound(k), maximum)
+                break
+        summary['p%d' % percent] = value
+    return summary
+#
+# End of Histograms
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Stats
+#
+# histograms of a shard, by key:
+#   (kind,)                : kind is 'lag' or 'duration'
+#   (kind, 'job', job id)
+#   (kind, 'func', callable)
+#   ('jobstore', operation)
+#
+_g_counters = ('runs', 'executed', 'errors', 'misfires', 'skipped',
+               'overflows', 'coalesced', 'retries')
+
+
+class _Shard(object):
+
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.counters = dict.fromkeys(_g_counters, 0)
+        self.histograms = {}
+
+    def fold(self, shard):
+        """
+        Adds the counters and histograms of 
+        the given shard to this one.
+        """
+        for counter, n in list(shard.counters.items()):
+            self.counters[counter] += n
+        for key, histogram in list(shard.histograms.items()):
+            merged = self.histograms.get(key)
+            if merged is None:
+                merged = self.histograms[key] = _new_histogram()
+            _merge(merged, histogram)
+
+
+class Stats(object):
+    """
+    Collects the counters and histograms of a scheduler
+    backend. The record methods can be called from any
+    thread without locking.
+    """
+
+    def __init__(self):
+        self.__local = threading.local()
+        self.__shards = []
+        self.__shards_lock = threading.Lock()
+        self.__retired = _Shard()
+        # ids of the jobs with histograms
+        self.__jobids = set()
+
+    def __shard(self):
+        shard = getattr(self.__local, 'shard', None)
+        if shard is None:
+            # once per thread
+            shard = _Shard(threading.current_thread())
+            self.__local.shard = shard
+            self.__shards_lock.acquire()
+            try:
+                self.__retire()
+                self.__shards.append(shard)
+            finally:
+                self.__shards_lock.release()
+        return shard
+
+    def __retire(self):
+        # folds the shards of the threads which are gone
+        live = []
+        for shard in self.__shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+            else:
+                self.__retired.fold(shard)
+        self.__shards = live
+
+    def __histogram(self, shard, key):
+        histogram = shard.histograms.get(key)
+        if histogram is None:
+            histogram = shard.histograms[key] = _new_histogram()
+        return histogram
+
+    def count(self, counter, n=1):
+        self.__shard().counters[counter] += n
+
+    def run(self, kind, job, seconds):
+        """
+        Records the lag or the duration of a run of a job.
+        """
+        shard = self.__shard()
+        self.__jobids.add(job.id)
+        _add(self.__histogram(shard, (kind,)), seconds)
+        _add(self.__histogram(shard, (kind, 'job', job.id)), seconds)
+        func = getattr(job, 'func_ref', None) or job.name
+        _add(self.__histogram(shard, (kind, 'func', func)), seconds)
+
+    def jobstore(self, operation, started):
+        """
+        Records the duration of a job store operation
+        which started at 'started' (time.time()).
+        """
+        _add(self.__histogram(self.__shard(), ('jobstore', operation)),
+             time.time() - started)
+
+    def __all_shards(self):
+        self.__shards_lock.acquire()
+        try:
+            return self.__shards + [self.__retired]
+        finally:
+            self.__shards_lock.release()
+
+    def forget_job(self, jobid):
+        """
+        Drops the histograms of the given (removed) job.
+        """
+        if jobid not in self.__jobids:
+            return
+        self.__jobids.discard(jobid)
+        for shard in self.__all_shards():
+            for kind in ('lag', 'duration'):
+                shard.histograms.pop((kind, 'job', jobid), None)
+
+    def snapshot(self):
+        """
+        Returns the counters and histograms recorded so
+        far, added up over all the threads.
+        """
+        total = _Shard()
+        for shard in self.__all_shards():
+            total.fold(shard)
+        counters, histograms = total.counters, total.histograms
+
+        stats = {'time': datetime.now(), 'counters': counters,
+                 'lag': histogram_summary(histograms.pop(('lag',), None)
+                                          or _new_histogram()),
+                 'duration': histogram_summary(
+                     histograms.pop(('duration',), None)
+                     or _new_histogram()),
+                 'jobs': {}, 'callables': {}, 'jobstore': {}}
+        for key, histogram in histograms.items():
+            if key[0] == 'jobstore':
+                stats['jobstore'][key[1]] = histogram_summary(histogram)
+            else:
+                kind, scope, name = key
+                group = stats['jobs' if scope == 'job' else 'callables']
+                group.setdefault(name, {})[kind] = \
+                    histogram_summary(histogram)
+        return stats
+#
+# End of Stats
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -1,5 +1,6 @@
 # import the scheduler
 from scheduler import Scheduler as scheduler
+from scheduler import JobFilter
 
 # to calculate date and time 
 from datetime import datetime, timedelta
@@ -82,6 +83,18 @@ j2_start_date = datetime.now() + timedelta(seconds=90)
 every_j2 = sched.every(func, start_date=j2_start_date, 
                        args=["EVERY 10s"], seconds=10)
 
+# executes every 20 seconds in a worker process
+# (executor='process'), for CPU-bound functions;
+# the function must be importable (module level)
+every_j3 = sched.every(func, args=["EVERY 20s IN A PROCESS"],
+                       seconds=20, executor='process')
+
+# executes every 5 seconds, shifted by a fixed offset 
+# of up to 3 seconds (jitter), so that many such jobs 
+# do not all start at the same instant
+every_j4 = sched.every(func, args=["EVERY 5s WITH JITTER"],
+                       seconds=5, jitter=3, misfire_grace_time=5)
+
 # decorator for every()
 # executes every 30 seconds starting now
 @sched.schedule_every(seconds=30,
@@ -149,21 +162,30 @@ def dec_after(*args):
 #   args    : arguments to the function 'func'
 #
 # executes at the following:
-# year      : 2012, 2013, 2014 and 2015
+# year      : this year and the next 3
 # months    : jan, feb, march, may, july, sept, nov and dec
 # seconds   : every 5 seconds  
-cron_j1 = sched.cron(func, year='2012-2015', 
+#
+# a job which would never run (all its years in the past,
+# say) is refused with ValueError when it is scheduled
+this_year = datetime.now().year
+cron_j1 = sched.cron(func, year='%d-%d' % (this_year, this_year + 3), 
                      month='1-3,5,7,9,11-12', 
-                     second='5,10,15,20,25,30,35,40,45,50,55,60', 
-                     args=["CORN 5s,m1-3,5,7,9,11,12,y2012-15"])
+                     second='0,5,10,15,20,25,30,35,40,45,50,55', 
+                     args=["CORN 5s,m1-3,5,7,9,11,12,y+0-3"])
+
+# preview the next 3 fire times of the above cron() job
+print 'cron_j1 next fire times: %s' % \
+      cron_j1.trigger.next_n_fire_times(3)
 
 # decorator for corn()
 # executes at the following:
-# year      : 2013
+# year      : next year
 # months    : feb, march, apr, may, june and july
 # seconds   : every 15 seconds  
-@sched.schedule_cron(year='2013', month='2-7', second='15,30,45,60',
-                     args=["DECORATOR", "CORN", "15s,m2-7,y2013"])
+@sched.schedule_cron(year=str(this_year + 1), month='2-7', 
+                     second='0,15,30,45',
+                     args=["DECORATOR", "CORN", "15s,m2-7,y+1"])
 def dec_cron(*args):
     fname = inspect.stack()[0][3] #function name
     print '%s : %s : current time "%s"' % \
@@ -174,6 +196,37 @@ def dec_cron(*args):
 
 
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Scheduler.batch() 
+# Scheduler.add_jobs() 
+#
+# input:
+#   add_jobs : list of dicts, 'kind' is one of 'at', 
+#              'every', 'after' or 'cron' and the rest 
+#              are the parameters of that function
+#
+# all the jobs scheduled within a batch (including the 
+# decorators) are validated first and then persisted 
+# together, instead of one INSERT per job.
+with sched.batch():
+    for n in range(3):
+        sched.after(func, minutes=2, seconds=n, 
+                    args=["BATCH AFTER +2m%ds" % n])
+
+batch_jobs = sched.add_jobs([
+    {'kind': 'at', 'func': func, 'args': ["ADD_JOBS AT +40s"],
+     'date': datetime.now() + timedelta(seconds=40)},
+    {'kind': 'every', 'func': func, 'args': ["ADD_JOBS EVERY 50s"],
+     'seconds': 50},
+])
+#
+# End of Scheduler.batch() 
+# End of Scheduler.add_jobs() 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 #
 # Scheduler.get_scheduled_jobs() 
@@ -186,16 +239,23 @@ def dec_cron(*args):
 #
 #   get_scheduled_jobs_list : human readable list of 
 #                             all scheduled jobs,
-#                             returns string.
+#                             printed a line at a time.
+#
+# Scheduler.iter_jobs() goes through the jobs (matching
+# a JobFilter, ordered, limit and offset) without copying 
+# all of them, and Scheduler.count_jobs() counts them; 
+# both in SQL for a persistent job store.
 #
-# print the list of all scheduled jobs 
-# for every 1 minute
+# print the number of scheduled jobs, of cron jobs and
+# the next 5 jobs to run for every 1 minute
 @sched.schedule_every(minutes=1,
                       args=["EVERY", "+1m"])
 def dec_print_scheduled_jobs(*args):
     fname = inspect.stack()[0][3] #function name
-    print '%s : %s : current time "%s"' % \
-          (fname, sched.get_scheduled_jobs(), \
+    print '%s : %d jobs, %d cron jobs, next %s : current time "%s"' % \
+          (fname, sched.count_jobs(), \
+          sched.count_jobs(JobFilter(trigger='cron')), \
+          list(sched.iter_jobs(order_by='next_run_time', limit=5)), \
           datetime.now())
 
 # print the list of all scheduled jobs in 
@@ -222,7 +282,17 @@ def dec_print_scheduled_jobs_list(*args):
 #   job     : instance of type job to be unscheduled 
 #   func    : function - all jobs scheduled on this 
 #             function will be unscheduled
-#   jobid   : job with jobid will be unscheduled (TODO)
+#   jobid   : job with jobid will be unscheduled
+#
+# Scheduler.get_job() returns the job with the given 
+# jobid (job.id), without scanning all the jobs.
+#
+# Scheduler.unschedule() without any parameter 
+# unschedules all the jobs, and 
+# Scheduler.unschedule_where() unschedules all the 
+# jobs matching the given criteria (trigger, func, 
+# name_prefix, next_run_after, next_run_before or 
+# a predicate) - both with a single DELETE.
 #
 # unschedule_func function is called at 3 minutes 
 # from now. this function will unschedule all the 
@@ -235,7 +305,10 @@ def unschedule_func(*args):
     print '%s : %s : current time "%s"' % \
           (fname, args, datetime.now())
     #sched.unschedule(job=j4)
-    #sched.unschedule(jobid=123)
+    #sched.unschedule(jobid=every_j2.id)
+    print '%s : job %s is %s' % \
+          (fname, every_j1.id, sched.get_job(every_j1.id))
+    sched.unschedule_where(trigger='after', func=func)
     sched.unschedule(func=func)
     sched.unschedule(func=dec_cron)
     #sched.unschedule(func=dec_after)
@@ -243,12 +316,49 @@ def unschedule_func(*args):
     #sched.unschedule(func=dec_at)
     sched.unschedule(func=dec_print_scheduled_jobs)
     sched.unschedule(func=dec_print_scheduled_jobs_list)
+    #sched.unschedule()
 #
 # End of Scheduler.unschedule()
 # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Scheduler.simulate()
+#
+# forecasts the runs of all the above jobs over the 
+# next 3 minutes, per 10 seconds, from their triggers 
+# and without running them (see simulate.py)
+#
+report = sched.simulate(horizon=180, bucket=10)
+print 'next 3 minutes: %d fires, at most %d per 10s (at %s)' % \
+      (report['fires'], report['peak_fires'], report['peak_fires_at'])
+#
+# End of Scheduler.simulate()
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Scheduler.subscribe()
+#
+# the outcomes of the runs (executed, error, missed) are
+# handed to the sink in batches, at most every 5 seconds,
+# on a thread of its own (see sinks.py)
+#
+def print_outcomes(events):
+    errors = sum(1 for event in events if event.exception)
+    print '%d runs, %d errors' % (len(events), errors)
+
+sched.subscribe(print_outcomes, batch_size=500, flush_interval=5)
+#
+# End of Scheduler.subscribe()
+# # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 #
 # start the scheduler
@@ -23,28 +23,40 @@ class Test:
         self.__data_transfer_timeout = 15 #seconds
     def start(self):
         try:
-            # Try to start here! 
-            # Intentionally don't wanr to start for the first 5 times
-            if self.__retry_count < self.__start_max_retries:
-                self.__retry_count += 1
-                raise Failed
-            if self.__running:
-                raise Failed
-            self.__running = True
-            print 'started successfully :)'
-            # initiate data transfer once in self.__data_transfer_timeout
-            self.__data_transfer_job = self.scheduler.every(self.transfer, 
-                                            seconds=self.__data_transfer_timeout)
-            self.scheduler.start()
+            self.__try_start()
         except Failed:
-            # log the start failure and reschedule the start()
-            print 'attempt (#%d): unable to start now.. ' \
-                  'so rescheduling to start after %d seconds' % \
-                  (self.__retry_count, self.__retry_timeout)
+            # log the start failure and let the scheduler retry 
+            # the start, every self.__retry_timeout seconds
+            print 'so retrying to start after %d seconds' % \
+                  self.__retry_timeout
             alarm_time = datetime.now() + \
                          timedelta(seconds=self.__retry_timeout)
-            self.scheduler.at(self.start, alarm_time)
-            self.scheduler.start()
+            # a short-lived timer: kept in memory, not in the database
+            self.scheduler.at(self.__try_start, alarm_time, durable=False,
+                              max_attempts=self.__start_max_retries,
+                              retry_backoff=self.__retry_timeout,
+                              retry_max_backoff=self.__retry_timeout,
+                              retry_jitter=0, retry_on=Failed)
+        self.scheduler.start()
+        # in standalone mode, start() returns once no job is
+        # left: the retries of the start must have run first
+        if not self.__running and not self.scheduler.is_running():
+            print 'unable to start after %d attempts' % self.__retry_count
+    def __try_start(self):
+        # Try to start here! 
+        # Intentionally don't wanr to start for the first 5 times
+        if self.__retry_count < self.__start_max_retries:
+            self.__retry_count += 1
+            print 'attempt (#%d): unable to start now.. ' % \
+                  self.__retry_count
+            raise Failed
+        if self.__running:
+            return
+        self.__running = True
+        print 'started successfully :)'
+        # initiate data transfer once in self.__data_transfer_timeout
+        self.__data_transfer_job = self.scheduler.every(self.transfer, 
+                                        seconds=self.__data_transfer_timeout)
     def stop(self):
         if self.__running:
             self.__running = False